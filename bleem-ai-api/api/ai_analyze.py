@@ -2,16 +2,17 @@
 图片上传 API
 """
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pathlib import Path
 import uuid
 import os
+import json
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
-from services.local_segment import remove_background
-from services.removebg import remove_background_api
-from services.llm_compatible import analyze_clothes_openai, analyze_items_openai
-from storage.db_mysql import get_api_config,update_api_count
+from services.segment_engine import SegmentQueueFullError
+from services.analyze_pipeline import analyze_and_store_clothes_image, analyze_items_image, analyze_clothes_batch, BATCH_MAX_FILES
+from domain.clothes import ClothesSemantics
 
 router = APIRouter()
 
@@ -28,9 +29,25 @@ class ClotheItem(BaseModel):
     usage_semantics: List[str]
     color_semantics: str
     description: str
+    image_hash: Optional[str] = None  # 去背景图片在 blob 存储中的内容哈希，保存衣物时引用
     created_at: datetime
 
 
+def _to_clothe_item(semantics: ClothesSemantics, image_hash: Optional[str] = None) -> ClotheItem:
+    """语义分析结果转换为返回给前端的衣物信息"""
+    return ClotheItem(
+        category=semantics.category,
+        item=semantics.item,
+        style_semantics=semantics.style_semantics,
+        season_semantics=semantics.season_semantics,
+        usage_semantics=semantics.usage_semantics,
+        color_semantics=semantics.color_semantics,
+        description=semantics.description,
+        image_hash=image_hash,
+        created_at=datetime.now()
+    )
+
+
 @router.post("/clothe_analyze", response_model=ClotheItem)
 async def clothe_analyze(
     file: UploadFile = File(...)
@@ -42,8 +59,8 @@ async def clothe_analyze(
     1. 接收图片
     2. 根据配置使用 rembg 或 remove.bg API 去除背景
     3. 使用 LLM Vision 进行语义分析
-    4. 保存到数据库
-    5. 返回衣物信息
+    4. 去背景图片写入 blob 存储，后台预生成常用尺寸的缩略图
+    5. 返回衣物信息（含 image_hash）
     """
     # 验证文件类型
     if not file.content_type or not file.content_type.startswith("image/"):
@@ -53,54 +70,14 @@ async def clothe_analyze(
         raw_bytes = await file.read()
         print(f"📥 接收到文件: {file.filename}, 大小: {len(raw_bytes)} bytes")
 
-        removebg_type = os.getenv("REMOVEBG_TYPE", "local")
-        # 根据配置选择背景移除方式
-        if removebg_type ==  "local":
-            print("🎨 使用本地 rembg 处理...")
-            processed_bytes = remove_background(raw_bytes)
-        else:
-            # 使用 remove.bg API
-            try:
-                # 加载配置
-                api_configs = await get_api_config("removebg")
-                api_config = api_configs[0]
-                print(f"当前运行的api：{api_config}")
-                print("🎨 使用 remove.bg API 处理背景...")
-                processed_bytes = await remove_background_api(
-                    raw_bytes,
-                    api_config.api_base,
-                    api_config.api_key 
-                )
-                await update_api_count(api_config.id) 
-                print("🎨 使用 remove.bg API 处理背景完成")
-            except ValueError as e:
-                # 如果 remove.bg 失败，回退到本地处理
-                print(f"⚠️ remove.bg API 失败，回退到本地处理: {e}")
-                print("🎨 使用本地 rembg 处理...")
-                processed_bytes = remove_background(raw_bytes)
-    
-        # 使用 OpenAI 兼容 API 进行语义分析
-        print(f"🔍 开始语义分析，处理后图片大小: {len(processed_bytes)} bytes")
-        semantics: ClothesSemantics = await analyze_clothes_openai(processed_bytes)
-        print(f"✅ 语义分析完成: {semantics.item}")
+        # 去背景 -> 分析缓存 / 语义分析 -> 图片写入 blob 存储
+        semantics, image_hash = await analyze_and_store_clothes_image(raw_bytes)
+        print(f"💾 去背景图片已保存到 blob 存储: {image_hash}")
         
-        # 生成文件名（保留用于标识，但不再保存到磁盘）
-        filename = f"{uuid.uuid4()}.png"
-
-        # 直接将图片数据保存到数据库
-        print(f"💾 准备保存图片到数据库，文件名: {filename}")
-        
-        clothes_data = ClotheItem(
-            category=semantics.category,
-            item=semantics.item,
-            style_semantics=semantics.style_semantics,
-            season_semantics=semantics.season_semantics,
-            usage_semantics=semantics.usage_semantics,
-            color_semantics=semantics.color_semantics,
-            description=semantics.description,
-            created_at=datetime.now()
-        )
-        return clothes_data
+        return _to_clothe_item(semantics, image_hash)
+    except SegmentQueueFullError as e:
+        print(f"⚠️ {str(e)}")
+        raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试")
     except ValueError as e:
         print(f"❌ ValueError: {str(e)}")
         raise HTTPException(status_code=400, detail=f"图片分析失败: {str(e)}")
@@ -111,6 +88,59 @@ async def clothe_analyze(
         raise HTTPException(status_code=500, detail=f"服务器错误: {str(e)}")
 
 
+@router.post("/clothe_analyze/batch")
+async def clothe_analyze_batch(
+    files: List[UploadFile] = File(...)
+):
+    """
+    批量上传衣物图片
+
+    解码、去背景、语义分析三个阶段分别限制并发，每张图片完成后立即以 NDJSON 返回一行：
+        {"index": 0, "filename": "a.jpg", "ok": true, "item": {...}}
+        {"index": 1, "filename": "b.jpg", "ok": false, "error": "..."}
+    最后一行为汇总：{"done": true, "total": 2, "succeeded": 1, "failed": 1}
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="请至少上传一张图片")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"单次最多上传 {BATCH_MAX_FILES} 张图片")
+
+    # 响应开始流式返回前读取全部文件，非图片文件直接记为失败
+    items = []
+    rejected = []
+    for index, file in enumerate(files):
+        if not file.content_type or not file.content_type.startswith("image/"):
+            rejected.append({"index": index, "filename": file.filename, "ok": False, "error": "只支持图片文件"})
+            continue
+        items.append((index, file.filename, await file.read()))
+    print(f"📥 批量接收到 {len(files)} 个文件，其中图片 {len(items)} 张")
+
+    async def result_stream():
+        succeeded = 0
+        for line in rejected:
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        async for result in analyze_clothes_batch([(filename, raw) for _, filename, raw in items]):
+            line = {
+                "index": items[result["index"]][0],
+                "filename": result["filename"],
+                "ok": result["ok"],
+            }
+            if result["ok"]:
+                succeeded += 1
+                line["item"] = _to_clothe_item(result["semantics"], result["image_hash"]).model_dump(mode="json")
+            else:
+                line["error"] = result["error"]
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "done": True,
+            "total": len(files),
+            "succeeded": succeeded,
+            "failed": len(files) - succeeded
+        }) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
 @router.post("/items_analyze", response_model=dict)
 async def items_analyze(
     file: UploadFile = File(...)
@@ -133,35 +163,11 @@ async def items_analyze(
         raw_bytes = await file.read()
         print(f"📥 接收到文件: {file.filename}, 大小: {len(raw_bytes)} bytes")
 
-        removebg_type = os.getenv("REMOVEBG_TYPE", "local")
-        # 根据配置选择背景移除方式
-        if removebg_type ==  "local":
-            print("🎨 使用本地 rembg 处理...")
-            processed_bytes = remove_background(raw_bytes)
-        else:
-            # 使用 remove.bg API
-            try:
-                # 加载配置
-                api_configs = await get_api_config("removebg")
-                api_config = api_configs[0]
-                print(f"当前运行的api：{api_config}")
-                print("🎨 使用 remove.bg API 处理背景...")
-                processed_bytes = await remove_background_api(
-                    raw_bytes,
-                    api_config.api_base,
-                    api_config.api_key 
-                )
-                await update_api_count(api_config.id) 
-                print("🎨 使用 remove.bg API 处理背景完成")
-            except ValueError as e:
-                # 如果 remove.bg 失败，回退到本地处理
-                print(f"⚠️ remove.bg API 失败，回退到本地处理: {e}")
-                print("🎨 使用本地 rembg 处理...")
-                processed_bytes = remove_background(raw_bytes)
-    
-        # 使用 OpenAI 兼容 API 进行语义分析
-        print(f"🔍 开始语义分析，处理后图片大小: {len(processed_bytes)} bytes")
-        return await analyze_items_openai(processed_bytes)
+        # 分析缓存 -> 去背景 -> 物品识别
+        return await analyze_items_image(raw_bytes)
+    except SegmentQueueFullError as e:
+        print(f"⚠️ {str(e)}")
+        raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试")
     except ValueError as e:
         print(f"❌ ValueError: {str(e)}")
         raise HTTPException(status_code=400, detail=f"图片分析失败: {str(e)}")
@@ -0,0 +1,181 @@
+"""
+衣物图片 API
+按内容哈希生成强 ETag，支持 If-None-Match（304）和 Range，图片流式返回，
+单个请求的内存占用与图片大小无关；传入 w 时返回对应宽度档位的缩略图
+"""
+import mimetypes
+import os
+import re
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from services.image_variants import bucket_width, resolve_format, variant_media_type, open_variant, iter_variant
+from storage.blob_store import get_blob_store
+from storage.db_mysql import get_clothes_image_info, iter_clothes_image
+
+router = APIRouter(tags=["clothes"])
+
+# 同一衣物 ID 的图片不会变化，可长期缓存
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _media_type(filename: Optional[str]) -> str:
+    """按文件名推断图片类型，去背景后的图片默认为 PNG"""
+    media_type, _ = mimetypes.guess_type(filename or "")
+    return media_type if media_type and media_type.startswith("image/") else "image/png"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比较，忽略 W/ 前缀"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个字节区间
+
+    Returns:
+        [start, end) 区间；没有 Range 头、格式不支持或多区间时返回 None（返回完整内容）
+
+    Raises:
+        HTTPException(416): 区间超出图片大小
+    """
+    if not range_header:
+        return None
+    match = _RANGE_RE.match(range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise HTTPException(
+            status_code=416,
+            detail="请求的范围无效",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+def _stream_response(
+    request: Request,
+    size: int,
+    headers: Dict[str, str],
+    media_type: str,
+    open_stream: Callable[[int, Optional[int]], AsyncIterator[bytes]]
+) -> Response:
+    """按 Range 头返回完整内容（200）或部分内容（206）"""
+    byte_range = _parse_range(request.headers.get("range"), size)
+    headers = {**headers, "Accept-Ranges": "bytes"}
+    if byte_range is None:
+        start, end, status_code = 0, size, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["Content-Length"] = str(end - start)
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(
+        open_stream(start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
+
+
+async def _load_original(info: Dict) -> Optional[bytes]:
+    """读取原图（仅生成缩略图时调用）"""
+    if info["image_hash"]:
+        return await get_blob_store().get(info["image_hash"])
+    return b"".join([chunk async for chunk in iter_clothes_image(info["id"])])
+
+
+@router.api_route("/clothes/image/{clothes_id}", methods=["GET", "HEAD"])
+async def get_clothes_image(
+    clothes_id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=4096, description="缩略图宽度，向上取整到最近的档位"),
+    fmt: Optional[str] = Query(None, description="缩略图格式：webp / avif")
+):
+    """
+    获取衣物图片
+
+    - 强 ETag 为图片内容的 SHA-256（缩略图附加宽度档位和格式），If-None-Match 命中时返回 304
+    - 支持单区间 Range 请求（206）
+    - 本地 blob 存储通过 FileResponse 返回（服务器支持时零拷贝发送文件）；
+      S3 存储和仍保存在数据库中的旧图片分块流式返回
+    - 传入 w 时返回缩略图，首次请求时生成并缓存到磁盘；缓存文件打开后再流式返回，
+      发送过程中被淘汰删除也能读完
+    """
+    info = await get_clothes_image_info(clothes_id)
+    if not info:
+        raise HTTPException(status_code=404, detail="图片不存在")
+
+    digest = info["image_hash"] or info["data_hash"]
+    if w is not None:
+        width, variant_fmt = bucket_width(w), resolve_format(fmt)
+        etag = f'"{digest}-{width}.{variant_fmt}"'
+    else:
+        etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if w is not None:
+        try:
+            f = await open_variant(digest, width, variant_fmt, lambda: _load_original(info))
+        except Exception as e:
+            print(f"❌ 生成缩略图失败（衣物 {clothes_id}）: {e}")
+            raise HTTPException(status_code=500, detail="缩略图生成失败")
+        if f is None:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        # 从已打开的文件读取，发送前缓存条目被淘汰删除也不影响
+        size = os.fstat(f.fileno()).st_size
+        if request.method == "HEAD":
+            f.close()
+        try:
+            return _stream_response(
+                request, size, headers, variant_media_type(variant_fmt),
+                lambda start, end: iter_variant(f, start, end)
+            )
+        except HTTPException:
+            f.close()
+            raise
+
+    media_type = _media_type(info["image_filename"])
+
+    if info["image_hash"]:
+        store = get_blob_store()
+        path = store.local_path(digest)
+        if path:
+            # FileResponse 自带 Range / If-Range / HEAD 处理
+            return FileResponse(path, media_type=media_type, headers=headers)
+        size = await store.size(digest)
+        if size is None:
+            print(f"⚠️ blob 存储中缺少图片 {digest}（衣物 {clothes_id}）")
+            raise HTTPException(status_code=404, detail="图片不存在")
+        return _stream_response(
+            request, size, headers, media_type,
+            lambda start, end: store.stream(digest, start, end)
+        )
+
+    # 尚未迁移到 blob 存储的旧图片
+    return _stream_response(
+        request, info["size"], headers, media_type,
+        lambda start, end: iter_clothes_image(clothes_id, start=start, end=end)
+    )
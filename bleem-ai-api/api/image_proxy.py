@@ -1,13 +1,20 @@
 """
 图片代理服务 - 将 HTTP 图片转换为 HTTPS
+远程图片缓存到本地磁盘，同一 URL 的并发请求只下载一次，限制图片大小和内容类型
 """
 from fastapi import APIRouter, HTTPException
-import httpx
-import io
-from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
+from services.image_proxy_cache import fetch_image, ImageProxyError, IMAGE_PROXY_TTL
 
 router = APIRouter(tags=["image_proxy"])
 
+_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET",
+    "Access-Control-Allow-Headers": "*"
+}
+
+
 @router.get("/image-proxy")
 async def proxy_image(url: str):
     """
@@ -17,34 +24,22 @@ async def proxy_image(url: str):
         url: 原始图片 URL
 
     Returns:
-        图片数据
+        图片数据；缓存命中时读取已打开的缓存文件，否则边下载边返回
     """
     try:
         print(f"代理图片请求: {url}")
-
-        # 下载图片
-        async with httpx.AsyncClient(timeout=30.0, trust_env=False) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-
-            # 获取内容类型
-            content_type = response.headers.get('content-type', 'image/jpeg')
-
-            # 返回图片数据
-            return Response(
-                content=response.content,
-                media_type=content_type,
-                headers={
-                    "Cache-Control": "public, max-age=86400",  # 缓存1天
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET",
-                    "Access-Control-Allow-Headers": "*"
-                }
-            )
-
-    except httpx.HTTPError as e:
+        result = await fetch_image(url)
+    except ImageProxyError as e:
         print(f"图片代理失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to proxy image: {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         print(f"图片代理异常: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Image proxy error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Image proxy error: {str(e)}")
+
+    headers = {
+        "Cache-Control": f"public, max-age={IMAGE_PROXY_TTL}",
+        **_CORS_HEADERS
+    }
+    if "size" in result:
+        headers["Content-Length"] = str(result["size"])
+    return StreamingResponse(result["stream"], media_type=result["content_type"], headers=headers)
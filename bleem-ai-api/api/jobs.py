@@ -0,0 +1,71 @@
+"""
+异步分析任务 API
+提交图片后立即返回任务 ID，通过轮询或回调获取分析结果
+"""
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+from typing import Optional
+from services.job_queue import submit_job, check_callback_url, JobQueueFullError, JOB_KINDS
+from storage.job_store import get_job
+
+router = APIRouter(tags=["jobs"])
+
+
+@router.post("/jobs", status_code=202)
+async def create_analyze_job(
+    file: UploadFile = File(...),
+    kind: str = Form("clothes"),
+    callback_url: Optional[str] = Form(None)
+):
+    """
+    提交异步分析任务
+
+    参数:
+        file: 图片文件
+        kind: clothes（衣物语义分析，同 /clothe_analyze）或 items（物品识别，同 /items_analyze）
+        callback_url: 可选，任务结束后以 POST JSON 发送 {job_id, kind, status, result, error}；
+            只允许公网地址，或 JOB_CALLBACK_ALLOWED_HOSTS 中的主机
+
+    返回:
+        202 与任务 ID，通过 GET /api/jobs/{job_id} 查询状态
+    """
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"不支持的任务类型: {kind}")
+    if callback_url:
+        try:
+            await check_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="只支持图片文件")
+
+    raw_bytes = await file.read()
+    print(f"📥 接收到异步任务文件: {file.filename}, 大小: {len(raw_bytes)} bytes")
+    try:
+        job_id = await submit_job(kind, raw_bytes, callback_url)
+    except JobQueueFullError as e:
+        print(f"⚠️ {str(e)}")
+        raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试")
+
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued"},
+        headers={"Location": f"/api/jobs/{job_id}"}
+    )
+
+
+@router.get("/jobs/{job_id}")
+async def get_analyze_job(job_id: str):
+    """
+    查询异步分析任务
+
+    返回:
+        status: queued / running / succeeded / failed
+        result: 成功时的分析结果（衣物任务包含去背景图片的 image_hash）
+        error: 失败原因
+    """
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    job.pop("callback_url", None)
+    return job
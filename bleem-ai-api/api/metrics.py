@@ -0,0 +1,63 @@
+"""
+运行指标 API
+汇总各服务模块的计数器，便于观察连接复用、缓存命中等情况
+"""
+from fastapi import APIRouter
+from services.http_client import get_http_client_stats
+from services.segment_engine import get_segment_engine_stats
+from services.analysis_cache import get_analysis_cache_stats
+from services.segment_cache import get_segment_cache_stats
+from services.image_preprocess import get_image_preprocess_stats
+from services.provider_router import get_router_stats
+from services.retry_policy import get_retry_stats
+from services.hedging import get_hedge_stats
+from services.llm_stream import get_llm_stream_stats
+from services.job_queue import get_job_queue_stats
+from services.image_variants import get_image_variant_stats
+from services.image_proxy_cache import get_image_proxy_stats
+from services.weather import get_weather_cache_stats
+from services.weather_prefetch import get_weather_prefetch_stats
+from storage.blob_store import get_blob_store_stats
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    获取服务运行指标
+
+    返回:
+        http_clients: 各上游的请求数、新建连接数、TLS 握手数、复用次数
+        segment_engine: 背景移除进程池的排队、拒绝及各工作进程耗时
+        analysis_cache: 图片分析结果缓存的命中/未命中次数
+        segment_cache: 去背景感知哈希缓存的条目数、占用空间及命中情况
+        image_preprocess: 发送给 LLM 前图片压缩节省的字节数
+        providers: 各 API Key 的在途请求、延迟/错误率 EWMA 及熔断状态
+        retries: 各上游的重试次数、遵循 Retry-After 次数及放弃原因
+        hedging: 对冲请求的触发延迟、触发次数及主/对冲请求胜出次数
+        llm_stream: 流式分析的请求数及 JSON 闭合后提前断开的次数
+        jobs: 异步分析任务的队列深度、排队等待时间与执行时间
+        blob_store: 图片 blob 存储的写入、去重命中、读取次数及字节数
+        image_variants: 缩略图缓存的条目数、占用空间、命中、生成及淘汰次数
+        image_proxy: 图片代理缓存的命中、重新验证、合并请求、拒绝及淘汰次数
+        weather_cache: 实时天气缓存的命中、过期命中、未命中、合并请求及上游请求次数
+        weather_prefetch: 天气预取的执行次数、刷新/跳过/失败的位置数及下次执行时间
+    """
+    return {
+        "http_clients": get_http_client_stats(),
+        "segment_engine": get_segment_engine_stats(),
+        "analysis_cache": get_analysis_cache_stats(),
+        "segment_cache": get_segment_cache_stats(),
+        "image_preprocess": get_image_preprocess_stats(),
+        "providers": get_router_stats(),
+        "retries": get_retry_stats(),
+        "hedging": get_hedge_stats(),
+        "llm_stream": get_llm_stream_stats(),
+        "jobs": await get_job_queue_stats(),
+        "blob_store": get_blob_store_stats(),
+        "image_variants": get_image_variant_stats(),
+        "image_proxy": get_image_proxy_stats(),
+        "weather_cache": get_weather_cache_stats(),
+        "weather_prefetch": get_weather_prefetch_stats(),
+    }
@@ -3,9 +3,11 @@ AI穿搭推荐 API 路由
 基于天气的智能穿搭推荐
 """
 from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import StreamingResponse
 from typing import Optional
+import json
 from services.weather import get_weather
-from services.recommendation import get_ai_recommendation
+from services.recommendation import get_ai_recommendation, stream_ai_recommendation
 from pydantic import BaseModel
 from api.auth import get_current_user_from_token
 
@@ -56,3 +58,42 @@ async def get_outfit_recommendation(
     recommendation = await get_ai_recommendation(weather,user_id)
     print(f"👔 用户 {user_id} 获取穿搭推荐，位置: {location},推荐: {recommendation}")
     return recommendation
+
+
+@router.get("/recommendation/stream")
+async def stream_outfit_recommendation(
+    location: str = Query(
+        default="101020100",
+        description="LocationID 或 经纬度坐标(如 '116.41,39.92')"
+    ),
+    current_user: dict = Depends(get_current_user_from_token)
+):
+    """
+    流式获取AI穿搭推荐（Server-Sent Events）
+
+    事件顺序:
+        weather: 天气信息
+        outfit: 推荐的上衣、裤子和鞋子
+        delta: 推荐文本片段（Markdown，多次）
+        done: 结束
+    """
+    user_id = current_user["id"]
+    print(f"👔 用户 {user_id} 请求流式穿搭推荐，位置: {location}")
+    # 获取天气信息
+    weather = await get_weather(location)
+
+    if not weather:
+        raise HTTPException(status_code=500, detail="获取天气信息失败")
+
+    async def event_stream():
+        async for event in stream_ai_recommendation(weather, user_id):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁止 nginx 缓冲，保证逐段推送
+        }
+    )
@@ -29,6 +29,7 @@ class ClothesItem(BaseModel):
     color_semantics: str
     description: str
     image_url: str
+    image_hash: Optional[str] = None  # 图片内容哈希（blob 存储）
     created_at: datetime
 
 
@@ -42,7 +43,8 @@ class ClothesCreate(BaseModel):
     color_semantics: str
     description: str
     image_filename: str
-    image_data: Optional[bytes] = None  # 图片二进制数据
+    image_data: Optional[bytes] = None  # 图片二进制数据，保存时写入 blob 存储
+    image_hash: Optional[str] = None  # 已写入 blob 存储的图片内容哈希（与 image_data 二选一）
     user_id: Optional[str] = None  # 用户 ID
 
 
@@ -28,6 +28,39 @@ JSON Schema：
 如果无法判断某个字段，请填 "unknown"。数组字段如果不是 "unknown"，也必须返回包含 "unknown" 的数组，如 ["unknown"]。
 """
 
+CLOTHES_SEMANTIC_BATCH_PROMPT = """
+你是一个【服装语义理解 AI】，不是目标检测模型。
+
+本次请求按顺序包含 {count} 张图片，每张图片是一件独立的衣物，编号从 0 到 {last_index}。
+请对每张图片分别进行【语义层面的理解】，不要描述像素、位置或背景，也不要把不同图片的信息混在一起。
+
+目标：为智能衣橱抽取"可用于推荐和推理"的服装语义。
+
+重要：请严格按照以下 JSON Schema 返回，results 数组必须恰好包含 {count} 个元素，index 与图片顺序一一对应！
+所有数组字段必须返回数组格式，即使只有一个元素！
+特别注意：color_semantics 必须是字符串，不要返回数组！
+
+请只返回 JSON，不要任何解释。
+
+JSON Schema：
+{{
+  "results": [
+    {{
+      "index": 0,
+      "category": "top | bottom | shoes",
+      "item": "具体衣物名称，如 T恤、牛仔裤、运动鞋",
+      "style_semantics": ["风格标签，如 休闲、正式、运动"],
+      "season_semantics": ["春", "夏", "秋", "冬"],
+      "usage_semantics": ["通勤", "日常", "运动", "约会"],
+      "color_semantics": "颜色语义，如 深色系 / 浅色系 / 中性色",
+      "description": "一句话语义总结"
+    }}
+  ]
+}}
+
+如果无法判断某个字段，请填 "unknown"。数组字段如果不是 "unknown"，也必须返回包含 "unknown" 的数组，如 ["unknown"]。
+"""
+
 ITEMS_ANALYZE_PROMPT = """
 你是一个专业的物品识别与信息提取助手。请分析用户上传的图片，识别其中的物品并提供详细的结构化信息。
 
@@ -19,7 +19,8 @@ CREATE TABLE IF NOT EXISTS clothes (
     color_semantics VARCHAR(50) COMMENT '颜色语义，如 深色系 / 浅色系 / 中性色',
     description TEXT COMMENT '一句话语义总结',
     image_filename VARCHAR(255) NOT NULL COMMENT '上传的图片文件名',
-    image_data LONGBLOB COMMENT '图片二进制数据',
+    image_data LONGBLOB COMMENT '图片二进制数据（旧数据，新图片保存在 blob 存储中）',
+    image_hash CHAR(64) NULL COMMENT '图片内容哈希（SHA-256），对应 blob 存储中的对象',
     del_flag TINYINT DEFAULT 0 COMMENT '删除标志',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '记录创建时间'
 ) ENGINE=InnoDB
@@ -34,6 +35,19 @@ CREATE INDEX idx_clothes_category ON clothes(category);
 -- CREATE INDEX idx_clothes_created_at ON clothes(created_at);
 -- CREATE INDEX idx_clothes_item ON clothes(item(50));
 
+-- 衣物季节索引（由 clothes.season_semantics 展开，推荐时按 用户+季节+分类 筛选）
+CREATE TABLE IF NOT EXISTS clothes_season (
+    clothes_id INT NOT NULL COMMENT '衣物ID',
+    user_id INT NOT NULL COMMENT '用户ID（冗余，便于按用户筛选）',
+    category VARCHAR(50) NOT NULL COMMENT '衣物分类（冗余）：top, bottom, shoes',
+    season VARCHAR(20) NOT NULL COMMENT '季节：春、夏、秋、冬',
+    PRIMARY KEY (clothes_id, season),
+    INDEX idx_clothes_season_user (user_id, season, category)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_unicode_ci
+COMMENT='衣物季节索引';
+
 -- API 配置
 CREATE TABLE IF NOT EXISTS api_config (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -47,4 +61,17 @@ CREATE TABLE IF NOT EXISTS api_config (
 ) ENGINE=InnoDB
 DEFAULT CHARSET=utf8mb4
 COLLATE=utf8mb4_unicode_ci
-COMMENT='API 配置';
\ No newline at end of file
+COMMENT='API 配置';
+
+-- 图片分析结果缓存（ANALYSIS_CACHE_PERSIST=mysql 时使用）
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    cache_key CHAR(64) NOT NULL PRIMARY KEY COMMENT '图片哈希+Prompt+模型 的 SHA-256',
+    kind VARCHAR(20) NOT NULL COMMENT '结果类型：clothes, items',
+    result LONGTEXT NOT NULL COMMENT '识别结果 JSON',
+    expires_at BIGINT NOT NULL COMMENT '过期时间（Unix 时间戳）',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '记录创建时间',
+    INDEX idx_analysis_cache_expires (expires_at)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_unicode_ci
+COMMENT='图片分析结果缓存';
@@ -1,6 +1,7 @@
 """
 AI 智能衣橱 - FastAPI 后端入口
 """
+import os
 from fastapi import FastAPI
 from dotenv import load_dotenv
 
@@ -19,8 +20,15 @@ from pathlib import Path
 # from api.recommendation import router as recommendation_router
 # from api.auth import router as auth_router
 from api.ai_analyze import router as ai_analyze_router
-from storage.db_mysql import init_db
+from api.metrics import router as metrics_router
+from api.jobs import router as jobs_router
+from api.clothes_image import router as clothes_image_router
+from storage.db_mysql import init_db, start_api_usage_flusher, stop_api_usage_flusher
 from storage.db_config import close_mysql_pool, DB_TYPE
+from services.http_client import init_http_clients, close_http_clients
+from services.segment_engine import start_segment_engine, stop_segment_engine
+from services.job_queue import start_job_workers, stop_job_workers
+from services.weather_prefetch import start_weather_prefetcher, stop_weather_prefetcher
 
 
 @asynccontextmanager
@@ -29,8 +37,26 @@ async def lifespan(app: FastAPI):
     # 启动时初始化数据库
     await init_db()
     print(f"✅ 数据库初始化完成 (使用 {DB_TYPE.upper()})")
+    # 启动 API 使用次数批量写回任务
+    start_api_usage_flusher()
+    # 创建共享的 HTTP 连接池
+    await init_http_clients()
+    # 启动背景移除进程池（仅本地 rembg 模式需要）
+    if os.getenv("REMOVEBG_TYPE", "local") == "local":
+        await start_segment_engine()
+    # 启动异步分析任务的工作协程
+    await start_job_workers()
+    # 启动早高峰前的天气预取定时任务
+    start_weather_prefetcher()
     yield
     # 关闭时的清理工作
+    await stop_weather_prefetcher()
+    await stop_job_workers()
+    await stop_segment_engine()
+    # 在关闭连接池前写回剩余的 API 使用次数
+    await stop_api_usage_flusher()
+    await close_http_clients()
+    print("✅ HTTP 连接池已关闭")
     if DB_TYPE == "mysql":
         await close_mysql_pool()
         print("✅ MySQL 连接池已关闭")
@@ -61,6 +87,9 @@ app.add_middleware(
 # app.include_router(weather_router, prefix="/api")
 # app.include_router(recommendation_router, prefix="/api")
 app.include_router(ai_analyze_router,prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+app.include_router(clothes_image_router, prefix="/api")
+app.include_router(metrics_router, prefix="/api")
 # 打印所有注册的路由用于调试
 print("\n=== FastAPI 应用路由列表 ===")
 for route in app.routes:
@@ -84,7 +113,12 @@ async def api_info():
             "delete_clothes": "DELETE /api/clothes/{id}",
             "weather": "GET /api/weather",
             "weather_suggestion": "GET /api/weather/suggestion",
-            "ai_recommendation": "GET /api/recommendation"
+            "ai_recommendation": "GET /api/recommendation",
+            "ai_recommendation_stream": "GET /api/recommendation/stream",
+            "clothe_analyze_batch": "POST /api/clothe_analyze/batch",
+            "analyze_job": "POST /api/jobs",
+            "analyze_job_status": "GET /api/jobs/{job_id}",
+            "metrics": "GET /api/metrics"
         }
     }
 
@@ -0,0 +1,75 @@
+"""
+衣橱列表查询基准测试
+对比 SELECT *（包含 image_data）与显式字段投影在一次衣橱列表查询中从 MySQL 传输的字节数和耗时
+
+用法（在 bleem-ai-api 目录下）:
+    python scripts/bench_clothes_listing.py --user-id 1 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import aiomysql
+from storage.db_config import DB_CONFIG
+from storage.db_mysql import _clothes_columns
+
+QUERIES = {
+    "SELECT *": "SELECT * FROM clothes WHERE del_flag = 0 and user_id = %s ORDER BY created_at DESC",
+    "显式投影": f"SELECT {_clothes_columns()} FROM clothes WHERE del_flag = 0 and user_id = %s ORDER BY created_at DESC",
+}
+
+
+async def _bytes_sent(cursor) -> int:
+    """服务端向当前连接发送的累计字节数"""
+    await cursor.execute("SHOW SESSION STATUS LIKE 'Bytes_sent'")
+    row = await cursor.fetchone()
+    return int(row[1])
+
+
+async def _measure(conn, sql: str, user_id: str):
+    """执行一次查询，返回 (行数, 传输字节数, 耗时秒)"""
+    async with conn.cursor() as cursor:
+        before = await _bytes_sent(cursor)
+        # 状态查询本身的响应大小，用于从差值中扣除
+        baseline = await _bytes_sent(cursor) - before
+        start = time.perf_counter()
+        await cursor.execute(sql, (user_id,))
+        rows = await cursor.fetchall()
+        elapsed = time.perf_counter() - start
+        after = await _bytes_sent(cursor)
+    return len(rows), after - before - 2 * baseline, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="衣橱列表查询传输量基准测试")
+    parser.add_argument("--user-id", required=True, help="要查询的用户ID")
+    parser.add_argument("--rounds", type=int, default=5, help="每种查询执行的次数")
+    args = parser.parse_args()
+
+    conn = await aiomysql.connect(**DB_CONFIG["mysql"])
+    try:
+        results = {}
+        for name, sql in QUERIES.items():
+            samples = [await _measure(conn, sql, args.user_id) for _ in range(args.rounds)]
+            rows = samples[0][0]
+            sent = min(s[1] for s in samples)
+            elapsed = sorted(s[2] for s in samples)[len(samples) // 2]
+            results[name] = sent
+            print(f"{name:8} 行数 {rows:5d}  传输 {sent / 1024:10.1f} KB  耗时(中位数) {elapsed * 1000:8.1f} ms")
+        old, new = results["SELECT *"], results["显式投影"]
+        if new:
+            print(f"📉 传输量减少 {(1 - new / old) * 100:.1f}%（{old / new:.1f} 倍）")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
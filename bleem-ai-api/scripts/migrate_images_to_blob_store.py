@@ -0,0 +1,92 @@
+"""
+把 clothes.image_data 中的旧图片迁移到 blob 存储
+按 ID 顺序分批处理，每张图片分块读出、写入 blob 存储并校验后再记录哈希、清空 image_data。
+可随时中断，再次运行时从未迁移的记录继续
+
+用法（在 bleem-ai-api 目录下）:
+    python scripts/migrate_images_to_blob_store.py --batch-size 50 --sleep 0.5
+    python scripts/migrate_images_to_blob_store.py --dry-run
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from storage.blob_store import get_blob_store, compute_digest, BLOB_STORE_TYPE
+from storage.db_config import close_mysql_pool
+from storage.db_mysql import (
+    init_db,
+    iter_clothes_image,
+    list_clothes_with_inline_images,
+    set_clothes_image_hash,
+)
+from services.http_client import close_http_clients
+
+
+async def _migrate_one(clothes_id: int, keep_data: bool, dry_run: bool) -> int:
+    """迁移一张图片，返回字节数"""
+    data = b"".join([chunk async for chunk in iter_clothes_image(clothes_id)])
+    if dry_run:
+        return len(data)
+
+    store = get_blob_store()
+    digest = await store.put(data)
+    # 确认对象已完整写入后再修改数据库
+    if digest != compute_digest(data) or await store.size(digest) != len(data):
+        raise ValueError(f"blob 存储校验失败: {digest}")
+    await set_clothes_image_hash(clothes_id, digest, clear_data=not keep_data)
+    return len(data)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="迁移衣物图片到 blob 存储")
+    parser.add_argument("--batch-size", type=int, default=50, help="每批处理的记录数")
+    parser.add_argument("--sleep", type=float, default=0.5, help="批次之间的间隔（秒），减轻数据库压力")
+    parser.add_argument("--limit", type=int, default=0, help="最多迁移的记录数（0 表示全部）")
+    parser.add_argument("--keep-data", action="store_true", help="记录哈希但保留 image_data")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写入")
+    args = parser.parse_args()
+
+    await init_db()
+    print(f"🚚 开始迁移图片到 blob 存储 ({BLOB_STORE_TYPE}){'（试运行）' if args.dry_run else ''}")
+
+    migrated, failed, total_bytes = 0, 0, 0
+    last_id = 0
+    start = time.monotonic()
+    try:
+        while True:
+            batch_size = args.batch_size
+            if args.limit:
+                batch_size = min(batch_size, args.limit - migrated - failed)
+                if batch_size <= 0:
+                    break
+            ids = await list_clothes_with_inline_images(last_id, batch_size)
+            if not ids:
+                break
+            for clothes_id in ids:
+                try:
+                    total_bytes += await _migrate_one(clothes_id, args.keep_data, args.dry_run)
+                    migrated += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"❌ 迁移衣物 {clothes_id} 失败: {e}")
+            last_id = ids[-1]
+            print(f"📦 已处理到 ID {last_id}: 成功 {migrated}, 失败 {failed}, 共 {total_bytes / 1024 / 1024:.1f} MB")
+            await asyncio.sleep(args.sleep)
+    finally:
+        await close_mysql_pool()
+        await close_http_clients()
+
+    print(f"✅ 迁移结束: 成功 {migrated}, 失败 {failed}, 共 {total_bytes / 1024 / 1024:.1f} MB, "
+          f"耗时 {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
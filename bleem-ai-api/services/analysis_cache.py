@@ -0,0 +1,132 @@
+"""
+图片分析结果缓存
+按 图片内容哈希 + Prompt + 模型 缓存 LLM 识别结果，同一张图片重复上传时直接返回，
+跳过背景移除和 LLM 调用。本地 LRU（带 TTL）+ 可选的 SQLite / MySQL 持久层
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+# 本地 LRU 容量与过期时间（秒）
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "512"))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "86400"))
+# 持久层：none / sqlite / mysql
+ANALYSIS_CACHE_PERSIST = os.getenv("ANALYSIS_CACHE_PERSIST", "none").lower()
+
+# cache_key -> (过期时间, 结果)
+_lru: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_stats: Dict[str, int] = {
+    "memory_hits": 0,
+    "persistent_hits": 0,
+    "misses": 0,
+    "writes": 0,
+    "evictions": 0,
+    "errors": 0,
+}
+
+
+def make_cache_key(image_bytes: bytes, prompt: str, model: str) -> str:
+    """
+    生成缓存键
+
+    Args:
+        image_bytes: 原始上传图片的字节数据
+        prompt: 分析使用的 Prompt
+        model: 分析使用的模型名称
+
+    Returns:
+        64 位十六进制 SHA-256 字符串
+    """
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{image_hash}:{prompt_hash}:{model}".encode("utf-8")).hexdigest()
+
+
+def _persistent_backend():
+    """按配置返回持久层模块，未启用时返回 None"""
+    if ANALYSIS_CACHE_PERSIST == "mysql":
+        from storage import db_mysql
+        return db_mysql
+    if ANALYSIS_CACHE_PERSIST == "sqlite":
+        from storage import cache_sqlite
+        return cache_sqlite
+    return None
+
+
+def _put_local(cache_key: str, result: Dict[str, Any], expires_at: float):
+    _lru[cache_key] = (expires_at, result)
+    _lru.move_to_end(cache_key)
+    while len(_lru) > ANALYSIS_CACHE_SIZE:
+        _lru.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+async def get_cached_analysis(cache_key: str) -> Optional[Dict[str, Any]]:
+    """
+    读取缓存的分析结果
+
+    Returns:
+        缓存的结果字典（ClothesSemantics 的字段或物品识别结果），未命中返回 None
+    """
+    now = time.time()
+    entry = _lru.get(cache_key)
+    if entry is not None:
+        expires_at, result = entry
+        if expires_at > now:
+            _lru.move_to_end(cache_key)
+            _stats["memory_hits"] += 1
+            return result
+        del _lru[cache_key]
+
+    backend = _persistent_backend()
+    if backend is not None:
+        try:
+            row = await backend.get_analysis_cache(cache_key, int(now))
+            if row:
+                _put_local(cache_key, row["result"], row["expires_at"])
+                _stats["persistent_hits"] += 1
+                return row["result"]
+        except Exception as e:
+            # 持久层故障不影响正常分析流程
+            _stats["errors"] += 1
+            print(f"⚠️ 读取分析缓存失败: {e}")
+
+    _stats["misses"] += 1
+    return None
+
+
+async def set_cached_analysis(cache_key: str, kind: str, result: Dict[str, Any]) -> None:
+    """
+    写入分析结果
+
+    Args:
+        cache_key: make_cache_key 生成的缓存键
+        kind: 结果类型（clothes / items）
+        result: 可 JSON 序列化的结果字典
+    """
+    expires_at = time.time() + ANALYSIS_CACHE_TTL
+    _put_local(cache_key, result, expires_at)
+    _stats["writes"] += 1
+
+    backend = _persistent_backend()
+    if backend is not None:
+        try:
+            await backend.save_analysis_cache(cache_key, kind, result, int(expires_at))
+        except Exception as e:
+            _stats["errors"] += 1
+            print(f"⚠️ 写入分析缓存失败: {e}")
+
+
+def get_analysis_cache_stats() -> Dict[str, Any]:
+    """获取缓存命中统计"""
+    hits = _stats["memory_hits"] + _stats["persistent_hits"]
+    total = hits + _stats["misses"]
+    return {
+        "size": len(_lru),
+        "capacity": ANALYSIS_CACHE_SIZE,
+        "persist": ANALYSIS_CACHE_PERSIST,
+        **_stats,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+    }
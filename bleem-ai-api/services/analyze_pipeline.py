@@ -0,0 +1,318 @@
+"""
+衣物图片分析流水线
+单张分析、批量分析与异步任务共用：分析缓存 -> 去背景（感知哈希缓存 / rembg / remove.bg）-> LLM 语义分析
+-> 去背景图片写入 blob 存储。
+批量分析按 解码、去背景、LLM 三个阶段分别限制并发，每张图片完成后立即返回结果；
+可选把多张图片合并到一次 LLM 请求中分析
+"""
+import asyncio
+import contextlib
+import io
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from PIL import Image
+from domain.clothes import ClothesSemantics
+from domain.prompts import CLOTHES_SEMANTIC_PROMPT, ITEMS_ANALYZE_PROMPT
+from services.analysis_cache import make_cache_key, get_cached_analysis, set_cached_analysis
+from services.llm_compatible import analyze_clothes_openai, analyze_clothes_multi_openai, analyze_items_openai, get_llm_model
+from services.provider_router import get_router
+from services.removebg import RemoveBgError, remove_background_api
+from services.segment_cache import lookup_segment, store_segment
+from services.image_variants import pregenerate_variants
+from services.segment_engine import submit_remove_background, SegmentQueueFullError, SEGMENT_WORKERS
+from storage.blob_store import get_blob_store
+from storage.db_mysql import update_api_count
+
+# 批量分析：单次最多图片数，以及各阶段的并发上限（所有批量请求共享）
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_DECODE_CONCURRENCY = int(os.getenv("BATCH_DECODE_CONCURRENCY", "4"))
+BATCH_SEGMENT_CONCURRENCY = int(os.getenv("BATCH_SEGMENT_CONCURRENCY", str(max(SEGMENT_WORKERS, 1))))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+# 多图合并分析：每次 LLM 请求最多包含的图片数（1 表示逐张分析），以及凑满一组前最多等待的秒数
+BATCH_LLM_GROUP_SIZE = int(os.getenv("BATCH_LLM_GROUP_SIZE", "1"))
+BATCH_LLM_GROUP_WAIT = float(os.getenv("BATCH_LLM_GROUP_WAIT", "0.5"))
+
+_decode_slots = asyncio.Semaphore(BATCH_DECODE_CONCURRENCY)
+_segment_slots = asyncio.Semaphore(BATCH_SEGMENT_CONCURRENCY)
+_llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+# 后台任务（预生成缩略图）的引用，避免任务被垃圾回收
+_background_tasks: set = set()
+
+
+async def remove_background(raw_bytes: bytes, full_resolution: bool = False) -> bytes:
+    """
+    去除背景，近似重复的图片直接复用感知哈希缓存中的结果
+
+    Args:
+        full_resolution: 是否需要原图尺寸的抠图。本地 rembg 默认只输出工作分辨率
+            （SEGMENT_WORK_EDGE），足够 LLM 分析；写入 blob 存储的图片需要原图尺寸，
+            此时只把蒙版放大回原图。感知哈希缓存只保存原图尺寸的结果，两种请求都可以复用
+    """
+    signature, cached = await lookup_segment(raw_bytes)
+    if cached is not None:
+        print("✅ 命中去背景缓存")
+        return cached
+
+    processed_bytes = await _run_background_removal(raw_bytes, full_resolution)
+    # 背景移除失败时返回的是原图，不写入缓存
+    if signature is not None and full_resolution and processed_bytes != raw_bytes:
+        await store_segment(signature, processed_bytes)
+    return processed_bytes
+
+
+async def _run_background_removal(raw_bytes: bytes, full_resolution: bool = False) -> bytes:
+    """
+    根据 REMOVEBG_TYPE 配置去除背景
+    本地 rembg 推理提交到进程池执行，remove.bg 失败时回退到本地处理
+    """
+    removebg_type = os.getenv("REMOVEBG_TYPE", "local")
+    if removebg_type ==  "local":
+        print("🎨 使用本地 rembg 处理...")
+        return await submit_remove_background(raw_bytes, full_resolution)
+
+    # 使用 remove.bg API，按健康状态在多个 Key 之间切换
+    router = get_router("removebg")
+    for api_config in await router.candidates():
+        print(f"🎨 使用 remove.bg API 处理背景 (Key {api_config.id})...")
+        started_at = router.start(api_config.id)
+        try:
+            processed_bytes = await remove_background_api(
+                raw_bytes,
+                api_config.api_base,
+                api_config.api_key
+            )
+        except (ValueError, httpx.RequestError) as e:
+            # 余额不足、Key 无效、网络错误等都切换到下一个 Key；
+            # 只有 429 / 5xx / 网络错误触发熔断，400 / 402 / 403 不会
+            status_code = e.status_code if isinstance(e, RemoveBgError) else None
+            router.finish(api_config.id, started_at, ok=False, status_code=status_code)
+            print(f"⚠️ remove.bg API 失败: {e}")
+            continue
+        router.finish(api_config.id, started_at, ok=True)
+        await update_api_count(api_config.id)
+        print("🎨 使用 remove.bg API 处理背景完成")
+        return processed_bytes
+
+    # 所有 Key 都失败时回退到本地处理
+    print("⚠️ remove.bg API 不可用，回退到本地处理")
+    print("🎨 使用本地 rembg 处理...")
+    return await submit_remove_background(raw_bytes, full_resolution)
+
+
+def _parse_cached_clothes(cached: Dict[str, Any]) -> Tuple[ClothesSemantics, Optional[str]]:
+    """缓存的衣物分析结果拆分为 (语义, 去背景图片的内容哈希)，只分析未保存图片的条目没有哈希"""
+    fields = dict(cached)
+    image_hash = fields.pop("image_hash", None)
+    return ClothesSemantics(**fields), image_hash
+
+
+async def _store_processed_image(processed_bytes: bytes) -> str:
+    """去背景后的图片写入 blob 存储，并在后台预生成常用尺寸的缩略图"""
+    image_hash = await get_blob_store().put(processed_bytes)
+    _background_tasks.add(task := asyncio.ensure_future(pregenerate_variants(image_hash, processed_bytes)))
+    task.add_done_callback(_background_tasks.discard)
+    return image_hash
+
+
+async def _analyze_and_store(
+    raw_bytes: bytes,
+    analyze: Callable[[bytes], Awaitable[ClothesSemantics]],
+    segment_slots: Optional[asyncio.Semaphore] = None
+) -> Tuple[ClothesSemantics, str]:
+    """
+    分析衣物图片并保存去背景后的图片，单张、批量和异步任务共用
+
+    Args:
+        analyze: 对去背景图片做语义分析的函数（批量分析时为合并请求的分组器）
+        segment_slots: 去背景阶段的并发限制（批量分析使用）
+    """
+    cache_key = make_cache_key(raw_bytes, CLOTHES_SEMANTIC_PROMPT, await get_llm_model())
+    semantics = None
+    cached = await get_cached_analysis(cache_key)
+    if cached is not None:
+        semantics, image_hash = _parse_cached_clothes(cached)
+        if image_hash and await get_blob_store().exists(image_hash):
+            print(f"✅ 命中分析缓存: {semantics.item}")
+            return semantics, image_hash
+
+    # 写入 blob 存储的图片使用原图尺寸，1024 等大尺寸缩略图不会受工作分辨率限制
+    async with segment_slots or contextlib.nullcontext():
+        processed_bytes = await remove_background(raw_bytes, full_resolution=True)
+    if semantics is None:
+        print(f"🔍 开始语义分析，处理后图片大小: {len(processed_bytes)} bytes")
+        semantics = await analyze(processed_bytes)
+        print(f"✅ 语义分析完成: {semantics.item}")
+    image_hash = await _store_processed_image(processed_bytes)
+    await set_cached_analysis(cache_key, "clothes", {**semantics.model_dump(), "image_hash": image_hash})
+    return semantics, image_hash
+
+
+async def analyze_and_store_clothes_image(raw_bytes: bytes) -> Tuple[ClothesSemantics, str]:
+    """
+    分析衣物图片，并把去背景后的图片写入 blob 存储、在后台预生成常用尺寸的缩略图
+
+    分析缓存中同时记录去背景图片的内容哈希：完全相同的图片再次上传时，
+    只要 blob 仍然存在就直接返回，跳过背景移除和 LLM 调用
+
+    Returns:
+        (语义分析结果, 去背景图片的内容哈希)，保存衣物时以 image_hash 引用图片，无需再次上传
+
+    Raises:
+        SegmentQueueFullError: 背景移除队列已满
+        ValueError: 分析失败
+    """
+    return await _analyze_and_store(raw_bytes, analyze_clothes_openai)
+
+
+async def analyze_items_image(raw_bytes: bytes) -> Dict[str, Any]:
+    """
+    分析单张物品图片（物品识别 Prompt）
+
+    相同图片、Prompt、模型的分析结果直接复用；否则去背景后调用 LLM 分析并写入缓存，
+    去背景图片不写入 blob 存储
+
+    Raises:
+        SegmentQueueFullError: 背景移除队列已满
+        ValueError: 分析失败
+    """
+    cache_key = make_cache_key(raw_bytes, ITEMS_ANALYZE_PROMPT, await get_llm_model())
+    cached = await get_cached_analysis(cache_key)
+    if cached is not None:
+        print("✅ 命中分析缓存")
+        return cached
+
+    # 根据配置选择背景移除方式
+    processed_bytes = await remove_background(raw_bytes)
+
+    # 使用 OpenAI 兼容 API 进行语义分析
+    print(f"🔍 开始语义分析，处理后图片大小: {len(processed_bytes)} bytes")
+    result = await analyze_items_openai(processed_bytes)
+    await set_cached_analysis(cache_key, "items", result)
+    return result
+
+
+def _verify_image(raw_bytes: bytes):
+    """检查图片能否正常解码"""
+    with Image.open(io.BytesIO(raw_bytes)) as img:
+        img.verify()
+
+
+class _LLMGrouper:
+    """
+    把去背景完成的图片攒成一组，一次请求分析多张
+
+    凑满 BATCH_LLM_GROUP_SIZE 张或等待 BATCH_LLM_GROUP_WAIT 秒后发出请求；
+    合并分析中无效的图片回退为逐张分析
+    """
+
+    def __init__(self, group_size: int, wait: float):
+        self.group_size = group_size
+        self.wait = wait
+        self.pending: List[Tuple[bytes, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks: List[asyncio.Task] = []
+
+    async def analyze(self, processed_bytes: bytes) -> ClothesSemantics:
+        if self.group_size <= 1:
+            async with _llm_slots:
+                return await analyze_clothes_openai(processed_bytes)
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((processed_bytes, future))
+        if len(self.pending) >= self.group_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        group, self.pending = self.pending, []
+        if group:
+            self.tasks.append(asyncio.ensure_future(self._run_group(group)))
+
+    async def _run_group(self, group: List[Tuple[bytes, asyncio.Future]]):
+        results: List[Optional[ClothesSemantics]] = [None] * len(group)
+        if len(group) > 1:
+            try:
+                async with _llm_slots:
+                    results = await analyze_clothes_multi_openai([image for image, _ in group])
+            except Exception as e:
+                print(f"⚠️ 多图分析失败，将逐张分析: {e}")
+
+        async def resolve(image: bytes, future: asyncio.Future, semantics: Optional[ClothesSemantics]):
+            try:
+                if semantics is None:
+                    async with _llm_slots:
+                        semantics = await analyze_clothes_openai(image)
+                if not future.done():
+                    future.set_result(semantics)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        await asyncio.gather(*(
+            resolve(image, future, semantics)
+            for (image, future), semantics in zip(group, results)
+        ))
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        for task in self.tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _analyze_batch_item(raw_bytes: bytes, grouper: _LLMGrouper) -> Tuple[ClothesSemantics, str]:
+    """按阶段并发限制分析批量中的一张图片，返回 (语义, 去背景图片的内容哈希)"""
+    async with _decode_slots:
+        try:
+            await asyncio.to_thread(_verify_image, raw_bytes)
+        except Exception as e:
+            raise ValueError(f"图片无法解码: {e}")
+
+    return await _analyze_and_store(raw_bytes, grouper.analyze, _segment_slots)
+
+
+async def analyze_clothes_batch(files: List[Tuple[str, bytes]]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    批量分析衣物图片，按完成顺序逐个返回结果
+
+    单张图片失败不影响其他图片
+
+    Args:
+        files: (文件名, 图片字节数据) 列表
+
+    Yields:
+        {"index": 序号, "filename": 文件名, "ok": True, "semantics": ClothesSemantics, "image_hash": 内容哈希}
+        或 {"index": 序号, "filename": 文件名, "ok": False, "error": 错误信息}
+    """
+    grouper = _LLMGrouper(BATCH_LLM_GROUP_SIZE, BATCH_LLM_GROUP_WAIT)
+
+    async def run(index: int, filename: str, raw_bytes: bytes) -> Dict[str, Any]:
+        try:
+            semantics, image_hash = await _analyze_batch_item(raw_bytes, grouper)
+            return {"index": index, "filename": filename, "ok": True, "semantics": semantics, "image_hash": image_hash}
+        except SegmentQueueFullError:
+            return {"index": index, "filename": filename, "ok": False, "error": "服务繁忙，请稍后重试"}
+        except Exception as e:
+            print(f"❌ 批量分析第 {index} 张图片失败: {e}")
+            return {"index": index, "filename": filename, "ok": False, "error": str(e)}
+
+    tasks = [
+        asyncio.ensure_future(run(index, filename, raw_bytes))
+        for index, (filename, raw_bytes) in enumerate(files)
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # 客户端断开时取消尚未完成的图片
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        grouper.cancel()
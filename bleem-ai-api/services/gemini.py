@@ -8,6 +8,7 @@ import re
 from dotenv import load_dotenv
 from domain.prompts import CLOTHES_SEMANTIC_PROMPT,ITEMS_ANALYZE_PROMPT
 from domain.clothes import ClothesSemantics
+from services.llm_stream import extract_json_object
 
 load_dotenv()
 
@@ -39,13 +40,10 @@ def extract_json_from_response(text: str) -> dict:
         except json.JSONDecodeError:
             pass
     
-    # 尝试找到 { } 包围的内容
-    brace_match = re.search(r'\{[\s\S]*\}', text)
-    if brace_match:
-        try:
-            return json.loads(brace_match.group())
-        except json.JSONDecodeError:
-            pass
+    # 查找第一个括号配对完整的 JSON 对象
+    result = extract_json_object(text)
+    if result is not None:
+        return result
     
     raise ValueError(f"无法从响应中提取 JSON: {text}")
 
@@ -0,0 +1,156 @@
+"""
+对冲请求（hedged requests）
+主请求超过近期延迟的指定分位数仍未返回时，向另一个 Key 再发一次相同请求，
+采用先成功返回的结果并取消另一个，用少量额外请求压低尾延迟。
+对冲比例受预算限制，避免上游整体变慢时请求量翻倍
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# 是否启用、触发分位数、样本不足时的默认等待（秒）、最少样本数、对冲请求占比上限、样本窗口
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "90"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+
+
+def _consume_exception(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
+
+
+class Hedger:
+    """按延迟分位数决定何时发出对冲请求"""
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool,
+        percentile: float,
+        default_delay: float,
+        min_samples: int,
+        max_rate: float,
+        window: int
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.latencies: "deque[float]" = deque(maxlen=window)
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "hedges_fired": 0,
+            "hedge_wins": 0,
+            "primary_wins": 0,
+            "skipped_budget": 0,
+        }
+
+    def hedge_delay(self) -> float:
+        """主请求等待多久后发出对冲请求（秒）"""
+        if len(self.latencies) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(self.latencies)
+        index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def _allow_hedge(self) -> bool:
+        """对冲请求数不超过总请求数的 max_rate"""
+        if self.stats["hedges_fired"] + 1 > self.max_rate * self.stats["requests"]:
+            self.stats["skipped_budget"] += 1
+            return False
+        return True
+
+    async def run(
+        self,
+        primary: Callable[[], Awaitable[Any]],
+        backup: Optional[Callable[[], Awaitable[Any]]],
+        accept: Callable[[Any], bool]
+    ) -> Any:
+        """
+        执行请求，必要时发出对冲请求
+
+        Args:
+            primary: 创建主请求协程的函数
+            backup: 创建对冲请求协程的函数，None 表示没有可用的备用 Key
+            accept: 判断结果是否成功；成功的结果才会胜出并取消另一个请求
+
+        Returns:
+            先成功的结果；都不成功时返回主请求的结果（主请求抛出的异常会原样抛出）
+        """
+        self.stats["requests"] += 1
+        started_at = time.monotonic()
+        primary_task = asyncio.ensure_future(primary())
+        if not self.enabled or backup is None:
+            result = await primary_task
+            self.latencies.append(time.monotonic() - started_at)
+            return result
+
+        done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_delay())
+        if done or not self._allow_hedge():
+            result = await primary_task
+            self.latencies.append(time.monotonic() - started_at)
+            return result
+
+        print(f"🔀 {self.name} 主请求超过 {self.hedge_delay():.1f} 秒未返回，发出对冲请求")
+        self.stats["hedges_fired"] += 1
+        backup_task = asyncio.ensure_future(backup())
+        for task in (primary_task, backup_task):
+            # 落败一方的异常不会被读取，避免 "Task exception was never retrieved" 警告
+            task.add_done_callback(_consume_exception)
+        pending = {primary_task, backup_task}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and accept(task.result()):
+                        if task is primary_task:
+                            self.stats["primary_wins"] += 1
+                        else:
+                            self.stats["hedge_wins"] += 1
+                        # 被对冲的主请求只知道耗时不少于当前值
+                        self.latencies.append(time.monotonic() - started_at)
+                        return task.result()
+            # 都没有成功，按主请求的结果处理
+            return primary_task.result()
+        finally:
+            for task in (primary_task, backup_task):
+                if not task.done():
+                    task.cancel()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "delay_ms": round(self.hedge_delay() * 1000),
+            "samples": len(self.latencies),
+            **self.stats,
+        }
+
+
+_hedgers: Dict[str, Hedger] = {
+    "llm": Hedger(
+        "llm",
+        enabled=LLM_HEDGE_ENABLED,
+        percentile=LLM_HEDGE_PERCENTILE,
+        default_delay=LLM_HEDGE_DEFAULT_DELAY,
+        min_samples=LLM_HEDGE_MIN_SAMPLES,
+        max_rate=LLM_HEDGE_MAX_RATE,
+        window=LLM_HEDGE_WINDOW,
+    ),
+}
+
+
+def get_hedger(name: str) -> Hedger:
+    """获取指定上游的对冲器"""
+    return _hedgers[name]
+
+
+def get_hedge_stats() -> Dict[str, Any]:
+    """获取对冲统计"""
+    return {name: hedger.to_dict() for name, hedger in _hedgers.items()}
@@ -0,0 +1,155 @@
+"""
+共享 HTTP 客户端注册表
+为每个上游（LLM、remove.bg、和风天气、图片代理、对象存储）维护一个长连接的 httpx.AsyncClient，
+由 main.py 的 lifespan 统一创建和关闭，避免每次请求都重新进行 TCP/TLS 握手
+"""
+import os
+import httpx
+from typing import Dict, Any
+
+# HTTP/2 依赖 h2 包（pip install httpx[http2]），未安装时自动回退到 HTTP/1.1
+try:
+    import h2  # noqa: F401
+    _H2_AVAILABLE = True
+except ImportError:
+    _H2_AVAILABLE = False
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and _H2_AVAILABLE
+
+# 各上游的连接池与超时配置
+# httpx 会在同一个客户端内按 (scheme, host, port) 维护独立的 keep-alive 连接池
+UPSTREAM_CONFIG: Dict[str, Dict[str, Any]] = {
+    "llm": {
+        "timeout": httpx.Timeout(60.0, connect=10.0),
+        "max_connections": int(os.getenv("HTTP_LLM_MAX_CONNECTIONS", "50")),
+        "max_keepalive_connections": int(os.getenv("HTTP_LLM_MAX_KEEPALIVE", "20")),
+        "keepalive_expiry": 60.0,
+    },
+    "removebg": {
+        "timeout": httpx.Timeout(60.0, connect=10.0),
+        "max_connections": int(os.getenv("HTTP_REMOVEBG_MAX_CONNECTIONS", "20")),
+        "max_keepalive_connections": int(os.getenv("HTTP_REMOVEBG_MAX_KEEPALIVE", "10")),
+        "keepalive_expiry": 30.0,
+    },
+    "qweather": {
+        "timeout": httpx.Timeout(10.0, connect=5.0),
+        "max_connections": int(os.getenv("HTTP_QWEATHER_MAX_CONNECTIONS", "20")),
+        "max_keepalive_connections": int(os.getenv("HTTP_QWEATHER_MAX_KEEPALIVE", "10")),
+        "keepalive_expiry": 60.0,
+    },
+    "webhook": {
+        "timeout": httpx.Timeout(10.0, connect=5.0),
+        "max_connections": int(os.getenv("HTTP_WEBHOOK_MAX_CONNECTIONS", "20")),
+        "max_keepalive_connections": int(os.getenv("HTTP_WEBHOOK_MAX_KEEPALIVE", "5")),
+        "keepalive_expiry": 30.0,
+    },
+    "image_proxy": {
+        "timeout": httpx.Timeout(30.0, connect=10.0),
+        "max_connections": int(os.getenv("HTTP_PROXY_MAX_CONNECTIONS", "50")),
+        "max_keepalive_connections": int(os.getenv("HTTP_PROXY_MAX_KEEPALIVE", "20")),
+        "keepalive_expiry": 30.0,
+    },
+    "blob": {
+        "timeout": httpx.Timeout(30.0, connect=5.0),
+        "max_connections": int(os.getenv("HTTP_BLOB_MAX_CONNECTIONS", "50")),
+        "max_keepalive_connections": int(os.getenv("HTTP_BLOB_MAX_KEEPALIVE", "20")),
+        "keepalive_expiry": 60.0,
+    },
+}
+
+# 全局客户端与统计
+_clients: Dict[str, httpx.AsyncClient] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _new_stats() -> Dict[str, int]:
+    return {
+        "requests": 0,
+        "connections_opened": 0,
+        "tls_handshakes": 0,
+        "http2_responses": 0,
+    }
+
+
+def _build_event_hooks(upstream: str) -> Dict[str, list]:
+    """
+    构建请求/响应钩子，通过 httpcore 的 trace 扩展统计新建连接和 TLS 握手次数
+    复用的连接不会触发 connect_tcp 事件，因此 复用次数 = 请求数 - 新建连接数
+    """
+    stats = _stats.setdefault(upstream, _new_stats())
+
+    async def trace(event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            stats["connections_opened"] += 1
+        elif event_name == "connection.start_tls.complete":
+            stats["tls_handshakes"] += 1
+
+    async def on_request(request: httpx.Request):
+        stats["requests"] += 1
+        request.extensions["trace"] = trace
+
+    async def on_response(response: httpx.Response):
+        if response.http_version == "HTTP/2":
+            stats["http2_responses"] += 1
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def _create_client(upstream: str) -> httpx.AsyncClient:
+    """按上游配置创建客户端"""
+    config = UPSTREAM_CONFIG.get(upstream, UPSTREAM_CONFIG["image_proxy"])
+    limits = httpx.Limits(
+        max_connections=config["max_connections"],
+        max_keepalive_connections=config["max_keepalive_connections"],
+        keepalive_expiry=config["keepalive_expiry"],
+    )
+    return httpx.AsyncClient(
+        timeout=config["timeout"],
+        limits=limits,
+        http2=HTTP2_ENABLED,
+        trust_env=False,  # 禁用环境变量中的代理设置（国内 API 走系统代理反而会连接失败）
+        event_hooks=_build_event_hooks(upstream),
+    )
+
+
+async def init_http_clients():
+    """创建所有上游的共享客户端（应用启动时调用）"""
+    for upstream in UPSTREAM_CONFIG:
+        if upstream not in _clients:
+            _clients[upstream] = _create_client(upstream)
+    print(f"✅ HTTP 客户端池已创建: {list(_clients.keys())} (HTTP/2: {HTTP2_ENABLED})")
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    """
+    获取指定上游的共享客户端
+
+    Args:
+        upstream: 上游名称（llm / removebg / qweather / webhook / image_proxy / blob）
+
+    Returns:
+        长连接的 httpx.AsyncClient，调用方不要关闭它
+    """
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        # 未经过 lifespan 初始化时（如脚本调用）按需创建
+        client = _create_client(upstream)
+        _clients[upstream] = client
+    return client
+
+
+async def close_http_clients():
+    """关闭所有共享客户端（应用关闭时调用）"""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+def get_http_client_stats() -> Dict[str, Dict[str, int]]:
+    """获取各上游的连接复用统计"""
+    result = {}
+    for upstream, stats in _stats.items():
+        item = dict(stats)
+        item["connections_reused"] = max(stats["requests"] - stats["connections_opened"], 0)
+        result[upstream] = item
+    return result
@@ -0,0 +1,102 @@
+"""
+发送给视觉 LLM 前的图片预处理
+缩放到指定最长边、将透明背景铺到中性底色上，并重新编码为 WebP / JPEG，
+减少请求体积（base64 还会再放大 33%）和图片 token 开销
+"""
+import asyncio
+import io
+import os
+from typing import Dict, Tuple
+from PIL import Image
+
+# 最长边像素、输出格式（webp / jpeg）与编码质量
+LLM_IMAGE_MAX_EDGE = int(os.getenv("LLM_IMAGE_MAX_EDGE", "1024"))
+LLM_IMAGE_FORMAT = os.getenv("LLM_IMAGE_FORMAT", "webp").lower()
+LLM_IMAGE_QUALITY = int(os.getenv("LLM_IMAGE_QUALITY", "85"))
+# 透明区域铺底颜色（R,G,B）
+LLM_IMAGE_BACKGROUND = tuple(
+    int(c) for c in os.getenv("LLM_IMAGE_BACKGROUND", "255,255,255").split(",")
+)
+
+_FORMAT_MIME = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+_stats: Dict[str, int] = {
+    "images": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+}
+
+
+def prepare_image_for_llm(image_bytes: bytes) -> Tuple[bytes, str]:
+    """
+    缩放并重新编码图片
+
+    Args:
+        image_bytes: 图片字节数据（通常是去背景后的 PNG）
+
+    Returns:
+        (编码后的字节数据, MIME 类型)；处理失败或结果更大时返回原图
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        original_mime = _FORMAT_MIME.get(img.format, "image/png")
+
+        # JPEG 可以直接按缩小尺寸解码
+        img.draft("RGB", (LLM_IMAGE_MAX_EDGE, LLM_IMAGE_MAX_EDGE))
+        img.thumbnail((LLM_IMAGE_MAX_EDGE, LLM_IMAGE_MAX_EDGE), Image.LANCZOS)
+
+        # 有透明通道时铺到中性底色上，避免部分模型把透明区域当成黑色
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", rgba.size, LLM_IMAGE_BACKGROUND)
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        buf = io.BytesIO()
+        if LLM_IMAGE_FORMAT == "jpeg":
+            img.save(buf, format="JPEG", quality=LLM_IMAGE_QUALITY, optimize=True)
+            mime_type = "image/jpeg"
+        else:
+            img.save(buf, format="WEBP", quality=LLM_IMAGE_QUALITY, method=4)
+            mime_type = "image/webp"
+        result = buf.getvalue()
+
+        if len(result) >= len(image_bytes):
+            return image_bytes, original_mime
+        return result, mime_type
+    except Exception as e:
+        print(f"⚠️ 图片预处理失败，使用原图: {e}")
+        return image_bytes, "image/png"
+
+
+async def preprocess_for_llm(image_bytes: bytes) -> Tuple[bytes, str]:
+    """
+    在线程中执行预处理并记录节省的字节数
+
+    Returns:
+        (编码后的字节数据, MIME 类型)
+    """
+    result, mime_type = await asyncio.to_thread(prepare_image_for_llm, image_bytes)
+    _stats["images"] += 1
+    _stats["bytes_in"] += len(image_bytes)
+    _stats["bytes_out"] += len(result)
+    print(
+        f"🗜️ 图片预处理: {len(image_bytes)} -> {len(result)} bytes ({mime_type}), "
+        f"节省 {len(image_bytes) - len(result)} bytes"
+    )
+    return result, mime_type
+
+
+def get_image_preprocess_stats() -> Dict[str, int]:
+    """获取预处理统计"""
+    return {
+        **_stats,
+        "bytes_saved": _stats["bytes_in"] - _stats["bytes_out"],
+    }
@@ -0,0 +1,371 @@
+"""
+图片代理缓存
+远程图片按 URL 缓存到有容量上限的磁盘目录，过期后携带 ETag / Last-Modified 向上游重新验证。
+同一 URL 的并发请求共用一次上游下载：下载任务把响应体边写入临时文件边通知等待者，
+每个请求从文件中追读并流式返回，内存占用与图片大小无关，客户端断开也不会中断下载。
+返回前先打开缓存文件，之后即使条目被淘汰删除，已打开的文件仍可读完。
+限制响应体大小和 Content-Type
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from email.utils import formatdate
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+import httpx
+from services.http_client import get_http_client
+
+# 缓存目录、容量上限（字节）、缓存有效期（秒）、单张图片大小上限（字节）
+_default_dir = Path(__file__).parent.parent / "cache" / "image_proxy"
+IMAGE_PROXY_CACHE_DIR = Path(os.getenv("IMAGE_PROXY_CACHE_DIR", _default_dir))
+IMAGE_PROXY_CACHE_MAX_BYTES = int(os.getenv("IMAGE_PROXY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+IMAGE_PROXY_TTL = int(os.getenv("IMAGE_PROXY_TTL", "86400"))
+IMAGE_PROXY_MAX_BYTES = int(os.getenv("IMAGE_PROXY_MAX_BYTES", str(10 * 1024 * 1024)))
+
+_CHUNK_SIZE = 64 * 1024
+
+# 缓存键 -> 元数据（url、content_type、etag、last_modified、size、expires_at、accessed_at）
+_index: Dict[str, Dict[str, Any]] = {}
+_index_loaded = False
+_total_bytes = 0
+# 正在进行的上游下载
+_inflight: Dict[str, "_Fetch"] = {}
+_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "revalidated": 0,
+    "stale_served": 0,
+    "coalesced": 0,
+    "fetches": 0,
+    "rejected_size": 0,
+    "rejected_type": 0,
+    "upstream_errors": 0,
+    "evictions": 0,
+}
+
+
+class ImageProxyError(Exception):
+    """代理失败，status_code 为返回给客户端的状态码"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Fetch:
+    """一次上游下载的进度，供多个请求共享"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.tmp_path = IMAGE_PROXY_CACHE_DIR / f".{key}.{id(self)}.tmp"
+        self.meta: Optional[Dict[str, Any]] = None
+        self.size = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        # 响应头校验完成（或下载失败）时触发
+        self.ready = asyncio.Event()
+        # 每写入一块数据替换为新的 Event，等待者据此追读
+        self.progress = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        progress, self.progress = self.progress, asyncio.Event()
+        progress.set()
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _body_path(key: str) -> Path:
+    return IMAGE_PROXY_CACHE_DIR / f"{key}.bin"
+
+
+def _meta_path(key: str) -> Path:
+    return IMAGE_PROXY_CACHE_DIR / f"{key}.json"
+
+
+def _scan_dir() -> Dict[str, Dict[str, Any]]:
+    """读取缓存目录中的元数据文件"""
+    IMAGE_PROXY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    entries = {}
+    for path in IMAGE_PROXY_CACHE_DIR.glob("*.json"):
+        try:
+            meta = json.loads(path.read_text())
+            if _body_path(path.stem).stat().st_size == meta["size"]:
+                entries[path.stem] = meta
+        except (OSError, ValueError, KeyError):
+            continue
+    return entries
+
+
+async def _load_index():
+    global _index_loaded, _total_bytes
+    if _index_loaded:
+        return
+    entries = await asyncio.to_thread(_scan_dir)
+    if not _index_loaded:
+        _index.update(entries)
+        _total_bytes = sum(meta["size"] for meta in _index.values())
+        _index_loaded = True
+
+
+def _remove_files(key: str):
+    for path in (_body_path(key), _meta_path(key)):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def _commit_files(fetch: _Fetch, meta: Dict[str, Any]):
+    """临时文件替换为正式缓存文件，并写入元数据"""
+    os.replace(fetch.tmp_path, _body_path(fetch.key))
+    _meta_path(fetch.key).write_text(json.dumps(meta))
+
+
+def _write_meta(key: str, meta: Dict[str, Any]):
+    _meta_path(key).write_text(json.dumps(meta))
+
+
+async def _store(key: str, meta: Dict[str, Any]):
+    """更新索引，超出容量时淘汰最久未使用的条目"""
+    global _total_bytes
+    old = _index.pop(key, None)
+    if old:
+        _total_bytes -= old["size"]
+    _index[key] = meta
+    _total_bytes += meta["size"]
+
+    evicted = []
+    if _total_bytes > IMAGE_PROXY_CACHE_MAX_BYTES:
+        for old_key, old_meta in sorted(_index.items(), key=lambda kv: kv[1]["accessed_at"]):
+            if _total_bytes <= IMAGE_PROXY_CACHE_MAX_BYTES:
+                break
+            if old_key == key or old_key in _inflight:
+                continue
+            _index.pop(old_key)
+            _total_bytes -= old_meta["size"]
+            evicted.append(old_key)
+            _stats["evictions"] += 1
+    for old_key in evicted:
+        await asyncio.to_thread(_remove_files, old_key)
+
+
+def _validate_headers(response: httpx.Response) -> str:
+    """检查 Content-Type 和 Content-Length，返回 Content-Type"""
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+    if not content_type.startswith("image/"):
+        _stats["rejected_type"] += 1
+        raise ImageProxyError(415, f"不支持的内容类型: {content_type or '未知'}")
+    content_length = response.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > IMAGE_PROXY_MAX_BYTES:
+        _stats["rejected_size"] += 1
+        raise ImageProxyError(413, f"图片过大: {content_length} bytes")
+    return content_type
+
+
+async def _run_fetch(fetch: _Fetch, url: str, stale: Optional[Dict[str, Any]]):
+    """下载（或重新验证）一个 URL，写入缓存"""
+    _stats["fetches"] += 1
+    headers = {}
+    if stale:
+        if stale.get("etag"):
+            headers["If-None-Match"] = stale["etag"]
+        if stale.get("last_modified"):
+            headers["If-Modified-Since"] = stale["last_modified"]
+
+    f = None
+    try:
+        async with get_http_client("image_proxy").stream("GET", url, headers=headers) as response:
+            now = time.time()
+            if response.status_code == 304 and stale:
+                meta = {**stale, "expires_at": now + IMAGE_PROXY_TTL, "accessed_at": now}
+                await asyncio.to_thread(_write_meta, fetch.key, meta)
+                _index[fetch.key] = meta
+                fetch.meta = meta
+                _stats["revalidated"] += 1
+                return
+            if response.status_code != 200:
+                status_code = 404 if response.status_code == 404 else 502
+                raise ImageProxyError(status_code, f"上游返回 HTTP {response.status_code}")
+
+            meta = {
+                "url": url,
+                "content_type": _validate_headers(response),
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified") or formatdate(now, usegmt=True),
+                "size": 0,
+                "expires_at": now + IMAGE_PROXY_TTL,
+                "accessed_at": now,
+            }
+            await asyncio.to_thread(IMAGE_PROXY_CACHE_DIR.mkdir, parents=True, exist_ok=True)
+            f = await asyncio.to_thread(open, fetch.tmp_path, "wb")
+            fetch.meta = meta
+            fetch.ready.set()
+
+            async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+                if fetch.size + len(chunk) > IMAGE_PROXY_MAX_BYTES:
+                    _stats["rejected_size"] += 1
+                    raise ImageProxyError(413, f"图片超过 {IMAGE_PROXY_MAX_BYTES} bytes")
+
+                def write(data: bytes = chunk):
+                    f.write(data)
+                    f.flush()
+
+                await asyncio.to_thread(write)
+                fetch.size += len(chunk)
+                fetch.notify()
+
+        await asyncio.to_thread(f.close)
+        f = None
+        meta["size"] = fetch.size
+        await asyncio.to_thread(_commit_files, fetch, meta)
+        await _store(fetch.key, meta)
+    except ImageProxyError as e:
+        fetch.error = e
+    except httpx.HTTPError as e:
+        _stats["upstream_errors"] += 1
+        fetch.error = ImageProxyError(502, f"下载图片失败: {e}")
+    except Exception as e:
+        fetch.error = e
+    finally:
+        if f is not None:
+            await asyncio.to_thread(f.close)
+        if fetch.error is not None:
+            try:
+                await asyncio.to_thread(fetch.tmp_path.unlink)
+            except OSError:
+                pass
+        fetch.done = True
+        fetch.ready.set()
+        fetch.notify()
+        _inflight.pop(fetch.key, None)
+
+
+async def _open(path: Path):
+    """打开缓存文件，不存在时返回 None"""
+    try:
+        return await asyncio.to_thread(open, path, "rb")
+    except FileNotFoundError:
+        return None
+
+
+def _forget(key: str):
+    """缓存文件已丢失时移除索引条目"""
+    global _total_bytes
+    meta = _index.pop(key, None)
+    if meta:
+        _total_bytes -= meta["size"]
+
+
+async def _read_file(f) -> AsyncIterator[bytes]:
+    """分块读取已打开的缓存文件，读完后关闭"""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, _CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def _tail(fetch: _Fetch, f) -> AsyncIterator[bytes]:
+    """从下载中的临时文件（已打开）追读数据，直到下载完成"""
+    try:
+        offset = 0
+        while True:
+            progress = fetch.progress
+            if offset < fetch.size:
+                chunk = await asyncio.to_thread(f.read, min(_CHUNK_SIZE, fetch.size - offset))
+                offset += len(chunk)
+                yield chunk
+                continue
+            if fetch.done:
+                if fetch.error is not None:
+                    # 中途失败（如超出大小限制）时中断连接，客户端不会收到不完整的图片
+                    raise fetch.error
+                return
+            await progress.wait()
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def _cached_result(meta: Dict[str, Any], f) -> Dict[str, Any]:
+    return {"content_type": meta["content_type"], "size": meta["size"], "stream": _read_file(f)}
+
+
+async def fetch_image(url: str) -> Dict[str, Any]:
+    """
+    获取代理图片
+
+    Returns:
+        {"content_type", "size", "stream"}：缓存命中（或重新验证通过）时，stream 读取已打开的缓存文件；
+        {"content_type", "stream"}：正在从上游下载时，stream 从临时文件追读数据（大小未知）
+
+    Raises:
+        ImageProxyError: URL 无效、上游失败、内容类型或大小不符合要求、缓存文件丢失
+    """
+    if not url.startswith(("http://", "https://")):
+        raise ImageProxyError(400, "只支持 http(s) 图片地址")
+    await _load_index()
+
+    key = cache_key(url)
+    meta = _index.get(key)
+    now = time.time()
+    if meta and meta["url"] == url and meta["expires_at"] > now:
+        f = await _open(_body_path(key))
+        if f is not None:
+            meta["accessed_at"] = now
+            _stats["hits"] += 1
+            return _cached_result(meta, f)
+        # 文件已被删除（如刚被淘汰），按未命中处理
+        _forget(key)
+        meta = None
+
+    fetch = _inflight.get(key)
+    if fetch is not None:
+        _stats["coalesced"] += 1
+    else:
+        _stats["misses"] += 1
+        fetch = _Fetch(key)
+        _inflight[key] = fetch
+        fetch.task = asyncio.ensure_future(_run_fetch(fetch, url, meta))
+
+    await fetch.ready.wait()
+    if fetch.error is not None:
+        f = await _open(_body_path(key)) if meta else None
+        if f is not None:
+            # 重新验证失败时返回过期的缓存
+            _stats["stale_served"] += 1
+            print(f"⚠️ 图片重新验证失败，返回过期缓存: {fetch.error}")
+            return _cached_result(meta, f)
+        raise fetch.error
+
+    if not fetch.done:
+        f = await _open(fetch.tmp_path)
+        if f is not None:
+            return {"content_type": fetch.meta["content_type"], "stream": _tail(fetch, f)}
+        # 打开前下载已结束：临时文件已改名为正式缓存文件，或下载失败已被删除
+        if fetch.error is not None:
+            raise fetch.error
+
+    # 已下载完成，或上游返回 304
+    f = await _open(_body_path(key))
+    if f is None:
+        raise ImageProxyError(502, "缓存文件已丢失，请重试")
+    return _cached_result(fetch.meta, f)
+
+
+def get_image_proxy_stats() -> Dict[str, Any]:
+    """获取图片代理缓存统计"""
+    return {
+        "entries": len(_index),
+        "bytes": _total_bytes,
+        "max_bytes": IMAGE_PROXY_CACHE_MAX_BYTES,
+        "inflight": len(_inflight),
+        **_stats,
+    }
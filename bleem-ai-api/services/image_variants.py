@@ -0,0 +1,300 @@
+"""
+衣物图片缩略图 / 响应式尺寸
+按宽度档位生成 WebP（或 AVIF）缩略图，首次请求时在线程中生成，
+结果按 内容哈希 + 宽度 + 格式 保存在有容量上限的磁盘目录中，按最近使用淘汰。
+返回前先打开缓存文件，之后即使条目被淘汰删除，已打开的文件仍可读完。
+上传分析时预先生成常用尺寸
+"""
+import asyncio
+import io
+import os
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+from PIL import Image, features
+
+# 宽度档位（请求的宽度向上取整到最近的档位）、默认格式、编码质量
+IMAGE_VARIANT_WIDTHS = sorted(int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "128,256,512,1024").split(",") if w.strip())
+IMAGE_VARIANT_FORMAT = os.getenv("IMAGE_VARIANT_FORMAT", "webp")
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+# 上传分析时预先生成的宽度
+IMAGE_VARIANT_PREGENERATE = [int(w) for w in os.getenv("IMAGE_VARIANT_PREGENERATE", "256").split(",") if w.strip()]
+# 同时生成缩略图的线程数
+IMAGE_VARIANT_CONCURRENCY = int(os.getenv("IMAGE_VARIANT_CONCURRENCY", "2"))
+# 缓存目录与容量上限（字节）
+_default_dir = Path(__file__).parent.parent / "cache" / "variants"
+IMAGE_VARIANT_CACHE_DIR = Path(os.getenv("IMAGE_VARIANT_CACHE_DIR", _default_dir))
+IMAGE_VARIANT_CACHE_MAX_BYTES = int(os.getenv("IMAGE_VARIANT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_CHUNK_SIZE = 64 * 1024
+# 查找到打开之间文件被淘汰时，最多重新获取的次数
+_OPEN_ATTEMPTS = 3
+
+# 格式 -> (PIL 格式名, Content-Type)
+VARIANT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "webp": ("WEBP", "image/webp"),
+}
+if features.check("avif"):
+    VARIANT_FORMATS["avif"] = ("AVIF", "image/avif")
+
+# 文件名（不含目录）-> (文件大小, 最近访问时间)
+_index: Dict[str, Tuple[int, float]] = {}
+_index_loaded = False
+_total_bytes = 0
+# 索引在线程中读写，需要加锁
+_lock = threading.Lock()
+# 正在生成的缩略图，相同请求共用一次生成
+_inflight: Dict[str, asyncio.Future] = {}
+_render_slots = asyncio.Semaphore(IMAGE_VARIANT_CONCURRENCY)
+_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "generated": 0,
+    "pregenerated": 0,
+    "coalesced": 0,
+    "evictions": 0,
+    "errors": 0,
+}
+
+
+def bucket_width(width: int) -> int:
+    """把请求的宽度向上取整到最近的档位，超过最大档位时使用最大档位"""
+    for bucket in IMAGE_VARIANT_WIDTHS:
+        if width <= bucket:
+            return bucket
+    return IMAGE_VARIANT_WIDTHS[-1]
+
+
+def resolve_format(fmt: Optional[str]) -> str:
+    """校验格式，不支持时回退到默认格式（默认格式也不支持时使用 WebP）"""
+    fmt = (fmt or IMAGE_VARIANT_FORMAT).lower()
+    if fmt in VARIANT_FORMATS:
+        return fmt
+    return IMAGE_VARIANT_FORMAT if IMAGE_VARIANT_FORMAT in VARIANT_FORMATS else "webp"
+
+
+def variant_media_type(fmt: str) -> str:
+    return VARIANT_FORMATS[fmt][1]
+
+
+def _name_for(digest: str, width: int, fmt: str) -> str:
+    return f"{digest}-{width}.{fmt}"
+
+
+def _load_index():
+    """从缓存目录的文件重建索引"""
+    global _index_loaded, _total_bytes
+    if _index_loaded:
+        return
+    with _lock:
+        if _index_loaded:
+            return
+        IMAGE_VARIANT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for path in IMAGE_VARIANT_CACHE_DIR.iterdir():
+            if path.suffix.lstrip(".") not in VARIANT_FORMATS:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            _index[path.name] = (stat.st_size, stat.st_mtime)
+            _total_bytes += stat.st_size
+        _index_loaded = True
+
+
+def _forget(name: str):
+    global _total_bytes
+    size, _ = _index.pop(name, (0, 0.0))
+    _total_bytes -= size
+
+
+def _lookup_sync(name: str) -> Optional[str]:
+    """查找缓存文件并更新访问时间"""
+    _load_index()
+    path = IMAGE_VARIANT_CACHE_DIR / name
+    with _lock:
+        if name not in _index:
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            _forget(name)
+            return None
+        _index[name] = (_index[name][0], now)
+    return str(path)
+
+
+def _render(data: bytes, width: int, fmt: str) -> bytes:
+    """缩放并编码，保留透明通道，不放大"""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (width, width))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        if img.width > width:
+            height = max(round(img.height * width / img.width), 1)
+            img = img.resize((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        img.save(output, format=VARIANT_FORMATS[fmt][0], quality=IMAGE_VARIANT_QUALITY)
+        return output.getvalue()
+
+
+def _generate_sync(name: str, data: bytes, width: int, fmt: str) -> str:
+    """生成缩略图写入缓存目录，超出容量时淘汰最久未使用的文件"""
+    global _total_bytes
+    _load_index()
+    encoded = _render(data, width, fmt)
+    path = IMAGE_VARIANT_CACHE_DIR / name
+    tmp_path = path.with_name(f".{name}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(encoded)
+    with _lock:
+        os.replace(tmp_path, path)
+        _forget(name)
+        _index[name] = (len(encoded), time.time())
+        _total_bytes += len(encoded)
+
+        if _total_bytes > IMAGE_VARIANT_CACHE_MAX_BYTES:
+            for old_name, _ in sorted(_index.items(), key=lambda kv: kv[1][1]):
+                if _total_bytes <= IMAGE_VARIANT_CACHE_MAX_BYTES:
+                    break
+                if old_name == name:
+                    continue
+                try:
+                    (IMAGE_VARIANT_CACHE_DIR / old_name).unlink()
+                except OSError:
+                    pass
+                _forget(old_name)
+                _stats["evictions"] += 1
+    return str(path)
+
+
+async def _generate(name: str, data: bytes, width: int, fmt: str) -> str:
+    async with _render_slots:
+        path = await asyncio.to_thread(_generate_sync, name, data, width, fmt)
+    _stats["generated"] += 1
+    return path
+
+
+async def get_variant_path(
+    digest: str,
+    width: int,
+    fmt: str,
+    load_original: Callable[[], Awaitable[Optional[bytes]]]
+) -> Optional[str]:
+    """
+    获取缩略图文件路径，缓存中没有时生成
+
+    Args:
+        digest: 原图内容哈希
+        width: 宽度档位（bucket_width 的结果）
+        fmt: 格式（resolve_format 的结果）
+        load_original: 读取原图的回调，只在需要生成时调用
+
+    Returns:
+        缓存文件路径；原图不存在时返回 None
+    """
+    name = _name_for(digest, width, fmt)
+    path = await asyncio.to_thread(_lookup_sync, name)
+    if path is not None:
+        _stats["hits"] += 1
+        return path
+    _stats["misses"] += 1
+
+    while (future := _inflight.get(name)) is not None:
+        _stats["coalesced"] += 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 只有负责生成的请求被取消时才接手重新生成，自身被取消时照常退出
+            if not future.cancelled() or asyncio.current_task().cancelling():
+                raise
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[name] = future
+    try:
+        data = await load_original()
+        path = await _generate(name, data, width, fmt) if data is not None else None
+        future.set_result(path)
+        return path
+    except Exception as e:
+        _stats["errors"] += 1
+        future.set_exception(e)
+        # 没有其他等待者时避免 "exception was never retrieved" 警告
+        future.exception()
+        raise
+    finally:
+        # 生成请求被取消（CancelledError 不是 Exception）时也要结束共享的 future，
+        # 否则合并进来的等待者会一直挂起
+        if not future.done():
+            future.cancel()
+        _inflight.pop(name, None)
+
+
+async def open_variant(
+    digest: str,
+    width: int,
+    fmt: str,
+    load_original: Callable[[], Awaitable[Optional[bytes]]]
+) -> Optional[BinaryIO]:
+    """
+    获取并打开缩略图文件，缓存中没有时生成
+
+    文件在返回前打开，发送过程中条目被淘汰删除也不影响读取；
+    查找到打开之间文件已被淘汰时重新获取
+
+    Returns:
+        已打开的文件，交给 iter_variant 读取后关闭；原图不存在时返回 None
+    """
+    for _ in range(_OPEN_ATTEMPTS):
+        path = await get_variant_path(digest, width, fmt, load_original)
+        if path is None:
+            return None
+        try:
+            return await asyncio.to_thread(open, path, "rb")
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(f"缩略图文件被反复淘汰: {_name_for(digest, width, fmt)}")
+
+
+async def iter_variant(f: BinaryIO, start: int, end: int) -> AsyncIterator[bytes]:
+    """分块读取已打开的缩略图文件的 [start, end) 区间，读完后关闭"""
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def pregenerate_variants(digest: str, data: bytes, widths: Optional[List[int]] = None):
+    """预先生成常用尺寸的缩略图（上传分析时调用），失败只记录日志"""
+    fmt = resolve_format(None)
+    for width in widths or IMAGE_VARIANT_PREGENERATE:
+        width = bucket_width(width)
+        name = _name_for(digest, width, fmt)
+        if await asyncio.to_thread(_lookup_sync, name) is not None:
+            continue
+        try:
+            await _generate(name, data, width, fmt)
+            _stats["pregenerated"] += 1
+        except Exception as e:
+            _stats["errors"] += 1
+            print(f"⚠️ 预生成缩略图失败 {name}: {e}")
+
+
+def get_image_variant_stats() -> Dict[str, object]:
+    """获取缩略图缓存统计"""
+    return {
+        "entries": len(_index),
+        "bytes": _total_bytes,
+        "max_bytes": IMAGE_VARIANT_CACHE_MAX_BYTES,
+        "widths": IMAGE_VARIANT_WIDTHS,
+        "formats": list(VARIANT_FORMATS),
+        **_stats,
+    }
@@ -0,0 +1,298 @@
+"""
+异步分析任务队列
+上传后立即返回任务 ID，由服务内的工作协程从本地 SQLite 队列中取出任务执行，
+客户端轮询任务状态或通过回调地址接收结果，不再长时间占用 HTTP 连接
+"""
+import asyncio
+import ipaddress
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+from services.analyze_pipeline import analyze_and_store_clothes_image, analyze_items_image
+from services.http_client import get_http_client
+from services.retry_policy import get_retry_policy, send_with_retry
+from services.segment_engine import SegmentQueueFullError
+from storage.job_store import (
+    init_job_store,
+    enqueue_job,
+    claim_next_job,
+    finish_job,
+    count_jobs_by_status,
+    purge_finished_jobs,
+)
+
+# 工作协程数、空闲时的轮询间隔（秒）、排队任务上限、已结束任务的保留时间（秒）
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "500"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "86400"))
+# 回调地址允许的主机名（逗号分隔）；为空时允许任意公网地址，拒绝内网、回环、链路本地等地址
+JOB_CALLBACK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+# 背景移除队列已满时，任务最多等待多少秒后放弃
+JOB_SEGMENT_RETRY_TIMEOUT = float(os.getenv("JOB_SEGMENT_RETRY_TIMEOUT", "300"))
+# 记录任务结果失败时的重试次数
+JOB_FINISH_ATTEMPTS = 3
+
+JOB_KINDS = ("clothes", "items")
+
+
+class JobQueueFullError(Exception):
+    """排队任务数已达上限"""
+
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_last_purge = 0.0
+# 最近任务的排队等待时间和执行时间（秒）
+_wait_times: "deque[float]" = deque(maxlen=500)
+_run_times: "deque[float]" = deque(maxlen=500)
+_stats: Dict[str, int] = {
+    "submitted": 0,
+    "succeeded": 0,
+    "failed": 0,
+    "callbacks_sent": 0,
+    "callbacks_failed": 0,
+}
+
+
+def _get_wakeup() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+async def check_callback_url(callback_url: str) -> None:
+    """
+    校验回调地址，防止通过回调访问内网服务（SSRF）
+
+    配置了 JOB_CALLBACK_ALLOWED_HOSTS 时只允许列表中的主机；否则解析主机名，
+    任一解析结果不是公网地址（内网、回环、链路本地、保留地址等）即拒绝。
+    提交任务和发送回调前都会校验，缩小 DNS 重绑定的时间窗口
+
+    Raises:
+        ValueError: 地址无效或不允许
+    """
+    parts = urlsplit(callback_url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("回调地址必须是 http(s) URL")
+    host = parts.hostname.lower()
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        if host not in JOB_CALLBACK_ALLOWED_HOSTS:
+            raise ValueError(f"回调地址的主机不在允许列表中: {host}")
+        return
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except ValueError:
+        raise ValueError("回调地址端口无效")
+    except socket.gaierror:
+        raise ValueError(f"无法解析回调地址: {host}")
+    for *_, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            raise ValueError(f"回调地址不能指向内网或本机: {host}")
+
+
+async def submit_job(kind: str, image_bytes: bytes, callback_url: Optional[str] = None) -> str:
+    """
+    提交分析任务
+
+    Args:
+        kind: 任务类型（clothes / items）
+        image_bytes: 原始图片字节数据
+        callback_url: 任务结束后 POST 结果的地址（可选）
+
+    Returns:
+        任务 ID
+
+    Raises:
+        JobQueueFullError: 排队任务数已达上限
+    """
+    counts = await count_jobs_by_status()
+    if counts.get("queued", 0) >= JOB_MAX_QUEUED:
+        raise JobQueueFullError(f"分析任务队列已满 ({JOB_MAX_QUEUED})")
+
+    job_id = uuid.uuid4().hex
+    await enqueue_job(job_id, kind, image_bytes, callback_url)
+    _stats["submitted"] += 1
+    # 唤醒空闲的工作协程，不必等到下一次轮询
+    _get_wakeup().set()
+    print(f"📝 已提交分析任务 {job_id} ({kind})")
+    return job_id
+
+
+async def _run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """执行任务，背景移除队列已满时稍后重试，超过 JOB_SEGMENT_RETRY_TIMEOUT 仍满则任务失败"""
+    deadline = time.monotonic() + JOB_SEGMENT_RETRY_TIMEOUT
+    while True:
+        try:
+            if job["kind"] == "items":
+                return await analyze_items_image(job["image"])
+            semantics, image_hash = await analyze_and_store_clothes_image(job["image"])
+            return {**semantics.model_dump(), "image_hash": image_hash}
+        except SegmentQueueFullError:
+            if time.monotonic() >= deadline:
+                raise
+            await asyncio.sleep(1)
+
+
+async def _send_callback(job_id: str, callback_url: str, payload: Dict[str, Any]):
+    """把任务结果 POST 到回调地址"""
+    try:
+        await check_callback_url(callback_url)
+        response = await send_with_retry(
+            get_http_client("webhook"),
+            "POST",
+            callback_url,
+            get_retry_policy("webhook"),
+            json=payload
+        )
+        if response.status_code < 300:
+            _stats["callbacks_sent"] += 1
+            return
+        print(f"⚠️ 任务 {job_id} 回调失败: HTTP {response.status_code}")
+    except Exception as e:
+        print(f"⚠️ 任务 {job_id} 回调失败: {e}")
+    _stats["callbacks_failed"] += 1
+
+
+async def _finish_with_retry(job_id: str, result: Optional[Dict[str, Any]], error: Optional[str]):
+    """
+    记录任务结果，失败时重试；结果始终写不进去时尝试把任务标记为失败，
+    避免任务一直停留在 running 状态直到下次重启
+    """
+    for attempt in range(1, JOB_FINISH_ATTEMPTS + 1):
+        try:
+            await finish_job(job_id, result=result, error=error)
+            return
+        except Exception as e:
+            print(f"⚠️ 记录任务 {job_id} 结果失败 ({attempt}/{JOB_FINISH_ATTEMPTS}): {e}")
+            if attempt < JOB_FINISH_ATTEMPTS:
+                await asyncio.sleep(attempt)
+    if error is None:
+        try:
+            await finish_job(job_id, error="保存分析结果失败")
+        except Exception as e:
+            print(f"❌ 无法标记任务 {job_id} 为失败，将在下次启动时重新排队: {e}")
+
+
+async def _process(job: Dict[str, Any]):
+    """执行一个已领取的任务并记录结果"""
+    job_id = job["id"]
+    _wait_times.append(job["started_at"] - job["created_at"])
+    start = time.monotonic()
+    result, error = None, None
+    try:
+        result = await _run_job(job)
+        _stats["succeeded"] += 1
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        _stats["failed"] += 1
+        print(f"❌ 分析任务 {job_id} 失败: {error}")
+    _run_times.append(time.monotonic() - start)
+    await _finish_with_retry(job_id, result, error)
+    print(f"✅ 分析任务 {job_id} 结束，耗时 {_run_times[-1]:.1f}s")
+
+    if job["callback_url"]:
+        await _send_callback(job_id, job["callback_url"], {
+            "job_id": job_id,
+            "kind": job["kind"],
+            "status": "failed" if error else "succeeded",
+            "result": result,
+            "error": error,
+        })
+
+
+async def _purge_if_due():
+    """每小时清理一次过期的已结束任务"""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < 3600:
+        return
+    _last_purge = now
+    removed = await purge_finished_jobs(now - JOB_RETENTION)
+    if removed:
+        print(f"🧹 已清理 {removed} 个过期的分析任务")
+
+
+async def _worker(index: int):
+    """工作协程：循环领取并执行任务，队列为空时等待唤醒或轮询"""
+    wakeup = _get_wakeup()
+    while True:
+        try:
+            job = await claim_next_job()
+            if job is None:
+                await _purge_if_due()
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await _process(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 数据库暂时不可用等情况，稍后继续
+            print(f"⚠️ 任务工作协程 {index} 出错: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+async def start_job_workers():
+    """初始化任务表并启动工作协程（应用启动时调用）"""
+    if JOB_WORKERS <= 0 or _workers:
+        return
+    requeued = await init_job_store()
+    for index in range(JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker(index)))
+    print(f"✅ 分析任务队列已启动: workers={JOB_WORKERS}, 重新排队 {requeued} 个未完成任务")
+
+
+async def stop_job_workers():
+    """停止工作协程（应用关闭时调用），执行中的任务会在下次启动时重新排队"""
+    for task in _workers:
+        task.cancel()
+    for task in _workers:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _workers.clear()
+
+
+def _summarize(values) -> Dict[str, float]:
+    """p50 / p95 / max（毫秒）"""
+    if not values:
+        return {"p50_ms": 0, "p95_ms": 0, "max_ms": 0}
+    ordered = sorted(values)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000),
+        "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000),
+        "max_ms": round(ordered[-1] * 1000),
+    }
+
+
+async def get_job_queue_stats() -> Dict[str, Any]:
+    """获取队列深度、排队等待时间和执行时间统计"""
+    try:
+        counts = await count_jobs_by_status()
+    except Exception:
+        counts = {}
+    return {
+        "workers": len(_workers),
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        **_stats,
+        "wait_time": _summarize(_wait_times),
+        "run_time": _summarize(_run_times),
+    }
@@ -4,13 +4,26 @@ OpenAI 兼容 API 服务
 """
 import httpx
 import base64
+import os
 import json
 import re
 import asyncio
-from typing import List, Optional
-from domain.prompts import CLOTHES_SEMANTIC_PROMPT,ITEMS_ANALYZE_PROMPT
+from typing import List, Optional, Tuple
+from domain.prompts import CLOTHES_SEMANTIC_PROMPT, CLOTHES_SEMANTIC_BATCH_PROMPT, ITEMS_ANALYZE_PROMPT
 from domain.clothes import ClothesSemantics
+from domain.config import ApiConfig
 from storage.db_mysql import get_api_config,update_api_count
+from services.http_client import get_http_client
+from services.image_preprocess import preprocess_for_llm
+from services.provider_router import ProviderRouter, get_router
+from services.hedging import get_hedger
+from services.llm_stream import extract_json_object, read_json_from_stream
+from services.retry_policy import get_retry_policy, is_retryable_status, is_retryable_exception
+
+# 图片分析是否使用流式请求（JSON 闭合后提前断开）
+LLM_STREAM_ANALYSIS = os.getenv("LLM_STREAM_ANALYSIS", "true").lower() == "true"
+# 分析结果缓存键中的模型标识，未配置时由所有 llm 配置的模型名生成
+ANALYSIS_CACHE_MODEL = os.getenv("ANALYSIS_CACHE_MODEL", "")
 
 
 async def fetch_available_models() -> List[dict]:
@@ -35,34 +48,49 @@ async def fetch_available_models() -> List[dict]:
     url = f"{api_base}/models"
     
     try:
-        # 禁用代理设置
-        async with httpx.AsyncClient(timeout=30.0, trust_env=False) as client:
-            response = await client.get(
-                url,
-                headers={
-                    "Authorization": f"Bearer {config.api_key}",
-                    "Content-Type": "application/json",
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                models = data.get("data", [])
-                # 过滤出支持视觉的模型（通常包含 vision, gpt-4o, claude 等关键词）
-                return [
-                    {"id": m["id"], "name": m.get("name", m["id"])}
-                    for m in models
-                ]
-            else:
-                error_msg = f"API请求失败 ({response.status_code}): {response.text[:200]}"
-                print(error_msg)
-                raise Exception(error_msg)
+        # 使用共享的 LLM 客户端（已禁用代理设置）
+        client = get_http_client("llm")
+        response = await client.get(
+            url,
+            headers={
+                "Authorization": f"Bearer {llm_config.api_key}",
+                "Content-Type": "application/json",
+                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+            },
+            timeout=30.0
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            models = data.get("data", [])
+            # 过滤出支持视觉的模型（通常包含 vision, gpt-4o, claude 等关键词）
+            return [
+                {"id": m["id"], "name": m.get("name", m["id"])}
+                for m in models
+            ]
+        else:
+            error_msg = f"API请求失败 ({response.status_code}): {response.text[:200]}"
+            print(error_msg)
+            raise Exception(error_msg)
     except Exception as e:
         print(f"获取模型列表异常: {e}")
         raise Exception(f"连接异常: {str(e)}")
 
 
+async def get_llm_model() -> str:
+    """
+    获取分析结果缓存键中的模型标识
+
+    路由每次可能选择不同的 Key，第一条配置的模型不一定是实际处理请求的模型。
+    优先使用 ANALYSIS_CACHE_MODEL；未配置时使用所有 llm 配置的模型集合（排序去重），
+    所有 Key 使用同一模型时即为该模型名，混用多个模型时结果不会被标记为其中某一个模型
+    """
+    if ANALYSIS_CACHE_MODEL:
+        return ANALYSIS_CACHE_MODEL
+    llm_configs = await get_api_config("llm")
+    return ",".join(sorted({config.model for config in llm_configs if config.model}))
+
+
 def extract_json_from_response(text: str) -> dict:
     """
     从响应中提取 JSON
@@ -82,116 +110,56 @@ def extract_json_from_response(text: str) -> dict:
         except json.JSONDecodeError:
             pass
     
-    # 尝试找到 { } 包围的内容
-    brace_match = re.search(r'\{[\s\S]*\}', text)
-    if brace_match:
-        try:
-            return json.loads(brace_match.group())
-        except json.JSONDecodeError:
-            pass
+    # 查找第一个括号配对完整的 JSON 对象
+    result = extract_json_object(text)
+    if result is not None:
+        return result
     
     raise ValueError(f"无法从响应中提取 JSON: {text}")
 
 
-async def analyze_clothes_openai(image_bytes: bytes) -> ClothesSemantics:
+def _chat_url(api_base: str) -> str:
+    """确保 api_base 格式正确并拼接 chat/completions 地址"""
+    api_base = api_base.rstrip("/")
+    if not api_base.endswith("/v1"):
+        api_base = api_base + "/v1"
+    return f"{api_base}/chat/completions"
+
+
+def _build_vision_payload(model: str, prompt: str, images: List[Tuple[str, str]], max_tokens: int = 1000) -> dict:
     """
-    使用 OpenAI 兼容 API 分析衣物图片
-    
+    构建图片分析请求体
+
     Args:
-        image_bytes: 图片的字节数据
-        
-    Returns:
-        ClothesSemantics: 衣物语义信息
+        images: (base64 数据, MIME 类型) 列表，按顺序放在 Prompt 之后
     """
-    # config = load_config()
-    # 加载配置
-    
-    # 加载配置
-    llm_configs = await get_api_config("llm")
-    llm_config = llm_configs[0]
-    print(f"当前运行的api：{llm_config}")
-    if not llm_config.api_key:
-        raise ValueError("请先配置 API Key")
-    
-    # 确保 api_base 格式正确
-    api_base = llm_config.api_base.rstrip("/")
-    if not api_base.endswith("/v1"):
-        api_base = api_base + "/v1"
-    
-    url = f"{api_base}/chat/completions"
-    
-    # 将图片转换为 base64
-    image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-    
-    # 构建请求体
-    payload = {
-        "model": llm_config.model,
+    content = [
+        {
+            "type": "text",
+            "text": prompt
+        }
+    ]
+    for image_base64, mime_type in images:
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{image_base64}"
+            }
+        })
+    return {
+        "model": model,
         "messages": [
             {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": CLOTHES_SEMANTIC_PROMPT
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{image_base64}"
-                        }
-                    }
-                ]
+                "content": content
             }
         ],
-        "max_tokens": 1000
+        "max_tokens": max_tokens
     }
-    
-    # 尝试最多3次请求
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            print(f"API 请求尝试 {attempt + 1}/{max_retries} 到 {llm_config.api_base}")
-            # 创建 httpx 客户端，禁用系统代理
-            # 因为通义千问等国内API不需要代理，系统代理反而会导致连接问题
-            async with httpx.AsyncClient(
-                timeout=60.0,
-                trust_env=False  # 禁用环境变量中的代理设置
-            ) as client:
-                response = await client.post(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {llm_config.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-
-                if response.status_code != 200:
-                    error_msg = f"API 请求失败: {response.status_code} - {response.text}"
-                    print(f"{error_msg}")
-                    if attempt == max_retries - 1:
-                        raise ValueError(error_msg)
-                    print(f"⏳ 5秒后重试...")
-                    await asyncio.sleep(5)
-                    continue
-
-                # 请求成功，跳出循环
-                await update_api_count(llm_config.id) 
-                break
-
-        except httpx.RequestError as e:
-            error_msg = f"网络请求错误: {str(e)}"
-            print(f" {error_msg}")
-            if attempt == max_retries - 1:
-                raise ValueError(error_msg)
-            print(f"⏳ 5秒后重试...")
-            await asyncio.sleep(5)
-            continue
 
-    # 如果循环正常结束（所有重试都失败了）
-    if response is None:
-        raise ValueError("API 请求失败：已达到最大重试次数")
 
+def _extract_content(response: httpx.Response) -> str:
+    """从 chat/completions 响应中提取文本内容"""
     # 解析响应
     try:
         data = response.json()
@@ -209,19 +177,163 @@ async def analyze_clothes_openai(image_bytes: bytes) -> ClothesSemantics:
     try:
         content = data["choices"][0]["message"]["content"]
         print(f"AI响应内容: {content[:200]}...")
+        return content
     except (KeyError, IndexError) as e:
         print(f"提取内容失败: {str(e)}")
         raise ValueError(f"提取内容失败: {str(e)}")
 
-    # 解析 JSON
+
+async def _send_vision(
+    router: ProviderRouter,
+    client: httpx.AsyncClient,
+    llm_config: ApiConfig,
+    prompt: str,
+    images: List[Tuple[str, str]],
+    max_tokens: int,
+    timeout: httpx.Timeout
+) -> Tuple[ApiConfig, Optional[httpx.Response], str]:
+    """
+    向单个 Key 发送一次图片分析请求并记录健康状态
+
+    启用流式分析时以 stream: true 请求，JSON 对象闭合后立即断开连接，不再等待模型的多余输出；
+    上游不支持流式（返回普通 JSON）时按完整响应解析
+
+    Returns:
+        (使用的配置, 响应, 模型输出或错误信息)；网络错误时响应为 None
+    """
+    payload = _build_vision_payload(llm_config.model, prompt, images, max_tokens)
+    if LLM_STREAM_ANALYSIS:
+        payload["stream"] = True
+    started_at = router.start(llm_config.id)
     try:
-        result = extract_json_from_response(content)
-        print(f"AI分析结果: {result}")
-    except ValueError as e:
-        print(f"JSON解析失败: {str(e)}")
-        raise ValueError(f"JSON解析失败: {str(e)}")
+        # 使用共享的长连接客户端（已禁用系统代理）
+        # 因为通义千问等国内API不需要代理，系统代理反而会导致连接问题
+        async with client.stream(
+            "POST",
+            _chat_url(llm_config.api_base),
+            headers={
+                "Authorization": f"Bearer {llm_config.api_key}",
+                "Content-Type": "application/json"
+            },
+            json=payload,
+            timeout=timeout
+        ) as response:
+            content = ""
+            if response.status_code == 200 and response.headers.get("content-type", "").startswith("text/event-stream"):
+                content = await read_json_from_stream(response)
+                print(f"AI响应内容: {content[:200]}...")
+            else:
+                await response.aread()
+                if response.status_code == 200:
+                    content = _extract_content(response)
+    except asyncio.CancelledError:
+        # 对冲请求中落败的一方被取消，不计为失败
+        router.cancel(llm_config.id)
+        raise
+    except Exception as e:
+        if not is_retryable_exception(e):
+            # 200 响应但模型输出无法解析等：记为失败但不熔断，Key 本身仍然可用
+            router.finish(llm_config.id, started_at, ok=False, breaking=False)
+            raise
+        router.finish(llm_config.id, started_at, ok=False)
+        error_msg = f"网络请求错误: {str(e)}"
+        print(f" {error_msg}")
+        return llm_config, None, error_msg
+
+    if response.status_code == 200:
+        router.finish(llm_config.id, started_at, ok=True)
+        return llm_config, response, content
+
+    router.finish(llm_config.id, started_at, ok=False, status_code=response.status_code)
+    error_msg = f"API 请求失败: {response.status_code} - {response.text}"
+    print(f"{error_msg}")
+    return llm_config, response, error_msg
+
+
+async def _analyze_image(prompt: str, image_bytes: bytes) -> str:
+    """调用视觉模型分析单张图片，返回模型输出的文本"""
+    return await _analyze_images(prompt, [image_bytes])
+
+
+async def _analyze_images(prompt: str, images_bytes: List[bytes], max_tokens: int = 1000) -> str:
+    """
+    调用视觉模型分析图片（一次请求可包含多张），返回模型输出的文本
+
+    在所有 llm 配置之间路由：优先选择在途请求最少、延迟和错误率最低的 Key，
+    遇到 429 / 5xx / 网络错误时熔断当前 Key 并立即切换到下一个；
+    重试次数、Retry-After 等待和总耗时预算由 llm 重试策略控制；
+    启用对冲时，主请求过慢会同时向下一个 Key 发出请求
+
+    Args:
+        prompt: 分析 Prompt
+        images_bytes: 图片字节数据列表
+        max_tokens: 最大输出 token 数
+
+    Returns:
+        模型输出的文本内容
+    """
+    router = get_router("llm")
+    candidates = await router.candidates()
+    if not candidates:
+        raise ValueError("请先配置 API Key")
+
+    # 缩放并重新编码后再转换为 base64
+    images = []
+    for image_payload, mime_type in await asyncio.gather(*(preprocess_for_llm(b) for b in images_bytes)):
+        images.append((base64.b64encode(image_payload).decode("utf-8"), mime_type))
+
+    # 失败时优先立即切换到未尝试过的 Key；所有 Key 都试过后按退避策略等待
+    client = get_http_client("llm")
+    budget = get_retry_policy("llm").begin()
+    hedger = get_hedger("llm")
+    tried = set()
+    while True:
+        untried = [c for c in candidates if c.id not in tried]
+        llm_config = untried[0] if untried else candidates[0]
+        tried.add(llm_config.id)
+        backup_config = untried[1] if len(untried) > 1 else None
+        attempt = budget.attempt()
+        print(f"API 请求尝试 {attempt}/{budget.policy.max_attempts} 到 {llm_config.api_base} (Key {llm_config.id})")
+
+        timeout = budget.timeout(client.timeout)
+
+        def primary(config=llm_config):
+            return _send_vision(router, client, config, prompt, images, max_tokens, timeout)
+
+        def backup(config=backup_config):
+            tried.add(config.id)
+            return _send_vision(router, client, config, prompt, images, max_tokens, timeout)
+
+        # 主请求超过延迟分位数仍未返回时向备用 Key 发出对冲请求
+        used_config, response, text = await hedger.run(
+            primary,
+            backup if backup_config else None,
+            accept=lambda outcome: outcome[1] is not None and outcome[1].status_code == 200
+        )
+        if response is not None and response.status_code == 200:
+            await update_api_count(used_config.id)
+            return text
+        if response is not None and not is_retryable_status(response.status_code):
+            # 参数错误、鉴权失败等重试也不会成功
+            raise ValueError(text)
+
+        delay = budget.next_delay(response)
+        if delay is None:
+            raise ValueError(text)
+        candidates = await router.candidates() or candidates
+        if any(c.id not in tried for c in candidates):
+            continue
+        print(f"⏳ 没有其他可用的 Key，{delay:.1f} 秒后重试...")
+        await asyncio.sleep(delay)
+
 
-    # 数据清洗和标准化
+def _normalize_clothes_result(result: dict) -> ClothesSemantics:
+    """
+    数据清洗和标准化，转换为 ClothesSemantics
+
+    Raises:
+        ValueError: 缺少必需字段等无法创建语义对象时抛出
+    """
     try:
         # 处理 color_semantics - 如果是数组，转换为字符串
         if 'color_semantics' in result and isinstance(result['color_semantics'], list):
@@ -257,7 +369,7 @@ async def analyze_clothes_openai(image_bytes: bytes) -> ClothesSemantics:
         raise ValueError(f"创建语义对象失败: {str(e)}")
 
 
-async def analyze_items_openai(image_bytes: bytes) -> dict:
+async def analyze_clothes_openai(image_bytes: bytes) -> ClothesSemantics:
     """
     使用 OpenAI 兼容 API 分析衣物图片
     
@@ -267,115 +379,76 @@ async def analyze_items_openai(image_bytes: bytes) -> dict:
     Returns:
         ClothesSemantics: 衣物语义信息
     """
-    # config = load_config()
-    # 加载配置
-    
-    # 加载配置
-    llm_configs = await get_api_config("llm")
-    llm_config = llm_configs[0]
-    print(f"当前运行的api：{llm_config}")
-    if not llm_config.api_key:
-        raise ValueError("请先配置 API Key")
-    
-    # 确保 api_base 格式正确
-    api_base = llm_config.api_base.rstrip("/")
-    if not api_base.endswith("/v1"):
-        api_base = api_base + "/v1"
-    
-    url = f"{api_base}/chat/completions"
-    
-    # 将图片转换为 base64
-    image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-    
-    # 构建请求体
-    payload = {
-        "model": llm_config.model,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": ITEMS_ANALYZE_PROMPT
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{image_base64}"
-                        }
-                    }
-                ]
-            }
-        ],
-        "max_tokens": 1000
-    }
-    
-    # 尝试最多3次请求
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            print(f"API 请求尝试 {attempt + 1}/{max_retries} 到 {llm_config.api_base}")
-            # 创建 httpx 客户端，禁用系统代理
-            # 因为通义千问等国内API不需要代理，系统代理反而会导致连接问题
-            async with httpx.AsyncClient(
-                timeout=60.0,
-                trust_env=False  # 禁用环境变量中的代理设置
-            ) as client:
-                response = await client.post(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {llm_config.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-
-                if response.status_code != 200:
-                    error_msg = f"API 请求失败: {response.status_code} - {response.text}"
-                    print(f"{error_msg}")
-                    if attempt == max_retries - 1:
-                        raise ValueError(error_msg)
-                    print(f"⏳ 5秒后重试...")
-                    await asyncio.sleep(5)
-                    continue
-
-                # 请求成功，跳出循环
-                await update_api_count(llm_config.id) 
-                break
-
-        except httpx.RequestError as e:
-            error_msg = f"网络请求错误: {str(e)}"
-            print(f" {error_msg}")
-            if attempt == max_retries - 1:
-                raise ValueError(error_msg)
-            print(f"⏳ 5秒后重试...")
-            await asyncio.sleep(5)
-            continue
+    content = await _analyze_image(CLOTHES_SEMANTIC_PROMPT, image_bytes)
 
-    # 如果循环正常结束（所有重试都失败了）
-    if response is None:
-        raise ValueError("API 请求失败：已达到最大重试次数")
-
-    # 解析响应
+    # 解析 JSON
     try:
-        data = response.json()
-        print(f"API响应状态: {response.status_code}")
-    except Exception as e:
-        print(f"解析响应失败: {str(e)}")
-        raise ValueError(f"解析响应失败: {str(e)}")
+        result = extract_json_from_response(content)
+        print(f"AI分析结果: {result}")
+    except ValueError as e:
+        print(f"JSON解析失败: {str(e)}")
+        raise ValueError(f"JSON解析失败: {str(e)}")
 
-    # 检查响应格式
-    if "choices" not in data or not data["choices"]:
-        print(f"响应格式错误: {data}")
-        raise ValueError(f"响应格式错误: {data}")
+    return _normalize_clothes_result(result)
 
-    # 提取响应内容
+
+async def analyze_clothes_multi_openai(images_bytes: List[bytes]) -> List[Optional[ClothesSemantics]]:
+    """
+    一次请求分析多张衣物图片（数组输出的 Prompt），节省重复发送 Prompt 的 token 和请求次数
+
+    按 index 把结果对应回输入图片并逐条校验；整体响应无法解析、数量不符或某条结果无效时，
+    对应位置返回 None，由调用方对这些图片单独调用 analyze_clothes_openai
+
+    Args:
+        images_bytes: 图片字节数据列表
+
+    Returns:
+        与输入顺序一致的语义信息列表，无效的位置为 None
+    """
+    count = len(images_bytes)
+    results: List[Optional[ClothesSemantics]] = [None] * count
+    prompt = CLOTHES_SEMANTIC_BATCH_PROMPT.format(count=count, last_index=count - 1)
     try:
-        content = data["choices"][0]["message"]["content"]
-        print(f"AI响应内容: {content[:200]}...")
-    except (KeyError, IndexError) as e:
-        print(f"提取内容失败: {str(e)}")
-        raise ValueError(f"提取内容失败: {str(e)}")
+        content = await _analyze_images(prompt, images_bytes, max_tokens=1000 * count)
+        data = extract_json_from_response(content)
+    except ValueError as e:
+        print(f"⚠️ 多图分析失败，将逐张分析: {e}")
+        return results
+
+    items = data.get("results") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        print(f"⚠️ 多图分析结果格式错误，将逐张分析: {content[:200]}")
+        return results
+    if len(items) != count:
+        print(f"⚠️ 多图分析结果数量不符 ({len(items)}/{count})")
+
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        # 优先使用模型返回的 index，缺失时按顺序对应
+        index = item.pop("index", position)
+        if not isinstance(index, int) or not 0 <= index < count or results[index] is not None:
+            continue
+        try:
+            results[index] = _normalize_clothes_result(item)
+        except ValueError:
+            continue
+
+    print(f"✅ 多图分析完成: {sum(r is not None for r in results)}/{count} 张有效")
+    return results
+
+
+async def analyze_items_openai(image_bytes: bytes) -> dict:
+    """
+    使用 OpenAI 兼容 API 分析衣物图片
+    
+    Args:
+        image_bytes: 图片的字节数据
+        
+    Returns:
+        ClothesSemantics: 衣物语义信息
+    """
+    content = await _analyze_image(ITEMS_ANALYZE_PROMPT, image_bytes)
 
     # 解析 JSON
     try:
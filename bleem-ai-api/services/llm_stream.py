@@ -0,0 +1,127 @@
+"""
+LLM 流式响应处理
+解析 OpenAI 风格的 SSE（stream: true）响应，并在 token 流中增量查找第一个完整的 JSON 对象，
+对象闭合后即可返回结果并断开连接，不再等待（和计费）模型后续输出的多余内容
+"""
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+import httpx
+
+_stats: Dict[str, int] = {
+    "streams": 0,
+    "early_stops": 0,
+    "incomplete": 0,
+}
+
+
+async def iter_sse_content(response: httpx.Response) -> AsyncIterator[str]:
+    """解析 OpenAI 风格的 SSE 响应，逐段返回 delta.content"""
+    async for line in response.aiter_lines():
+        line = line.strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            chunk = json.loads(data)
+            content = chunk["choices"][0].get("delta", {}).get("content")
+        except (json.JSONDecodeError, KeyError, IndexError, AttributeError):
+            continue
+        if content:
+            yield content
+
+
+class IncrementalJSONParser:
+    """
+    增量查找文本中第一个完整的顶层 JSON 对象
+
+    只接受花括号深度为 0 处开始的对象；括号配对完整但解析失败的顶层对象会被整体跳过，
+    不会返回其中嵌套的子对象。逐字符跟踪花括号深度和字符串状态（忽略字符串内的括号和转义字符），
+    已扫描过的位置不会重复扫描，因此每次 feed 只处理新增的片段
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.result: Optional[Any] = None
+        self.json_text: Optional[str] = None
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> Optional[Any]:
+        """
+        追加一段文本
+
+        Returns:
+            解析出的 JSON 对象；对象尚未闭合时返回 None
+        """
+        if self.result is not None:
+            return self.result
+        self.text += chunk
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            if self._start < 0:
+                if ch == "{":
+                    self._start = i
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = text[self._start:i + 1]
+                    try:
+                        self.result = json.loads(candidate)
+                        self.json_text = candidate
+                        self._pos = i + 1
+                        return self.result
+                    except json.JSONDecodeError:
+                        # 顶层对象不是合法 JSON（如带 // 注释）时整体跳过，
+                        # 不能退回去返回其中嵌套的子对象
+                        self._start = -1
+            i += 1
+        self._pos = i
+        return None
+
+
+def extract_json_object(text: str) -> Optional[Any]:
+    """在完整文本中查找第一个合法的顶层 JSON 对象，找不到时返回 None"""
+    return IncrementalJSONParser().feed(text)
+
+
+async def read_json_from_stream(response: httpx.Response) -> str:
+    """
+    从流式响应中读取模型输出，JSON 对象闭合后立即停止读取
+
+    调用方退出 client.stream() 上下文时连接会被关闭，上游随之停止生成
+
+    Returns:
+        JSON 对象的文本；流结束仍未得到完整对象时返回全部输出文本
+    """
+    _stats["streams"] += 1
+    parser = IncrementalJSONParser()
+    async for content in iter_sse_content(response):
+        if parser.feed(content) is not None:
+            _stats["early_stops"] += 1
+            return parser.json_text
+    _stats["incomplete"] += 1
+    return parser.text
+
+
+def get_llm_stream_stats() -> Dict[str, int]:
+    """获取流式解析统计"""
+    return dict(_stats)
@@ -1,29 +1,122 @@
 """
 rembg 背景移除服务
+模型会话在启动时创建一次并复用，可配置模型和 onnxruntime 线程数
 """
-from rembg import remove
+from rembg import remove, new_session
 from PIL import Image
+import onnxruntime as ort
 import io
+import os
+import time
+from typing import Optional
 
+# 模型名称：u2net / u2netp / isnet-general-use / silueta 等
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+# onnxruntime 线程数（0 表示使用 onnxruntime 默认值）
+REMBG_INTRA_OP_THREADS = int(os.getenv("REMBG_INTRA_OP_THREADS", "0"))
+REMBG_INTER_OP_THREADS = int(os.getenv("REMBG_INTER_OP_THREADS", "0"))
+# 创建会话后是否执行一次预热推理
+REMBG_WARMUP = os.getenv("REMBG_WARMUP", "true").lower() == "true"
+# 分割时的工作分辨率（最长边）。u2net 内部只按 320px 推理，全尺寸解码、缩放和 PNG 编码的开销远大于推理本身
+SEGMENT_WORK_EDGE = int(os.getenv("SEGMENT_WORK_EDGE", "1024"))
 
-def remove_background(image_bytes: bytes) -> bytes:
+# 全局会话
+_session = None
+
+
+def init_segment_session(
+    model_name: Optional[str] = None,
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None,
+    warmup: Optional[bool] = None
+):
+    """
+    创建并缓存 rembg 会话
+
+    Args:
+        model_name: 模型名称，默认读取 REMBG_MODEL
+        intra_op_threads: 单个算子内部的并行线程数，默认读取 REMBG_INTRA_OP_THREADS
+        inter_op_threads: 算子之间的并行线程数，默认读取 REMBG_INTER_OP_THREADS
+        warmup: 是否执行一次预热推理，默认读取 REMBG_WARMUP
+
+    Returns:
+        rembg 会话对象
+    """
+    global _session
+    model_name = model_name or REMBG_MODEL
+    intra_op_threads = REMBG_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    inter_op_threads = REMBG_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+    warmup = REMBG_WARMUP if warmup is None else warmup
+
+    sess_opts = ort.SessionOptions()
+    if intra_op_threads > 0:
+        sess_opts.intra_op_num_threads = intra_op_threads
+    if inter_op_threads > 0:
+        sess_opts.inter_op_num_threads = inter_op_threads
+
+    start = time.perf_counter()
+    session = new_session(model_name, sess_opts=sess_opts)
+    print(
+        f"✅ rembg 会话已创建: model={model_name}, intra={intra_op_threads or 'default'}, "
+        f"inter={inter_op_threads or 'default'}, 耗时 {(time.perf_counter() - start) * 1000:.0f}ms"
+    )
+
+    if warmup:
+        # 用一张小图跑一次推理，让首个用户请求不再承担模型初始化开销
+        start = time.perf_counter()
+        remove(Image.new("RGB", (64, 64), (255, 255, 255)), session=session)
+        print(f"✅ rembg 预热完成，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    _session = session
+    return session
+
+
+def get_segment_session():
+    """获取全局 rembg 会话，未初始化时按默认配置创建"""
+    if _session is None:
+        return init_segment_session()
+    return _session
+
+
+def _open_reduced(image_bytes: bytes, max_edge: int) -> Image.Image:
+    """按缩小尺寸解码图片（JPEG 使用 draft 模式直接解码为 1/2、1/4、1/8 尺寸）"""
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("RGB", (max_edge, max_edge))
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+
+def remove_background(image_bytes: bytes, session=None, full_resolution: bool = False) -> bytes:
     """
     使用 rembg 移除图片背景
 
+    在缩小后的图片上完成分割，只有需要全尺寸抠图时才把蒙版放大回原图尺寸
+
     Args:
         image_bytes: 原始图片的字节数据
+        session: rembg 会话，默认使用全局会话
+        full_resolution: 是否输出原图尺寸的抠图（默认输出工作分辨率）
 
     Returns:
         去除背景后的 PNG 图片字节数据
     """
     try:
-        input_img = Image.open(io.BytesIO(image_bytes))
-        output = remove(input_img)
+        work_img = _open_reduced(image_bytes, SEGMENT_WORK_EDGE)
+        mask = remove(work_img, session=session or get_segment_session(), only_mask=True)
+
+        if full_resolution:
+            output = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+            if mask.size != output.size:
+                mask = mask.resize(output.size, Image.BILINEAR)
+        else:
+            output = work_img.convert("RGBA")
+        output.putalpha(mask)
 
         buf = io.BytesIO()
         output.save(buf, format="PNG")
         result = buf.getvalue()
-        print(f"✅ 背景移除成功，输出大小: {len(result)} bytes")
+        print(f"✅ 背景移除成功，输出尺寸: {output.size}, 大小: {len(result)} bytes")
         return result
     except Exception as e:
         print(f"❌ 背景移除失败: {str(e)}")
@@ -0,0 +1,164 @@
+"""
+多 Key 负载均衡与健康跟踪
+在同一类型（llm / removebg）的全部 api_config 之间按最少在途请求选择，
+记录每个 Key 的延迟与错误率 EWMA，遇到 429 / 5xx 时熔断该 Key 并立即切换到下一个
+"""
+import os
+import time
+from typing import Dict, List, Optional, Any
+from domain.config import ApiConfig
+from storage.db_mysql import get_api_config
+
+# EWMA 平滑系数
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+# 熔断基础时长与上限（秒），连续失败时按 2 的幂次增长
+ROUTER_CIRCUIT_OPEN_SECONDS = float(os.getenv("ROUTER_CIRCUIT_OPEN_SECONDS", "30"))
+ROUTER_CIRCUIT_MAX_SECONDS = float(os.getenv("ROUTER_CIRCUIT_MAX_SECONDS", "300"))
+
+
+def is_circuit_breaking_status(status_code: Optional[int]) -> bool:
+    """429 限流和 5xx 服务端错误会触发熔断；None 表示网络错误"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class KeyHealth:
+    """单个 Key 的健康状态"""
+
+    def __init__(self):
+        self.outstanding = 0
+        self.latency_ewma_ms: Optional[float] = None
+        self.error_ewma = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.circuit_open_until = 0.0
+
+    def is_open(self, now: float) -> bool:
+        return self.circuit_open_until > now
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "outstanding": self.outstanding,
+            "latency_ewma_ms": round(self.latency_ewma_ms, 1) if self.latency_ewma_ms is not None else None,
+            "error_ewma": round(self.error_ewma, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "circuit_open": self.is_open(now),
+            "circuit_remaining_s": round(max(self.circuit_open_until - now, 0.0), 1),
+        }
+
+
+class ProviderRouter:
+    """某一 api_type 下全部 Key 的路由器"""
+
+    def __init__(self, api_type: str):
+        self.api_type = api_type
+        self.health: Dict[int, KeyHealth] = {}
+
+    def _get_health(self, api_id: int) -> KeyHealth:
+        health = self.health.get(api_id)
+        if health is None:
+            health = KeyHealth()
+            self.health[api_id] = health
+        return health
+
+    async def candidates(self) -> List[ApiConfig]:
+        """
+        返回按优先级排序的候选 Key
+
+        熔断中的 Key 排在最后（全部熔断时仍可作为兜底）；
+        其余按 在途请求数、延迟 EWMA、错误率 EWMA、使用次数 升序
+        """
+        configs = [c for c in await get_api_config(self.api_type) if c.api_key]
+        now = time.monotonic()
+
+        def score(config: ApiConfig):
+            health = self._get_health(config.id)
+            return (
+                health.is_open(now),
+                health.circuit_open_until if health.is_open(now) else 0.0,
+                health.outstanding,
+                health.latency_ewma_ms or 0.0,
+                health.error_ewma,
+                config.usage_count,
+            )
+
+        return sorted(configs, key=score)
+
+    def start(self, api_id: int) -> float:
+        """标记请求开始，返回开始时间"""
+        health = self._get_health(api_id)
+        health.outstanding += 1
+        health.requests += 1
+        return time.monotonic()
+
+    def cancel(self, api_id: int):
+        """请求被取消（如对冲请求中落败的一方），只减少在途计数"""
+        health = self._get_health(api_id)
+        health.outstanding = max(health.outstanding - 1, 0)
+
+    def finish(
+        self,
+        api_id: int,
+        started_at: float,
+        ok: bool,
+        status_code: Optional[int] = None,
+        breaking: bool = True
+    ):
+        """
+        记录请求结果
+
+        Args:
+            api_id: 配置 ID
+            started_at: start() 返回的开始时间
+            ok: 是否成功
+            status_code: 失败时的 HTTP 状态码，网络错误传 None
+            breaking: 失败是否可能触发熔断；Key 本身可用、只是本次输出无法解析时传 False
+        """
+        health = self._get_health(api_id)
+        health.outstanding = max(health.outstanding - 1, 0)
+        now = time.monotonic()
+        elapsed_ms = (now - started_at) * 1000
+        alpha = ROUTER_EWMA_ALPHA
+
+        if ok:
+            health.latency_ewma_ms = (
+                elapsed_ms if health.latency_ewma_ms is None
+                else alpha * elapsed_ms + (1 - alpha) * health.latency_ewma_ms
+            )
+            health.error_ewma = (1 - alpha) * health.error_ewma
+            health.consecutive_failures = 0
+            health.circuit_open_until = 0.0
+            return
+
+        health.failures += 1
+        health.error_ewma = alpha + (1 - alpha) * health.error_ewma
+        if breaking and is_circuit_breaking_status(status_code):
+            health.consecutive_failures += 1
+            open_seconds = min(
+                ROUTER_CIRCUIT_OPEN_SECONDS * (2 ** (health.consecutive_failures - 1)),
+                ROUTER_CIRCUIT_MAX_SECONDS,
+            )
+            health.circuit_open_until = now + open_seconds
+            print(f"⚡ {self.api_type} Key {api_id} 熔断 {open_seconds:.0f} 秒 (status={status_code})")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {str(api_id): health.to_dict(now) for api_id, health in self.health.items()}
+
+
+_routers: Dict[str, ProviderRouter] = {}
+
+
+def get_router(api_type: str) -> ProviderRouter:
+    """获取指定类型的路由器"""
+    router = _routers.get(api_type)
+    if router is None:
+        router = ProviderRouter(api_type)
+        _routers[api_type] = router
+    return router
+
+
+def get_router_stats() -> Dict[str, Any]:
+    """获取所有路由器的各 Key 健康状态"""
+    return {api_type: router.stats() for api_type, router in _routers.items()}
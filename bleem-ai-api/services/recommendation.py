@@ -2,11 +2,75 @@
 AI穿搭推荐服务
 基于天气和衣橱数据生成个性化推荐
 """
+import asyncio
+from typing import Optional, AsyncIterator, Dict, Any, Tuple
 import httpx
-from typing import Optional
-from storage.config_store import load_config
+from domain.clothes import ClothesItem
+from domain.config import ApiConfig
+from services.http_client import get_http_client
+from services.llm_stream import iter_sse_content
+from services.provider_router import get_router
+from services.retry_policy import is_retryable_exception, is_retryable_status
 from services.weather import WeatherInfo, get_season_from_weather
-from storage.db_mysql import get_all_clothes
+from storage.db_mysql import count_recommendation_candidates, sample_recommendation_candidates
+
+
+def _weather_to_dict(weather: WeatherInfo) -> dict:
+    """推荐结果中返回的天气字段"""
+    return {
+        "temperature": weather.temperature,
+        "feelsLike": weather.feelsLike,
+        "condition": weather.condition,
+        "icon": weather.icon,
+        "humidity": weather.humidity,
+        "windDir": weather.windDir,
+        "windScale": weather.windScale,
+        "obsTime": weather.obsTime
+    }
+
+
+def _clothes_to_dict(item: ClothesItem) -> dict:
+    """推荐结果中返回的衣物字段"""
+    return {
+        "id": item.id,
+        "category": item.category,
+        "item": item.item,
+        "style_semantics": item.style_semantics,
+        "season_semantics": item.season_semantics,
+        "usage_semantics": item.usage_semantics,
+        "color_semantics": item.color_semantics,
+        "description": item.description,
+        "image_url": item.image_url
+    }
+
+
+async def _select_clothes(weather: WeatherInfo, user_id: str) -> Tuple[list, Dict[str, int], Dict[str, Optional[dict]]]:
+    """
+    按天气筛选可用的衣物
+
+    季节筛选和随机抽样在数据库中完成，只读取推荐需要的字段；
+    某分类没有适合当前季节的衣物时，从该分类全部衣物中选择
+
+    Returns:
+        (适合的季节, {分类: 可选数量}, 推荐的上衣、裤子和鞋子)
+    """
+    # 获取适合的季节
+    seasons = get_season_from_weather(weather)
+
+    counts, tops, bottoms, shoes = await asyncio.gather(
+        count_recommendation_candidates(user_id, seasons),
+        sample_recommendation_candidates(user_id, "top", seasons),
+        sample_recommendation_candidates(user_id, "bottom", seasons),
+        sample_recommendation_candidates(user_id, "shoes", seasons),
+    )
+    print(f"可选衣物数量: {counts}")
+
+    outfit = {
+        "suggested_top": _clothes_to_dict(tops[0]) if tops else None,
+        "suggested_bottom": _clothes_to_dict(bottoms[0]) if bottoms else None,
+        "suggested_shoes": _clothes_to_dict(shoes[0]) if shoes else None
+    }
+    return seasons, counts, outfit
 
 
 async def get_ai_recommendation(weather: WeatherInfo,user_id:str) -> dict:
@@ -19,105 +83,44 @@ async def get_ai_recommendation(weather: WeatherInfo,user_id:str) -> dict:
     Returns:
         推荐信息（包含文本和推荐的衣物）
     """
-    # 获取适合的季节
-    seasons = get_season_from_weather(weather)
-    
-    # 从数据库获取所有衣物
-    all_clothes_items = await get_all_clothes(user_id)
-    print(f"从数据库中获取衣物: {all_clothes_items} ")
-    
-    # 转换为字典格式
-    all_clothes = [
-        {
-            "id": item.id,
-            "category": item.category,
-            "item": item.item,
-            "style_semantics": item.style_semantics,
-            "season_semantics": item.season_semantics,
-            "usage_semantics": item.usage_semantics,
-            "color_semantics": item.color_semantics,
-            "description": item.description,
-            "image_url": item.image_url
-        }
-        for item in all_clothes_items
-    ]
-    
-    # 过滤出适合当前季节的衣物
-    suitable_tops = [
-        c for c in all_clothes 
-        if c.get("category") == "top" and any(s in c.get("season_semantics", []) for s in seasons)
-    ]
-    suitable_bottoms = [
-        c for c in all_clothes 
-        if c.get("category") == "bottom" and any(s in c.get("season_semantics", []) for s in seasons)
-    ]
-    suitable_shoes = [
-        c for c in all_clothes 
-        if c.get("category") == "shoes" and any(s in c.get("season_semantics", []) for s in seasons)
-    ]
-    
-    # 如果没有合适的衣物，就从全部中选择
-    if not suitable_tops:
-        suitable_tops = [c for c in all_clothes if c.get("category") == "top"]
-    if not suitable_bottoms:
-        suitable_bottoms = [c for c in all_clothes if c.get("category") == "bottom"]
-    if not suitable_shoes:
-        suitable_shoes = [c for c in all_clothes if c.get("category") == "shoes"]
+    seasons, counts, outfit = await _select_clothes(weather, user_id)
     
     # 向LLM请求推荐文本
-    recommendation_text = await get_llm_recommendation(weather, seasons, suitable_tops, suitable_bottoms,suitable_shoes)
-    
-    # 随机选择一件上衣和裤子
-    import random
-    suggested_top = random.choice(suitable_tops) if suitable_tops else None
-    suggested_bottom = random.choice(suitable_bottoms) if suitable_bottoms else None
-    suggested_shoes = random.choice(suitable_shoes) if suitable_shoes else None
+    recommendation_text = await get_llm_recommendation(weather, seasons, counts)
     
     return {
-        "weather": {
-            "temperature": weather.temperature,
-            "feelsLike": weather.feelsLike,
-            "condition": weather.condition,
-            "icon": weather.icon,
-            "humidity": weather.humidity,
-            "windDir": weather.windDir,
-            "windScale": weather.windScale,
-            "obsTime": weather.obsTime
-        },
+        "weather": _weather_to_dict(weather),
         "recommendation_text": recommendation_text,
-        "suggested_top": suggested_top,
-        "suggested_bottom": suggested_bottom,
-        "suggested_shoes": suggested_shoes
+        **outfit
     }
 
 
-
-async def get_llm_recommendation(
-    weather: WeatherInfo, 
-    seasons: list[str],
-    tops: list[dict],
-    bottoms: list[dict],
-    shoes: list[dict]
-) -> str:
+async def stream_ai_recommendation(weather: WeatherInfo, user_id: str) -> AsyncIterator[Dict[str, Any]]:
     """
-    使用LLM生成个性化推荐文本
-    
-    Args:
-        weather: 天气信息
-        seasons: 适合的季节
-        tops: 可用的上衣列表
-        bottoms: 可用的裤子列表
-        shoes: 可用的鞋子列表
-        
-    Returns:
-        推荐文本
+    流式获取AI穿搭推荐
+
+    先返回天气和推荐的衣物，再逐段返回 LLM 生成的推荐文本
+
+    Yields:
+        {"event": "weather" | "outfit" | "delta" | "done", "data": ...}
     """
-    config = load_config()
-    
-    if not config.api_key:
-        # 如果没有配置API，返回基础推荐
-        return generate_basic_recommendation(weather, seasons)
-    
+    yield {"event": "weather", "data": _weather_to_dict(weather)}
+
+    seasons, counts, outfit = await _select_clothes(weather, user_id)
+    yield {"event": "outfit", "data": outfit}
+
+    async for text in stream_llm_recommendation(weather, seasons, counts):
+        yield {"event": "delta", "data": {"text": text}}
+
+    yield {"event": "done", "data": {}}
+
+
+def _build_recommendation_messages(
+    weather: WeatherInfo,
+    seasons: list[str],
+    counts: Dict[str, int]
+) -> list:
+    """构建推荐请求的消息列表"""
     # 构建提示词
     prompt = f"""
 你是一位专业的时尚穿搭顾问。请根据以下天气信息，为用户提供穿搭建议：
@@ -131,7 +134,7 @@ async def get_llm_recommendation(
 
 适合的季节：{', '.join(seasons)}
 
-用户衣橱中有 {len(tops)} 件上衣,{len(bottoms)} 件裤子和{len(shoes)} 件鞋子可供选择。
+用户衣橱中有 {counts.get("top", 0)} 件上衣,{counts.get("bottom", 0)} 件裤子和{counts.get("shoes", 0)} 件鞋子可供选择。
 
 请生成一段友好、实用的穿搭推荐（150词左右），使用 Markdown 格式以便于阅读：
 1. **针对当前天气的穿搭建议**（使用粗体强调重点衣物）
@@ -140,44 +143,163 @@ async def get_llm_recommendation(
 
 请直接输出 Markdown 格式的文本，不要包含代码块标记（如 ```markdown）。
 """
+    return [
+        {"role": "system", "content": "你是一位专业的时尚穿搭顾问，擅长根据天气提供实用的穿搭建议。"},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _chat_url(api_base: str) -> str:
+    """确保 api_base 格式正确并拼接 chat/completions 地址"""
+    api_base = api_base.rstrip("/")
+    if not api_base.endswith("/v1"):
+        api_base = api_base + "/v1"
+    return f"{api_base}/chat/completions"
+
+
+def _headers(config: ApiConfig, **extra: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {config.api_key}",
+        "Content-Type": "application/json",
+        **extra
+    }
+
+
+async def get_llm_recommendation(
+    weather: WeatherInfo, 
+    seasons: list[str],
+    counts: Dict[str, int]
+) -> str:
+    """
+    使用LLM生成个性化推荐文本
+
+    按 llm 路由器的健康状态依次尝试各个 Key，并记录每次请求的结果；
+    遇到 429 / 5xx / 网络错误时换下一个 Key，全部失败时返回基础推荐
     
-    try:
-        # 确保 api_base 格式正确
-        api_base = config.api_base.rstrip("/")
-        if not api_base.endswith("/v1"):
-            api_base = api_base + "/v1"
-        
-        url = f"{api_base}/chat/completions"
+    Args:
+        weather: 天气信息
+        seasons: 适合的季节
+        counts: 各分类可用的衣物数量
         
+    Returns:
+        推荐文本
+    """
+    router = get_router("llm")
+    candidates = await router.candidates()
+    if not candidates:
+        # 如果没有配置API，返回基础推荐
+        return generate_basic_recommendation(weather, seasons)
+
+    messages = _build_recommendation_messages(weather, seasons, counts)
+    client = get_http_client("llm")
+    for config in candidates:
         payload = {
             "model": config.model,
-            "messages": [
-                {"role": "system", "content": "你是一位专业的时尚穿搭顾问，擅长根据天气提供实用的穿搭建议。"},
-                {"role": "user", "content": prompt}
-            ],
+            "messages": messages,
             "temperature": 0.7
         }
         print(f"LLM API请求 json: {payload}")
-        async with httpx.AsyncClient(timeout=30.0, trust_env=False) as client:
+        started_at = router.start(config.id)
+        try:
             response = await client.post(
-                url,
-                headers={
-                    "Authorization": f"Bearer {config.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json=payload
+                _chat_url(config.api_base),
+                headers=_headers(config),
+                json=payload,
+                timeout=30.0
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data["choices"][0]["message"]["content"].strip()
-            else:
-                print(f"LLM API请求失败: {response.status_code}")
-                return generate_basic_recommendation(weather, seasons)
-                
-    except Exception as e:
-        print(f"调用LLM失败: {e}")
-        return generate_basic_recommendation(weather, seasons)
+        except asyncio.CancelledError:
+            router.cancel(config.id)
+            raise
+        except Exception as e:
+            router.finish(config.id, started_at, ok=False, breaking=is_retryable_exception(e))
+            print(f"调用LLM失败 (Key {config.id}): {e}")
+            continue
+
+        if response.status_code != 200:
+            router.finish(config.id, started_at, ok=False, status_code=response.status_code)
+            print(f"LLM API请求失败 (Key {config.id}): {response.status_code}")
+            if not is_retryable_status(response.status_code):
+                break
+            continue
+
+        try:
+            text = response.json()["choices"][0]["message"]["content"].strip()
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            # 响应内容异常不代表 Key 不可用，不触发熔断
+            router.finish(config.id, started_at, ok=False, breaking=False)
+            print(f"LLM API响应格式错误 (Key {config.id}): {e}")
+            continue
+        router.finish(config.id, started_at, ok=True)
+        return text
+
+    return generate_basic_recommendation(weather, seasons)
+
+
+async def stream_llm_recommendation(
+    weather: WeatherInfo,
+    seasons: list[str],
+    counts: Dict[str, int]
+) -> AsyncIterator[str]:
+    """
+    使用 stream: true 流式生成推荐文本
+
+    逐段返回模型输出的文本；按 llm 路由器的健康状态依次尝试各个 Key，
+    在收到任何内容之前失败时换下一个 Key，全部失败时返回基础推荐，
+    已输出部分内容后失败则直接结束
+
+    Yields:
+        推荐文本片段
+    """
+    router = get_router("llm")
+    candidates = await router.candidates()
+    messages = _build_recommendation_messages(weather, seasons, counts)
+    client = get_http_client("llm")
+    sent_any = False
+    for config in candidates:
+        payload = {
+            "model": config.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "stream": True
+        }
+        started_at = router.start(config.id)
+        try:
+            async with client.stream(
+                "POST",
+                _chat_url(config.api_base),
+                headers=_headers(config, Accept="text/event-stream"),
+                json=payload,
+                timeout=httpx.Timeout(30.0, connect=10.0)
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    router.finish(config.id, started_at, ok=False, status_code=response.status_code)
+                    print(f"LLM API流式请求失败 (Key {config.id}): {response.status_code}")
+                    if not is_retryable_status(response.status_code):
+                        break
+                    continue
+                async for text in iter_sse_content(response):
+                    sent_any = True
+                    yield text
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开连接
+            router.cancel(config.id)
+            raise
+        except Exception as e:
+            router.finish(config.id, started_at, ok=False, breaking=is_retryable_exception(e))
+            print(f"调用LLM流式接口失败 (Key {config.id}): {e}")
+            if sent_any:
+                return
+            continue
+
+        if sent_any:
+            router.finish(config.id, started_at, ok=True)
+            return
+        # 200 但没有任何内容，换下一个 Key
+        router.finish(config.id, started_at, ok=False, breaking=False)
+        print(f"LLM API流式响应为空 (Key {config.id})")
+
+    yield generate_basic_recommendation(weather, seasons)
 
 
 def generate_basic_recommendation(weather: WeatherInfo, seasons: list[str]) -> str:
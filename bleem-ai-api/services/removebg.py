@@ -1,8 +1,17 @@
 """
 remove.bg API 背景移除服务
 """
-import httpx
 from typing import Optional
+from services.http_client import get_http_client
+from services.retry_policy import get_retry_policy, send_with_retry
+
+
+class RemoveBgError(ValueError):
+    """remove.bg 返回错误，status_code 为 HTTP 状态码（未发出请求时为 None）"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
 
 
 async def remove_background_api(
@@ -23,10 +32,10 @@ async def remove_background_api(
         去除背景后的 PNG 图片字节数据
         
     Raises:
-        ValueError: API 调用失败时抛出
+        RemoveBgError: API 调用失败时抛出（ValueError 的子类）
     """
     if not api_key:
-        raise ValueError("未配置 remove.bg API Key")
+        raise RemoveBgError("未配置 remove.bg API Key")
     
     headers = {
         "X-API-Key": api_key
@@ -40,25 +49,28 @@ async def remove_background_api(
         "size": size
     }
     
-    async with httpx.AsyncClient(timeout=60.0, trust_env=False) as client:
-        response = await client.post(
-            api_base,
-            headers=headers,
-            files=files,
-            data=data
-        )
-        
-        if response.status_code == 200:
-            return response.content
-        elif response.status_code == 402:
-            raise ValueError("remove.bg API 余额不足，请充值或切换到本地处理")
-        elif response.status_code == 403:
-            raise ValueError("remove.bg API Key 无效")
-        elif response.status_code == 400:
-            error_msg = response.json().get("errors", [{}])[0].get("title", "请求无效")
-            raise ValueError(f"remove.bg 错误: {error_msg}")
-        else:
-            raise ValueError(f"remove.bg API 调用失败: HTTP {response.status_code}")
+    client = get_http_client("removebg")
+    response = await send_with_retry(
+        client,
+        "POST",
+        api_base,
+        get_retry_policy("removebg"),
+        headers=headers,
+        files=files,
+        data=data
+    )
+    
+    if response.status_code == 200:
+        return response.content
+    elif response.status_code == 402:
+        raise RemoveBgError("remove.bg API 余额不足，请充值或切换到本地处理", 402)
+    elif response.status_code == 403:
+        raise RemoveBgError("remove.bg API Key 无效", 403)
+    elif response.status_code == 400:
+        error_msg = response.json().get("errors", [{}])[0].get("title", "请求无效")
+        raise RemoveBgError(f"remove.bg 错误: {error_msg}", 400)
+    else:
+        raise RemoveBgError(f"remove.bg API 调用失败: HTTP {response.status_code}", response.status_code)
 
 
 def get_remaining_credits(api_key: str) -> Optional[int]:
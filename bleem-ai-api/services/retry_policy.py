@@ -0,0 +1,227 @@
+"""
+上游请求重试策略
+统一判断哪些状态码 / 异常可以重试，遵循 Retry-After 响应头，
+使用去相关抖动（decorrelated jitter）的指数退避，并为单次调用设置总耗时预算。
+LLM、remove.bg、和风天气共用
+"""
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+import httpx
+
+# 可重试的状态码：请求超时、限流、服务端临时错误
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """判断状态码是否值得重试（其他 4xx 重试也不会成功）"""
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+def is_retryable_exception(exc: Exception) -> bool:
+    """连接失败、超时、连接被对端关闭等传输层错误可以重试"""
+    return isinstance(exc, httpx.TransportError) and not isinstance(exc, httpx.UnsupportedProtocol)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析 Retry-After 响应头
+
+    Args:
+        value: 秒数（"120"）或 HTTP 日期（"Wed, 21 Oct 2015 07:28:00 GMT"）
+
+    Returns:
+        需要等待的秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(retry_at.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """某一上游的重试参数与统计"""
+
+    def __init__(self, name: str, max_attempts: int, base_delay: float, max_delay: float, deadline: float):
+        """
+        Args:
+            name: 上游名称
+            max_attempts: 最大尝试次数（含首次请求）
+            base_delay: 退避基础时长（秒）
+            max_delay: 单次退避上限（秒）
+            deadline: 单次调用的总耗时预算（秒），包含所有请求和等待
+        """
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.stats: Dict[str, int] = {
+            "calls": 0,
+            "retries": 0,
+            "retry_after_honoured": 0,
+            "gave_up_attempts": 0,
+            "gave_up_deadline": 0,
+        }
+
+    def begin(self) -> "RetryBudget":
+        """开始一次调用"""
+        self.stats["calls"] += 1
+        return RetryBudget(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_attempts": self.max_attempts,
+            "deadline_s": self.deadline,
+            **self.stats,
+        }
+
+
+class RetryBudget:
+    """单次调用的重试状态：已尝试次数、剩余时间与上一次退避时长"""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.attempts = 0
+        self.deadline_at = time.monotonic() + policy.deadline
+        self._last_delay = policy.base_delay
+
+    def attempt(self) -> int:
+        """记录一次尝试，返回当前是第几次"""
+        self.attempts += 1
+        return self.attempts
+
+    def remaining(self) -> float:
+        """剩余时间预算（秒）"""
+        return max(self.deadline_at - time.monotonic(), 0.0)
+
+    def timeout(self, timeout: httpx.Timeout) -> httpx.Timeout:
+        """把客户端的超时配置收紧到剩余预算以内"""
+        remaining = max(self.remaining(), 0.1)
+
+        def clamp(value: Optional[float]) -> float:
+            return remaining if value is None else min(value, remaining)
+
+        return httpx.Timeout(
+            connect=clamp(timeout.connect),
+            read=clamp(timeout.read),
+            write=clamp(timeout.write),
+            pool=clamp(timeout.pool),
+        )
+
+    def next_delay(self, response: Optional[httpx.Response] = None) -> Optional[float]:
+        """
+        计算下一次重试前的等待时间
+
+        Args:
+            response: 失败的响应（网络错误时为 None），用于读取 Retry-After
+
+        Returns:
+            等待秒数；尝试次数用尽或等待后会超出时间预算时返回 None
+        """
+        policy = self.policy
+        if self.attempts >= policy.max_attempts:
+            policy.stats["gave_up_attempts"] += 1
+            return None
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        if retry_after is not None:
+            delay = retry_after
+            policy.stats["retry_after_honoured"] += 1
+        else:
+            # decorrelated jitter: sleep = min(cap, random(base, prev * 3))
+            delay = min(policy.max_delay, random.uniform(policy.base_delay, self._last_delay * 3))
+        self._last_delay = max(delay, policy.base_delay)
+
+        if delay >= self.remaining():
+            policy.stats["gave_up_deadline"] += 1
+            return None
+        policy.stats["retries"] += 1
+        return delay
+
+
+def _policy_from_env(name: str, max_attempts: int, base_delay: float, max_delay: float, deadline: float) -> RetryPolicy:
+    prefix = f"RETRY_{name.upper()}_"
+    return RetryPolicy(
+        name,
+        max_attempts=int(os.getenv(prefix + "MAX_ATTEMPTS", str(max_attempts))),
+        base_delay=float(os.getenv(prefix + "BASE_DELAY", str(base_delay))),
+        max_delay=float(os.getenv(prefix + "MAX_DELAY", str(max_delay))),
+        deadline=float(os.getenv(prefix + "DEADLINE", str(deadline))),
+    )
+
+
+# 各上游的重试策略，可通过 RETRY_<NAME>_MAX_ATTEMPTS 等环境变量覆盖
+RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    "llm": _policy_from_env("llm", max_attempts=3, base_delay=1.0, max_delay=10.0, deadline=120.0),
+    "removebg": _policy_from_env("removebg", max_attempts=2, base_delay=1.0, max_delay=5.0, deadline=60.0),
+    "qweather": _policy_from_env("qweather", max_attempts=3, base_delay=0.2, max_delay=2.0, deadline=8.0),
+    "webhook": _policy_from_env("webhook", max_attempts=4, base_delay=1.0, max_delay=10.0, deadline=30.0),
+}
+
+
+def get_retry_policy(name: str) -> RetryPolicy:
+    """获取指定上游的重试策略"""
+    return RETRY_POLICIES[name]
+
+
+async def send_with_retry(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    policy: RetryPolicy,
+    **kwargs
+) -> httpx.Response:
+    """
+    按重试策略发送请求
+
+    Args:
+        client: 共享的 httpx 客户端
+        method: HTTP 方法
+        url: 请求地址
+        policy: 重试策略
+        **kwargs: 传给 client.request 的其他参数（timeout 会被收紧到剩余预算以内）
+
+    Returns:
+        最后一次的响应（可能仍是失败状态码，由调用方判断）
+
+    Raises:
+        httpx.TransportError: 网络错误且不再重试时抛出
+    """
+    budget = policy.begin()
+    base_timeout = httpx.Timeout(kwargs.pop("timeout", client.timeout))
+    while True:
+        attempt = budget.attempt()
+        try:
+            response = await client.request(method, url, timeout=budget.timeout(base_timeout), **kwargs)
+        except Exception as e:
+            if not is_retryable_exception(e):
+                raise
+            delay = budget.next_delay()
+            if delay is None:
+                raise
+            print(f"⏳ {policy.name} 第 {attempt} 次请求失败 ({type(e).__name__})，{delay:.1f} 秒后重试")
+        else:
+            if not is_retryable_status(response.status_code):
+                return response
+            delay = budget.next_delay(response)
+            if delay is None:
+                return response
+            print(f"⏳ {policy.name} 第 {attempt} 次请求返回 {response.status_code}，{delay:.1f} 秒后重试")
+        await asyncio.sleep(delay)
+
+
+def get_retry_stats() -> Dict[str, Any]:
+    """获取各上游的重试统计"""
+    return {name: policy.to_dict() for name, policy in RETRY_POLICIES.items()}
@@ -0,0 +1,267 @@
+"""
+背景移除结果缓存（感知哈希）
+对原图计算 dHash，近似重复的上传（重新压缩的 JPEG、轻微裁剪的截图）直接复用已去背景的 PNG，
+避免重复执行 rembg 或消耗 remove.bg 额度。结果保存在有容量上限的磁盘目录中。
+
+dHash 基于灰度梯度，不区分颜色：同款不同色、整体调暗的图片哈希几乎相同。
+缓存由所有用户共享，因此候选结果还需通过 4x4 色块均值和宽高比校验才会复用
+"""
+import asyncio
+import io
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+from PIL import Image
+
+# 缓存目录、容量上限（字节）与相似度阈值（64 位哈希的汉明距离）
+_default_dir = Path(__file__).parent.parent / "cache" / "segment"
+SEGMENT_CACHE_DIR = Path(os.getenv("SEGMENT_CACHE_DIR", _default_dir))
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+SEGMENT_CACHE_THRESHOLD = int(os.getenv("SEGMENT_CACHE_THRESHOLD", "4"))
+# 色块均值的平均差异上限（0-255），以及宽高比的相对差异上限
+SEGMENT_CACHE_COLOR_TOLERANCE = float(os.getenv("SEGMENT_CACHE_COLOR_TOLERANCE", "12"))
+SEGMENT_CACHE_ASPECT_TOLERANCE = float(os.getenv("SEGMENT_CACHE_ASPECT_TOLERANCE", "0.03"))
+SEGMENT_CACHE_ENABLED = os.getenv("SEGMENT_CACHE_ENABLED", "true").lower() == "true"
+
+# 色块网格边长（4x4 个色块，每块 RGB 三个通道）
+_COLOR_GRID = 4
+
+
+class ImageSignature(NamedTuple):
+    """原图特征：dHash、4x4 色块的 RGB 均值、原图尺寸"""
+    dhash: int
+    colors: bytes
+    width: int
+    height: int
+
+    @property
+    def name(self) -> str:
+        """缓存文件名（不含扩展名）"""
+        return f"{self.dhash:016x}_{self.colors.hex()}_{self.width}x{self.height}"
+
+    @classmethod
+    def from_name(cls, name: str) -> "ImageSignature":
+        dhash, colors, size = name.split("_")
+        width, height = size.split("x")
+        colors = bytes.fromhex(colors)
+        if len(colors) != _COLOR_GRID * _COLOR_GRID * 3:
+            raise ValueError(f"无效的缓存文件名: {name}")
+        return cls(int(dhash, 16), colors, int(width), int(height))
+
+
+# 原图特征 -> (文件大小, 最近访问时间)
+_index: Dict[ImageSignature, Tuple[int, float]] = {}
+_index_loaded = False
+_total_bytes = 0
+# 查找和写入都在线程中执行，索引的读写需要加锁
+_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "rejected": 0,
+    "stores": 0,
+    "evictions": 0,
+}
+
+
+def _dhash(gray: Image.Image) -> int:
+    """由灰度图计算 64 位差异哈希（dHash）"""
+    pixels = gray.resize((9, 8), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def compute_signature(image_bytes: bytes) -> ImageSignature:
+    """计算原图特征，只解码一次缩小后的图片"""
+    img = Image.open(io.BytesIO(image_bytes))
+    width, height = img.size
+    img.draft("RGB", (64, 64))
+    # 透明背景按白色计算，与去背景模型看到的图片一致
+    if img.mode in ("RGBA", "LA", "P"):
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    else:
+        img = img.convert("RGB")
+    colors = img.resize((_COLOR_GRID, _COLOR_GRID), Image.BOX).tobytes()
+    return ImageSignature(_dhash(img.convert("L")), colors, width, height)
+
+
+def is_same_image(a: ImageSignature, b: ImageSignature) -> bool:
+    """
+    判断两张原图是否可以共用去背景结果
+
+    dHash 汉明距离、色块颜色差异、宽高比都在阈值以内才视为同一张图片
+    """
+    if (a.dhash ^ b.dhash).bit_count() > SEGMENT_CACHE_THRESHOLD:
+        return False
+    aspect_a, aspect_b = a.width / max(a.height, 1), b.width / max(b.height, 1)
+    if abs(aspect_a - aspect_b) > SEGMENT_CACHE_ASPECT_TOLERANCE * max(aspect_a, aspect_b):
+        return False
+    color_distance = sum(abs(x - y) for x, y in zip(a.colors, b.colors)) / len(a.colors)
+    return color_distance <= SEGMENT_CACHE_COLOR_TOLERANCE
+
+
+def _path_for(signature: ImageSignature) -> Path:
+    return SEGMENT_CACHE_DIR / f"{signature.name}.png"
+
+
+def _load_index():
+    """从缓存目录的文件名重建索引"""
+    if _index_loaded:
+        return
+    with _lock:
+        if not _index_loaded:
+            _scan_dir()
+
+
+def _scan_dir():
+    global _index_loaded, _total_bytes
+    SEGMENT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for path in SEGMENT_CACHE_DIR.glob("*.png"):
+        try:
+            signature = ImageSignature.from_name(path.stem)
+        except ValueError:
+            # 旧版本只按 dHash 命名的文件缺少颜色信息，无法安全复用
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        _index[signature] = (stat.st_size, stat.st_mtime)
+        _total_bytes += stat.st_size
+    _index_loaded = True
+
+
+def _find_nearest(signature: ImageSignature) -> Tuple[Optional[ImageSignature], int]:
+    """
+    在索引中查找可复用的最相近条目
+
+    Returns:
+        (匹配的条目, 因颜色或宽高比不符被拒绝的候选数)
+    """
+    best, best_distance, rejected = None, SEGMENT_CACHE_THRESHOLD + 1, 0
+    for candidate in _index:
+        distance = (candidate.dhash ^ signature.dhash).bit_count()
+        if distance >= best_distance:
+            continue
+        if not is_same_image(candidate, signature):
+            rejected += 1
+            continue
+        best, best_distance = candidate, distance
+        if distance == 0:
+            break
+    return best, rejected
+
+
+def _lookup_sync(image_bytes: bytes) -> Tuple[Optional[ImageSignature], Optional[bytes]]:
+    _load_index()
+    try:
+        signature = compute_signature(image_bytes)
+    except Exception as e:
+        print(f"⚠️ 计算感知哈希失败: {e}")
+        return None, None
+
+    with _lock:
+        match, rejected = _find_nearest(signature)
+        _stats["rejected"] += rejected
+        if match is None:
+            return signature, None
+        path = _path_for(match)
+        try:
+            data = path.read_bytes()
+            # 更新访问时间，用于按最近使用淘汰
+            now = time.time()
+            os.utime(path, (now, now))
+        except OSError:
+            _forget(match)
+            return signature, None
+        _index[match] = (len(data), now)
+    return signature, data
+
+
+def _forget(signature: ImageSignature):
+    global _total_bytes
+    size, _ = _index.pop(signature, (0, 0.0))
+    _total_bytes -= size
+
+
+def _store_sync(signature: ImageSignature, processed_bytes: bytes):
+    global _total_bytes
+    _load_index()
+    path = _path_for(signature)
+    tmp_path = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(processed_bytes)
+    with _lock:
+        os.replace(tmp_path, path)
+        _forget(signature)
+        _index[signature] = (len(processed_bytes), time.time())
+        _total_bytes += len(processed_bytes)
+
+        # 超出容量时淘汰最久未使用的条目
+        if _total_bytes > SEGMENT_CACHE_MAX_BYTES:
+            for old_signature, _ in sorted(_index.items(), key=lambda kv: kv[1][1]):
+                if _total_bytes <= SEGMENT_CACHE_MAX_BYTES:
+                    break
+                if old_signature == signature:
+                    continue
+                try:
+                    _path_for(old_signature).unlink()
+                except OSError:
+                    pass
+                _forget(old_signature)
+                _stats["evictions"] += 1
+
+
+async def lookup_segment(image_bytes: bytes) -> Tuple[Optional[ImageSignature], Optional[bytes]]:
+    """
+    查找近似图片的去背景结果
+
+    Args:
+        image_bytes: 原始上传图片的字节数据
+
+    Returns:
+        (原图特征, 命中的 PNG 数据)，未命中时 PNG 为 None；特征计算失败时均为 None
+    """
+    if not SEGMENT_CACHE_ENABLED:
+        return None, None
+    signature, data = await asyncio.to_thread(_lookup_sync, image_bytes)
+    if data is not None:
+        _stats["hits"] += 1
+    else:
+        _stats["misses"] += 1
+    return signature, data
+
+
+async def store_segment(signature: ImageSignature, processed_bytes: bytes) -> None:
+    """保存去背景结果"""
+    if not SEGMENT_CACHE_ENABLED:
+        return
+    try:
+        await asyncio.to_thread(_store_sync, signature, processed_bytes)
+        _stats["stores"] += 1
+    except OSError as e:
+        print(f"⚠️ 保存去背景缓存失败: {e}")
+
+
+def get_segment_cache_stats() -> Dict[str, float]:
+    """获取缓存统计"""
+    return {
+        "entries": len(_index),
+        "bytes": _total_bytes,
+        "max_bytes": SEGMENT_CACHE_MAX_BYTES,
+        "threshold": SEGMENT_CACHE_THRESHOLD,
+        "color_tolerance": SEGMENT_CACHE_COLOR_TOLERANCE,
+        **_stats,
+    }
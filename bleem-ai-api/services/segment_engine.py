@@ -0,0 +1,206 @@
+"""
+本地背景移除引擎
+在独立的进程池中运行 rembg/onnxruntime 推理，避免同步推理阻塞 uvicorn 事件循环
+每个工作进程启动时加载一次 ONNX 会话并常驻，提供异步提交接口、排队上限和按进程统计
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, Tuple
+
+# 工作进程数（0 表示不使用进程池，退化为线程中执行）
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "2"))
+# 除正在执行的任务外，最多允许排队的任务数
+SEGMENT_MAX_QUEUE = int(os.getenv("SEGMENT_MAX_QUEUE", "16"))
+
+
+class SegmentQueueFullError(Exception):
+    """背景移除队列已满"""
+    pass
+
+
+# 全局进程池与统计
+_executor: Optional[ProcessPoolExecutor] = None
+# 未启用进程池时执行推理的线程池
+_thread_executor: Optional[ThreadPoolExecutor] = None
+# 已提交且尚未执行完的任务数；在执行器的回调线程中递减，需要加锁
+_pending = 0
+_pending_lock = threading.Lock()
+_engine_stats: Dict[str, int] = {
+    "submitted": 0,
+    "completed": 0,
+    "rejected": 0,
+    "failed": 0,
+}
+_worker_stats: Dict[int, Dict[str, Any]] = {}
+
+# ==================== 工作进程内部 ====================
+
+def _init_worker():
+    """工作进程初始化：加载并预热 ONNX 会话"""
+    from services.local_segment import init_segment_session, REMBG_INTRA_OP_THREADS
+    # 未显式配置线程数时按工作进程数均分 CPU，避免多个进程争抢核心
+    intra_op_threads = REMBG_INTRA_OP_THREADS or max(1, (os.cpu_count() or 1) // max(SEGMENT_WORKERS, 1))
+    try:
+        init_segment_session(intra_op_threads=intra_op_threads)
+        print(f"✅ 背景移除工作进程已就绪 (pid={os.getpid()})")
+    except Exception as e:
+        # 初始化异常会导致整个进程池不可用，这里仅记录，推理时再按原逻辑降级
+        print(f"❌ 背景移除工作进程加载模型失败 (pid={os.getpid()}): {e}")
+
+
+def _ping() -> int:
+    """空任务，用于启动时拉起全部工作进程"""
+    return os.getpid()
+
+
+def _segment_in_worker(image_bytes: bytes, full_resolution: bool) -> Tuple[bytes, int, float]:
+    """在工作进程（或未启用进程池时的线程）中执行背景移除，复用进程内的全局会话，返回 (结果, 进程号, 耗时毫秒)"""
+    from services.local_segment import remove_background
+    start = time.perf_counter()
+    result = remove_background(image_bytes, full_resolution=full_resolution)
+    return result, os.getpid(), (time.perf_counter() - start) * 1000
+
+
+# ==================== 主进程接口 ====================
+
+def _create_executor() -> ProcessPoolExecutor:
+    # 使用 spawn 避免 fork 带有事件循环和线程的 uvicorn 进程
+    return ProcessPoolExecutor(
+        max_workers=SEGMENT_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    )
+
+
+async def start_segment_engine():
+    """启动进程池并预热全部工作进程（应用启动时调用）"""
+    global _executor
+    if SEGMENT_WORKERS <= 0:
+        # 不使用进程池时在主进程中创建一次会话
+        from services.local_segment import init_segment_session
+        try:
+            await asyncio.to_thread(init_segment_session)
+        except Exception as e:
+            print(f"❌ rembg 会话创建失败: {e}")
+        return
+    if _executor is not None:
+        return
+    _executor = _create_executor()
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[
+        loop.run_in_executor(_executor, _ping) for _ in range(SEGMENT_WORKERS)
+    ])
+    print(f"✅ 背景移除引擎已启动: {SEGMENT_WORKERS} 个工作进程, 队列上限 {SEGMENT_MAX_QUEUE}")
+
+
+async def stop_segment_engine():
+    """关闭进程池（应用关闭时调用），在线程中等待执行中的推理结束，不阻塞事件循环"""
+    global _executor, _thread_executor
+    executors = [e for e in (_executor, _thread_executor) if e is not None]
+    _executor, _thread_executor = None, None
+    for executor in executors:
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+
+def _record_worker(pid: int, elapsed_ms: float):
+    stats = _worker_stats.setdefault(pid, {"tasks": 0, "total_ms": 0.0, "last_ms": 0.0})
+    stats["tasks"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["last_ms"] = elapsed_ms
+
+
+def _release(_future: Optional[Future] = None):
+    """任务执行结束（或排队中被取消）时释放一个名额"""
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def _submit(executor: Executor, fn, *args) -> Future:
+    """
+    提交到执行器，并在执行器侧的任务结束时释放名额
+
+    等待结果的协程被取消（客户端断开、批量任务取消）时，已开始执行的推理仍在占用工作进程，
+    名额要等它真正结束才释放，排队上限才能反映实际负载
+    """
+    future = executor.submit(fn, *args)
+    future.add_done_callback(_release)
+    return future
+
+
+async def submit_remove_background(image_bytes: bytes, full_resolution: bool = False) -> bytes:
+    """
+    异步提交背景移除任务
+
+    Args:
+        image_bytes: 原始图片的字节数据
+        full_resolution: 是否输出原图尺寸的抠图
+
+    Returns:
+        去除背景后的 PNG 图片字节数据
+
+    Raises:
+        SegmentQueueFullError: 执行中和排队中的任务已达上限
+    """
+    global _pending, _executor, _thread_executor
+    capacity = max(SEGMENT_WORKERS, 1) + SEGMENT_MAX_QUEUE
+    with _pending_lock:
+        if _pending >= capacity:
+            _engine_stats["rejected"] += 1
+            raise SegmentQueueFullError(f"背景移除队列已满 ({_pending}/{capacity})")
+        _pending += 1
+    _engine_stats["submitted"] += 1
+
+    future = None
+    try:
+        if SEGMENT_WORKERS <= 0:
+            # 未启用进程池时在线程中执行，至少不阻塞事件循环
+            if _thread_executor is None:
+                _thread_executor = ThreadPoolExecutor(thread_name_prefix="segment")
+            future = _submit(_thread_executor, _segment_in_worker, image_bytes, full_resolution)
+        else:
+            if _executor is None:
+                _executor = _create_executor()
+            future = _submit(_executor, _segment_in_worker, image_bytes, full_resolution)
+        result, pid, elapsed_ms = await asyncio.wrap_future(future)
+        _record_worker(pid, elapsed_ms)
+        _engine_stats["completed"] += 1
+        return result
+    except BrokenProcessPool:
+        # 工作进程异常退出，丢弃进程池，下次提交时重建
+        _engine_stats["failed"] += 1
+        print("❌ 背景移除工作进程异常退出，将重建进程池")
+        broken, _executor = _executor, None
+        if broken is not None:
+            broken.shutdown(wait=False)
+        raise
+    except Exception:
+        _engine_stats["failed"] += 1
+        raise
+    finally:
+        if future is None:
+            # 提交失败，名额不会由执行器回调释放
+            _release()
+
+
+def get_segment_engine_stats() -> Dict[str, Any]:
+    """获取引擎与各工作进程的统计"""
+    workers = {}
+    for pid, stats in _worker_stats.items():
+        workers[str(pid)] = {
+            "tasks": stats["tasks"],
+            "avg_ms": round(stats["total_ms"] / stats["tasks"], 1) if stats["tasks"] else 0.0,
+            "last_ms": round(stats["last_ms"], 1),
+        }
+    return {
+        "workers": SEGMENT_WORKERS,
+        "max_queue": SEGMENT_MAX_QUEUE,
+        "pending": _pending,
+        **_engine_stats,
+        "per_worker": workers,
+    }
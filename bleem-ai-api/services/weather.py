@@ -3,10 +3,15 @@
 文档: https://dev.qweather.com/docs/api/weather/weather-now/
 GeoAPI: https://dev.qweather.com/docs/api/geoapi/city-lookup/
 """
-import httpx
+import asyncio
 import os
-from typing import Optional, List
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, List, Dict, Tuple
 from pydantic import BaseModel
+from services.http_client import get_http_client
+from services.retry_policy import get_retry_policy, send_with_retry
 
 
 class CityInfo(BaseModel):
@@ -112,25 +117,25 @@ async def get_city_by_location(latitude: float, longitude: float) -> Optional[Ci
     }
 
     try:
-        async with httpx.AsyncClient(trust_env=False) as client:
-            resp = await client.get(url, params=params, timeout=10.0)
-            if resp.status_code != 200:
-                return None
-
-            data = resp.json()
-            if data.get("code") != "200" or not data.get("location"):
-                return None
-
-            loc = data["location"][0]
-            return CityInfo(
-                name=loc.get("name"),
-                id=loc.get("id"),
-                adm1=loc.get("adm1"),
-                adm2=loc.get("adm2"),
-                country=loc.get("country"),
-                lat=loc.get("lat"),
-                lon=loc.get("lon")
-            )
+        client = get_http_client("qweather")
+        resp = await send_with_retry(client, "GET", url, get_retry_policy("qweather"), params=params, timeout=10.0)
+        if resp.status_code != 200:
+            return None
+
+        data = resp.json()
+        if data.get("code") != "200" or not data.get("location"):
+            return None
+
+        loc = data["location"][0]
+        return CityInfo(
+            name=loc.get("name"),
+            id=loc.get("id"),
+            adm1=loc.get("adm1"),
+            adm2=loc.get("adm2"),
+            country=loc.get("country"),
+            lat=loc.get("lat"),
+            lon=loc.get("lon")
+        )
 
     except Exception as e:
         print(f"理编码失败: {e}")
@@ -172,25 +177,25 @@ async def search_city(query: str, limit: int = 10) -> List[CityInfo]:
                 "key": api_key
             }
             
-            async with httpx.AsyncClient(trust_env=False) as client:
-                response = await client.get(url, params=params, timeout=10.0)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("code") == "200" and data.get("location"):
-                        cities = []
-                        for location in data.get("location", []):
-                            cities.append(CityInfo(
-                                name=location.get("name"),
-                                id=location.get("id"),
-                                adm1=location.get("adm1"),
-                                adm2=location.get("adm2"),
-                                country=location.get("country"),
-                                lat=location.get("lat"),
-                                lon=location.get("lon")
-                            ))
-                        print(f"✅ GeoAPI 搜索到 {len(cities)} 个城市")
-                        return cities
+            client = get_http_client("qweather")
+            response = await send_with_retry(client, "GET", url, get_retry_policy("qweather"), params=params, timeout=10.0)
+            
+            if response.status_code == 200:
+                data = response.json()
+                if data.get("code") == "200" and data.get("location"):
+                    cities = []
+                    for location in data.get("location", []):
+                        cities.append(CityInfo(
+                            name=location.get("name"),
+                            id=location.get("id"),
+                            adm1=location.get("adm1"),
+                            adm2=location.get("adm2"),
+                            country=location.get("country"),
+                            lat=location.get("lat"),
+                            lon=location.get("lon")
+                        ))
+                    print(f"✅ GeoAPI 搜索到 {len(cities)} 个城市")
+                    return cities
         except Exception as e:
             print(f"⚠️  GeoAPI调用失败，使用预定义城市列表: {e}")
     
@@ -214,9 +219,9 @@ async def search_city(query: str, limit: int = 10) -> List[CityInfo]:
     return matched_cities[:limit]
 
 
-async def get_qweather_now(location: str) -> Optional[WeatherResponse]:
+async def _fetch_qweather_now(location: str) -> Optional[WeatherResponse]:
     """
-    调用和风天气 API 获取实时天气
+    调用和风天气 API 获取实时天气（不经过缓存）
     
     Args:
         location: LocationID 或 经纬度坐标(逗号分隔，如 "116.41,39.92")
@@ -250,22 +255,173 @@ async def get_qweather_now(location: str) -> Optional[WeatherResponse]:
     }
     
     try:
-        async with httpx.AsyncClient(trust_env=False) as client:
-            response = await client.get(url, params=params, timeout=10.0)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get("code") != "200":
-                print(f"❌ 和风天气 API 错误: code={data.get('code')}")
-                return None
-            
-            return WeatherResponse(**data)
+        client = get_http_client("qweather")
+        response = await send_with_retry(client, "GET", url, get_retry_policy("qweather"), params=params, timeout=10.0)
+        response.raise_for_status()
+        data = response.json()
+        
+        if data.get("code") != "200":
+            print(f"❌ 和风天气 API 错误: code={data.get('code')}")
+            return None
+        
+        return WeatherResponse(**data)
     
     except Exception as e:
         print(f"❌ 获取天气信息失败: {e}")
         return None
 
 
+# ==================== 实时天气缓存 ====================
+
+# 和风天气实况的更新周期（秒）：缓存在 max(obsTime, updateTime) + 更新周期 时过期，
+# 并限制在 [最短, 最长] 有效期之间
+WEATHER_CACHE_INTERVAL = int(os.getenv("WEATHER_CACHE_INTERVAL", "600"))
+WEATHER_CACHE_MIN_TTL = int(os.getenv("WEATHER_CACHE_MIN_TTL", "60"))
+WEATHER_CACHE_MAX_TTL = int(os.getenv("WEATHER_CACHE_MAX_TTL", "1800"))
+# 过期后仍可直接返回（同时在后台刷新）的时间（秒）
+WEATHER_CACHE_STALE = int(os.getenv("WEATHER_CACHE_STALE", "3600"))
+# 请求失败后暂停请求该位置的时间（秒），避免 Key 无效或上游故障时每次请求都打到上游
+WEATHER_CACHE_ERROR_TTL = int(os.getenv("WEATHER_CACHE_ERROR_TTL", "30"))
+WEATHER_CACHE_MAX_ENTRIES = int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "5000"))
+
+# 位置 -> (过期时间, 可返回旧数据的截止时间, 实时天气)
+_weather_cache: "OrderedDict[str, Tuple[float, float, WeatherResponse]]" = OrderedDict()
+# 位置 -> 暂停请求的截止时间
+_weather_failures: Dict[str, float] = {}
+# 位置 -> 正在进行的上游请求
+_weather_inflight: Dict[str, asyncio.Task] = {}
+_weather_stats: Dict[str, int] = {
+    "hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "fetches": 0,
+    "background_refreshes": 0,
+    "errors": 0,
+}
+
+
+def _normalize_location(location: str) -> str:
+    """缓存键：LocationID 原样使用，经纬度保留两位小数（和风天气支持的精度）"""
+    location = location.strip()
+    if "," in location:
+        try:
+            lon, lat = (float(part) for part in location.split(",", 1))
+            return f"{lon:.2f},{lat:.2f}"
+        except ValueError:
+            pass
+    return location
+
+
+def _parse_qweather_time(value: str) -> Optional[float]:
+    """解析 2024-01-01T12:00+08:00 格式的时间"""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _weather_expiry(weather: WeatherResponse, now: float) -> float:
+    """按观测时间 / 更新时间推算下一次实况更新的时间"""
+    times = [t for t in (_parse_qweather_time(weather.now.obsTime), _parse_qweather_time(weather.updateTime)) if t]
+    expires_at = max(times) + WEATHER_CACHE_INTERVAL if times else now + WEATHER_CACHE_INTERVAL
+    return min(max(expires_at, now + WEATHER_CACHE_MIN_TTL), now + WEATHER_CACHE_MAX_TTL)
+
+
+async def _fetch_and_cache(key: str) -> Optional[WeatherResponse]:
+    _weather_stats["fetches"] += 1
+    try:
+        weather = await _fetch_qweather_now(key)
+        now = time.time()
+        if weather is None:
+            _weather_stats["errors"] += 1
+            _weather_failures[key] = now + WEATHER_CACHE_ERROR_TTL
+            return None
+        expires_at = _weather_expiry(weather, now)
+        _weather_failures.pop(key, None)
+        _weather_cache[key] = (expires_at, expires_at + WEATHER_CACHE_STALE, weather)
+        _weather_cache.move_to_end(key)
+        while len(_weather_cache) > WEATHER_CACHE_MAX_ENTRIES:
+            _weather_cache.popitem(last=False)
+        return weather
+    finally:
+        _weather_inflight.pop(key, None)
+
+
+def _start_fetch(key: str) -> asyncio.Task:
+    """同一位置同时只发起一次上游请求"""
+    task = _weather_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_cache(key))
+        _weather_inflight[key] = task
+    else:
+        _weather_stats["coalesced"] += 1
+    return task
+
+
+async def get_qweather_now(location: str) -> Optional[WeatherResponse]:
+    """
+    获取实时天气（带缓存）
+
+    - 缓存有效期按 obsTime / updateTime 对齐到下一次实况更新
+    - 同一位置的并发未命中共用一次上游请求
+    - 过期不久的数据直接返回，同时在后台刷新（stale-while-revalidate）
+
+    Args:
+        location: LocationID 或 经纬度坐标(逗号分隔，如 "116.41,39.92")
+
+    Returns:
+        WeatherResponse 或 None（失败时）
+    """
+    key = _normalize_location(location)
+    now = time.time()
+    entry = _weather_cache.get(key)
+    if entry is not None:
+        expires_at, stale_until, weather = entry
+        if now < expires_at:
+            _weather_stats["hits"] += 1
+            _weather_cache.move_to_end(key)
+            return weather
+        if now < stale_until:
+            _weather_stats["stale_hits"] += 1
+            if key not in _weather_inflight and now >= _weather_failures.get(key, 0):
+                _weather_stats["background_refreshes"] += 1
+                _start_fetch(key)
+            return weather
+
+    if now < _weather_failures.get(key, 0):
+        return None
+    _weather_stats["misses"] += 1
+    # shield: 调用方被取消时不影响其他等待同一请求的调用方
+    return await asyncio.shield(_start_fetch(key))
+
+
+async def refresh_qweather_now(location: str) -> Optional[bool]:
+    """
+    预先刷新某个位置的实时天气缓存（后台预取使用）
+
+    Returns:
+        True 已刷新；None 缓存仍在有效期内，跳过；False 请求失败
+    """
+    key = _normalize_location(location)
+    entry = _weather_cache.get(key)
+    now = time.time()
+    if entry is not None and now < entry[0]:
+        return None
+    if now < _weather_failures.get(key, 0):
+        return False
+    return await asyncio.shield(_start_fetch(key)) is not None
+
+
+def get_weather_cache_stats() -> Dict[str, int]:
+    """获取实时天气缓存统计"""
+    return {
+        "entries": len(_weather_cache),
+        "inflight": len(_weather_inflight),
+        **_weather_stats,
+    }
+
+
 async def get_weather(location: str = "101020100") -> Optional[WeatherInfo]:
     """
     获取天气信息（简化版）
@@ -0,0 +1,135 @@
+"""
+天气预取
+每天在早高峰前的固定时间，把最近活跃用户所在位置的实时天气刷新到缓存中，
+早高峰的推荐请求直接命中缓存，不再同步等待和风天气。按固定速率请求，避免占满调用额度
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from services.weather import refresh_qweather_now
+from storage.db_mysql import get_active_user_locations
+
+# 是否启用、每天执行的时间（服务器本地时间 HH:MM，逗号分隔）
+WEATHER_PREFETCH_ENABLED = os.getenv("WEATHER_PREFETCH_ENABLED", "true").lower() == "true"
+WEATHER_PREFETCH_TIMES = os.getenv("WEATHER_PREFETCH_TIMES", "06:45,07:45")
+# 活跃用户的范围（最近登录天数）、每次最多预取的位置数、每秒最多请求数
+WEATHER_PREFETCH_ACTIVE_DAYS = int(os.getenv("WEATHER_PREFETCH_ACTIVE_DAYS", "7"))
+WEATHER_PREFETCH_MAX_LOCATIONS = int(os.getenv("WEATHER_PREFETCH_MAX_LOCATIONS", "500"))
+WEATHER_PREFETCH_RATE = float(os.getenv("WEATHER_PREFETCH_RATE", "5"))
+
+_task: Optional[asyncio.Task] = None
+_stats: Dict[str, Any] = {
+    "runs": 0,
+    "refreshed": 0,
+    "skipped": 0,
+    "failed": 0,
+    "last_run_at": None,
+    "last_run_locations": 0,
+    "last_run_seconds": 0.0,
+    "next_run_at": None,
+}
+
+
+def _parse_times(value: str) -> List[tuple]:
+    """解析 "06:45,07:45" 为 [(6, 45), (7, 45)]，忽略格式错误的项"""
+    times = []
+    for item in value.split(","):
+        try:
+            hour, minute = (int(part) for part in item.strip().split(":"))
+        except ValueError:
+            continue
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            times.append((hour, minute))
+    return sorted(times)
+
+
+def _next_run(now: datetime, times: List[tuple]) -> datetime:
+    """下一次执行时间"""
+    for day in (0, 1):
+        date = now.date() + timedelta(days=day)
+        for hour, minute in times:
+            candidate = datetime(date.year, date.month, date.day, hour, minute)
+            if candidate > now:
+                return candidate
+    # times 为空时不会走到这里
+    return now + timedelta(days=1)
+
+
+async def prefetch_weather() -> Dict[str, int]:
+    """
+    刷新活跃用户所在位置的天气缓存
+
+    Returns:
+        本次刷新、跳过（缓存仍有效）、失败的位置数
+    """
+    started = time.monotonic()
+    locations = await get_active_user_locations(WEATHER_PREFETCH_ACTIVE_DAYS, WEATHER_PREFETCH_MAX_LOCATIONS)
+    result = {"refreshed": 0, "skipped": 0, "failed": 0}
+    interval = 1.0 / WEATHER_PREFETCH_RATE if WEATHER_PREFETCH_RATE > 0 else 0.0
+
+    for location in locations:
+        request_started = time.monotonic()
+        refreshed = await refresh_qweather_now(location)
+        if refreshed is None:
+            result["skipped"] += 1
+            continue
+        result["refreshed" if refreshed else "failed"] += 1
+        # 只有真正请求了上游才需要限速
+        await asyncio.sleep(max(interval - (time.monotonic() - request_started), 0.0))
+
+    elapsed = time.monotonic() - started
+    _stats["runs"] += 1
+    for name, count in result.items():
+        _stats[name] += count
+    _stats["last_run_at"] = datetime.now().isoformat(timespec="seconds")
+    _stats["last_run_locations"] = len(locations)
+    _stats["last_run_seconds"] = round(elapsed, 1)
+    print(f"🌤️ 天气预取完成: {len(locations)} 个位置，刷新 {result['refreshed']}，"
+          f"跳过 {result['skipped']}，失败 {result['failed']}，耗时 {elapsed:.1f}s")
+    return result
+
+
+async def _prefetch_loop(times: List[tuple]):
+    while True:
+        next_run = _next_run(datetime.now(), times)
+        _stats["next_run_at"] = next_run.isoformat(timespec="seconds")
+        await asyncio.sleep(max((next_run - datetime.now()).total_seconds(), 0.0))
+        try:
+            await prefetch_weather()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ 天气预取失败: {e}")
+
+
+def start_weather_prefetcher():
+    """启动天气预取定时任务（应用启动时调用）"""
+    global _task
+    if not WEATHER_PREFETCH_ENABLED or _task is not None:
+        return
+    times = _parse_times(WEATHER_PREFETCH_TIMES)
+    if not times:
+        print(f"⚠️ WEATHER_PREFETCH_TIMES 配置无效: {WEATHER_PREFETCH_TIMES}，天气预取未启动")
+        return
+    _task = asyncio.create_task(_prefetch_loop(times))
+    print(f"✅ 天气预取已启动: 每天 {', '.join(f'{h:02d}:{m:02d}' for h, m in times)}")
+
+
+async def stop_weather_prefetcher():
+    """停止天气预取定时任务（应用关闭时调用）"""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+
+
+def get_weather_prefetch_stats() -> Dict[str, Any]:
+    """获取天气预取统计"""
+    return {"enabled": _task is not None, **_stats}
@@ -0,0 +1,345 @@
+"""
+图片 blob 存储
+图片按内容的 SHA-256 寻址保存，数据库只记录哈希。相同图片只保存一份，写入是幂等的。
+
+- local: 本地文件系统，按哈希前两级分目录（ab/cd/abcd...）避免单目录文件过多
+- s3: S3 兼容对象存储（AWS S3、MinIO、阿里云 OSS 等），使用 SigV4 签名，
+  本地开发可用 MinIO 充当替身
+"""
+import asyncio
+import datetime
+import hashlib
+import hmac
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import quote
+import httpx
+from services.http_client import get_http_client
+
+# 存储类型：local / s3
+BLOB_STORE_TYPE = os.getenv("BLOB_STORE_TYPE", "local")
+# 本地存储根目录（默认位于项目目录下，与启动时的工作目录无关）
+_default_dir = Path(__file__).parent.parent / "uploads" / "blobs"
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", str(_default_dir))
+# 流式读取时每块的字节数
+BLOB_STREAM_CHUNK_SIZE = 64 * 1024
+# S3 兼容存储配置
+BLOB_S3_ENDPOINT = os.getenv("BLOB_S3_ENDPOINT", "")
+BLOB_S3_BUCKET = os.getenv("BLOB_S3_BUCKET", "")
+BLOB_S3_REGION = os.getenv("BLOB_S3_REGION", "us-east-1")
+BLOB_S3_ACCESS_KEY = os.getenv("BLOB_S3_ACCESS_KEY", "")
+BLOB_S3_SECRET_KEY = os.getenv("BLOB_S3_SECRET_KEY", "")
+BLOB_S3_PREFIX = os.getenv("BLOB_S3_PREFIX", "clothes/")
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def compute_digest(data: bytes) -> str:
+    """计算内容哈希（SHA-256 十六进制）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_valid_digest(digest: object) -> bool:
+    """是否为 64 位小写十六进制的 SHA-256 哈希"""
+    return isinstance(digest, str) and _DIGEST_RE.match(digest) is not None
+
+
+def _check_digest(digest: str) -> str:
+    """校验哈希格式，防止拼接出任意路径"""
+    if not is_valid_digest(digest):
+        raise ValueError(f"无效的内容哈希: {digest!r}")
+    return digest
+
+
+def _shard_key(digest: str) -> str:
+    """ab/cd/abcd... 形式的分片路径"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+class BlobStore(ABC):
+    """blob 存储接口，按内容哈希读写图片"""
+
+    type = "base"
+
+    def __init__(self):
+        self.stats: Dict[str, int] = {
+            "puts": 0,
+            "dedup_hits": 0,
+            "gets": 0,
+            "misses": 0,
+            "bytes_written": 0,
+            "bytes_read": 0,
+        }
+
+    async def put(self, data: bytes) -> str:
+        """保存数据并返回内容哈希，已存在时不重复写入"""
+        digest = compute_digest(data)
+        self.stats["puts"] += 1
+        if await self.exists(digest):
+            self.stats["dedup_hits"] += 1
+            return digest
+        await self._write(digest, data)
+        self.stats["bytes_written"] += len(data)
+        return digest
+
+    async def get(self, digest: str) -> Optional[bytes]:
+        """读取数据，不存在时返回 None"""
+        data = await self._read(_check_digest(digest))
+        self.stats["gets"] += 1
+        if data is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["bytes_read"] += len(data)
+        return data
+
+    def local_path(self, digest: str) -> Optional[str]:
+        """本地文件路径（可直接交给 FileResponse），非本地存储返回 None"""
+        return None
+
+    @abstractmethod
+    def stream(self, digest: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        分块读取 [start, end) 区间的数据，内存占用与对象大小无关
+
+        Args:
+            end: 结束位置（不含），None 表示读到末尾
+        """
+
+    @abstractmethod
+    async def exists(self, digest: str) -> bool:
+        """数据是否存在"""
+
+    @abstractmethod
+    async def size(self, digest: str) -> Optional[int]:
+        """数据大小（字节），不存在时返回 None"""
+
+    @abstractmethod
+    async def delete(self, digest: str) -> bool:
+        """删除数据，不存在时返回 False"""
+
+    @abstractmethod
+    async def _write(self, digest: str, data: bytes):
+        """写入数据（调用方已确认不存在）"""
+
+    @abstractmethod
+    async def _read(self, digest: str) -> Optional[bytes]:
+        """读取全部数据，不存在时返回 None"""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, **self.stats}
+
+
+class LocalBlobStore(BlobStore):
+    """本地文件系统存储，文件 I/O 在线程中执行"""
+
+    type = "local"
+
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = os.path.abspath(root)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, *_shard_key(_check_digest(digest)).split("/"))
+
+    def local_path(self, digest: str) -> Optional[str]:
+        path = self._path(digest)
+        return path if os.path.isfile(path) else None
+
+    async def exists(self, digest: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self._path(digest))
+
+    async def size(self, digest: str) -> Optional[int]:
+        try:
+            return await asyncio.to_thread(os.path.getsize, self._path(digest))
+        except OSError:
+            return None
+
+    async def delete(self, digest: str) -> bool:
+        try:
+            await asyncio.to_thread(os.remove, self._path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def stream(self, digest: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        f = await asyncio.to_thread(open, self._path(digest), "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                size = BLOB_STREAM_CHUNK_SIZE if remaining is None else min(BLOB_STREAM_CHUNK_SIZE, remaining)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+    def _write_file(self, path: str, data: bytes):
+        """先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    async def _write(self, digest: str, data: bytes):
+        await asyncio.to_thread(self._write_file, self._path(digest), data)
+
+    def _read_file(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def _read(self, digest: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read_file, self._path(digest))
+
+
+class S3BlobStore(BlobStore):
+    """S3 兼容对象存储（路径风格地址：{endpoint}/{bucket}/{key}）"""
+
+    type = "s3"
+
+    def __init__(self, endpoint: str, bucket: str, region: str, access_key: str, secret_key: str, prefix: str = ""):
+        super().__init__()
+        if not endpoint or not bucket:
+            raise ValueError("S3 存储需要配置 BLOB_S3_ENDPOINT 和 BLOB_S3_BUCKET")
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix
+
+    def _url(self, digest: str) -> str:
+        key = self.prefix + _shard_key(_check_digest(digest))
+        return f"{self.endpoint}/{quote(self.bucket)}/{quote(key)}"
+
+    def _sign(self, method: str, url: str, payload_hash: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """生成 AWS Signature Version 4 请求头"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        parsed = httpx.URL(url)
+
+        signed = {
+            "host": parsed.netloc.decode(),
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": amz_date,
+            **{name.lower(): value.strip() for name, value in (headers or {}).items()},
+        }
+        names = sorted(signed)
+        signed_headers = ";".join(names)
+        canonical_request = "\n".join([
+            method,
+            quote(parsed.path, safe="/-_.~"),
+            "",
+            "".join(f"{name}:{signed[name]}\n" for name in names),
+            signed_headers,
+            payload_hash,
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+
+        key = ("AWS4" + self.secret_key).encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        result = {name: value for name, value in signed.items() if name != "host"}
+        result["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return result
+
+    async def stream(self, digest: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        url = self._url(digest)
+        range_headers = {}
+        if start or end is not None:
+            range_headers["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        headers = self._sign("GET", url, hashlib.sha256(b"").hexdigest(), range_headers)
+        async with get_http_client("blob").stream("GET", url, headers=headers) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(BLOB_STREAM_CHUNK_SIZE):
+                yield chunk
+
+    async def _request(self, method: str, digest: str, data: bytes = b"") -> httpx.Response:
+        url = self._url(digest)
+        headers = self._sign(method, url, hashlib.sha256(data).hexdigest())
+        return await get_http_client("blob").request(method, url, headers=headers, content=data or None)
+
+    async def exists(self, digest: str) -> bool:
+        return await self.size(digest) is not None
+
+    async def size(self, digest: str) -> Optional[int]:
+        response = await self._request("HEAD", digest)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return int(response.headers.get("Content-Length", 0))
+
+    async def delete(self, digest: str) -> bool:
+        response = await self._request("DELETE", digest)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    async def _write(self, digest: str, data: bytes):
+        response = await self._request("PUT", digest, data)
+        response.raise_for_status()
+
+    async def _read(self, digest: str) -> Optional[bytes]:
+        response = await self._request("GET", digest)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content
+
+
+_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """按 BLOB_STORE_TYPE 获取全局 blob 存储"""
+    global _store
+    if _store is None:
+        if BLOB_STORE_TYPE == "s3":
+            _store = S3BlobStore(
+                BLOB_S3_ENDPOINT,
+                BLOB_S3_BUCKET,
+                BLOB_S3_REGION,
+                BLOB_S3_ACCESS_KEY,
+                BLOB_S3_SECRET_KEY,
+                BLOB_S3_PREFIX,
+            )
+        else:
+            _store = LocalBlobStore(BLOB_STORE_DIR)
+    return _store
+
+
+def get_blob_store_stats() -> Dict[str, Any]:
+    """获取 blob 存储的读写统计"""
+    return get_blob_store().to_dict()
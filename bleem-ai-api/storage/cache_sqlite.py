@@ -0,0 +1,55 @@
+"""
+本地 SQLite 缓存存储
+用于分析结果缓存的持久层（ANALYSIS_CACHE_PERSIST=sqlite）
+"""
+import aiosqlite
+import json
+import os
+from pathlib import Path
+from typing import Optional, Dict, Any
+from storage.models import ANALYSIS_CACHE_TABLE_SQL_SQLITE
+
+# 缓存数据库文件路径
+_default_path = Path(__file__).parent.parent / "cache.db"
+CACHE_DB_PATH = Path(os.getenv("CACHE_DB_PATH", _default_path))
+
+_initialized = False
+
+
+async def _ensure_tables(db: aiosqlite.Connection):
+    """首次使用时创建缓存表"""
+    global _initialized
+    if _initialized:
+        return
+    await db.execute(ANALYSIS_CACHE_TABLE_SQL_SQLITE)
+    await db.commit()
+    _initialized = True
+
+
+async def get_analysis_cache(cache_key: str, now: int) -> Optional[Dict[str, Any]]:
+    """SQLite 读取未过期的分析结果缓存"""
+    if not CACHE_DB_PATH.parent.exists():
+        CACHE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    async with aiosqlite.connect(CACHE_DB_PATH) as db:
+        await _ensure_tables(db)
+        async with db.execute(
+            "SELECT kind, result, expires_at FROM analysis_cache WHERE cache_key = ? AND expires_at > ?",
+            (cache_key, now)
+        ) as cursor:
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            return {"kind": row[0], "result": json.loads(row[1]), "expires_at": row[2]}
+
+
+async def save_analysis_cache(cache_key: str, kind: str, result: Dict[str, Any], expires_at: int) -> None:
+    """SQLite 写入分析结果缓存（已存在则覆盖）"""
+    if not CACHE_DB_PATH.parent.exists():
+        CACHE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    async with aiosqlite.connect(CACHE_DB_PATH) as db:
+        await _ensure_tables(db)
+        await db.execute(
+            "INSERT OR REPLACE INTO analysis_cache (cache_key, kind, result, expires_at) VALUES (?, ?, ?, ?)",
+            (cache_key, kind, json.dumps(result, ensure_ascii=False), expires_at)
+        )
+        await db.commit()
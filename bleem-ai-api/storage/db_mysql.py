@@ -5,20 +5,26 @@
 """
 import aiosqlite
 import aiomysql
+import asyncio
 import json
 import os
+import time
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator
 from datetime import datetime
 from domain.clothes import ClothesItem, ClothesCreate
 from storage.db_config import DB_TYPE, get_mysql_pool, DB_CONFIG
 from domain.config import ApiConfig
+from storage.blob_store import get_blob_store, is_valid_digest
 
 from storage.models import (
     USERS_TABLE_SQL_MYSQL,
     API_CONFIG_TABLE_SQL_MYSQL,
     CLOTHES_TABLE_SQL_MYSQL,
-    CLOTHES_INDEX_SQL_MYSQL
+    CLOTHES_INDEX_SQL_MYSQL,
+    CLOTHES_SEASON_TABLE_SQL_MYSQL,
+    CLOTHES_IMAGE_HASH_COLUMN_SQL_MYSQL,
+    ANALYSIS_CACHE_TABLE_SQL_MYSQL
 )
 
 async def init_db():
@@ -39,6 +45,25 @@ async def _init_mysql_db():
             await cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database_name} CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
         await conn.commit()
 
+    # 创建分析结果缓存表
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(ANALYSIS_CACHE_TABLE_SQL_MYSQL)
+        await conn.commit()
+
+    # 为 clothes 表添加图片内容哈希列（图片迁出到 blob 存储）
+    try:
+        await _ensure_clothes_image_hash_column(database_name)
+    except Exception as e:
+        print(f"⚠️ 添加 image_hash 列失败: {e}")
+
+    # 创建衣物季节索引表，为缺少季节行的衣物从 clothes.season_semantics 回填
+    try:
+        await _init_clothes_season_index()
+    except Exception as e:
+        print(f"⚠️ 初始化衣物季节索引失败: {e}")
+
     # 现在连接到指定数据库并创建表
     # pool = await get_mysql_pool()
     # async with pool.acquire() as conn:
@@ -64,8 +89,58 @@ async def _init_mysql_db():
 
 
 
+# 衣物元数据字段：列表和详情查询使用显式投影，不读取 image_data（LONGBLOB），图片通过 iter_clothes_image 分块读取
+_CLOTHES_COLUMNS = (
+    "id", "user_id", "category", "item", "style_semantics", "season_semantics",
+    "usage_semantics", "color_semantics", "description", "image_filename", "image_hash", "created_at"
+)
+
+# 分块读取图片时每次查询的字节数
+CLOTHES_IMAGE_CHUNK_SIZE = int(os.getenv("CLOTHES_IMAGE_CHUNK_SIZE", str(256 * 1024)))
+
+
+def _clothes_columns(alias: str = "") -> str:
+    """衣物元数据字段列表，alias 为表别名"""
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(prefix + column for column in _CLOTHES_COLUMNS)
+
+
+async def _ensure_clothes_image_hash_column(database_name: str):
+    """clothes 表缺少 image_hash 列时添加"""
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT COUNT(*) FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'clothes' AND COLUMN_NAME = 'image_hash'
+                """,
+                (database_name,)
+            )
+            (exists,) = await cursor.fetchone()
+            if not exists:
+                await cursor.execute(CLOTHES_IMAGE_HASH_COLUMN_SQL_MYSQL)
+                print("✅ clothes 表已添加 image_hash 列")
+        await conn.commit()
+
+
 async def add_clothes(clothes: ClothesCreate) -> int:
-    """MySQL 添加衣物"""
+    """
+    MySQL 添加衣物，图片写入 blob 存储，数据库只保存内容哈希
+
+    Raises:
+        ValueError: image_hash 格式无效，或 blob 存储中不存在该图片
+    """
+    image_hash = clothes.image_hash
+    if image_hash is not None:
+        # 客户端传入的哈希必须指向已保存的图片，避免产生悬空引用
+        if not is_valid_digest(image_hash):
+            raise ValueError(f"无效的图片哈希: {image_hash!r}")
+        if not await get_blob_store().exists(image_hash):
+            raise ValueError(f"图片不存在: {image_hash}")
+    elif clothes.image_data:
+        image_hash = await get_blob_store().put(clothes.image_data)
+
     pool = await get_mysql_pool()
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
@@ -73,7 +148,7 @@ async def add_clothes(clothes: ClothesCreate) -> int:
                 """
                 INSERT INTO clothes (
                     category, item, style_semantics, season_semantics,
-                    usage_semantics, color_semantics, description, image_filename, image_data,user_id
+                    usage_semantics, color_semantics, description, image_filename, image_hash,user_id
                 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s,%s)
                 """,
                 (
@@ -85,12 +160,16 @@ async def add_clothes(clothes: ClothesCreate) -> int:
                     clothes.color_semantics,
                     clothes.description,
                     clothes.image_filename,
-                    clothes.image_data,
+                    image_hash,
                     clothes.user_id
                 )
             )
+            clothes_id = cursor.lastrowid
+            await _replace_clothes_seasons(
+                cursor, clothes_id, clothes.user_id, clothes.category, clothes.season_semantics
+            )
             await conn.commit()
-            return cursor.lastrowid
+            return clothes_id
 
 async def get_all_clothes(user_id:str) -> List[ClothesItem]:
     """MySQL 获取所有衣物"""
@@ -101,7 +180,7 @@ async def get_all_clothes(user_id:str) -> List[ClothesItem]:
             await conn.begin()
             # 强制读取最新数据，不使用缓存
             await cursor.execute(
-                "SELECT * FROM clothes WHERE del_flag = 0 and user_id = %s ORDER BY created_at DESC",
+                f"SELECT {_clothes_columns()} FROM clothes WHERE del_flag = 0 and user_id = %s ORDER BY created_at DESC",
                 (user_id,)
             )
             rows = await cursor.fetchall()
@@ -117,7 +196,7 @@ async def get_clothes_by_category(category: str,user_id:str) -> List[ClothesItem
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
             await cursor.execute(
-                "SELECT * FROM clothes WHERE del_flag = 0 and category = %s AND user_id = %s ORDER BY created_at DESC",
+                f"SELECT {_clothes_columns()} FROM clothes WHERE del_flag = 0 and category = %s AND user_id = %s ORDER BY created_at DESC",
                 (category,user_id)
             )
             rows = await cursor.fetchall()
@@ -131,7 +210,7 @@ async def get_clothes_by_id(clothes_id: int,user_id:str) -> Optional[ClothesItem
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
             await cursor.execute(
-                "SELECT * FROM clothes WHERE del_flag = 0 and  id = %s AND user_id = %s",
+                f"SELECT {_clothes_columns()} FROM clothes WHERE del_flag = 0 and  id = %s AND user_id = %s",
                 (clothes_id,user_id)
             )
             row = await cursor.fetchone()
@@ -147,6 +226,112 @@ async def get_clothes_by_id(clothes_id: int,user_id:str) -> Optional[ClothesItem
             return None
 
 
+async def get_clothes_image_info(clothes_id: int, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    获取衣物图片的文件名、内容哈希和大小，不读取图片数据
+
+    Returns:
+        {"id", "image_filename", "image_hash", "size", "data_hash", "created_at"}，衣物不存在或没有图片时返回 None；
+        image_hash 不为空时图片在 blob 存储中，size 为空；
+        否则图片在 image_data 中，data_hash 为数据库端计算的 SHA-256（不传输图片数据）
+    """
+    sql = (
+        "SELECT id, image_filename, image_hash, LENGTH(image_data) AS size, "
+        "IF(image_hash IS NULL, SHA2(image_data, 256), NULL) AS data_hash, created_at "
+        "FROM clothes WHERE del_flag = 0 and id = %s"
+    )
+    args: Tuple = (clothes_id,)
+    if user_id is not None:
+        sql += " AND user_id = %s"
+        args += (user_id,)
+
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, args)
+            row = await cursor.fetchone()
+    if not row or not (row["image_hash"] or row["size"]):
+        return None
+    return row
+
+
+async def iter_clothes_image(
+    clothes_id: int,
+    chunk_size: int = CLOTHES_IMAGE_CHUNK_SIZE,
+    start: int = 0,
+    end: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    分块读取仍保存在 clothes.image_data 中的旧图片数据
+
+    每次用 SUBSTRING 只取一块，读取之间归还连接，
+    不会一次把整张图片读进内存，也不会在客户端慢速下载时长期占用连接池
+
+    Args:
+        start: 起始字节位置
+        end: 结束字节位置（不含），None 表示读到末尾
+
+    Yields:
+        图片数据块
+    """
+    pool = await get_mysql_pool()
+    offset = start + 1  # SUBSTRING 从 1 开始计数
+    while end is None or offset <= end:
+        size = chunk_size if end is None else min(chunk_size, end - offset + 1)
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT SUBSTRING(image_data, %s, %s) FROM clothes WHERE id = %s",
+                    (offset, size, clothes_id)
+                )
+                row = await cursor.fetchone()
+        chunk = row[0] if row else None
+        if not chunk:
+            return
+        yield bytes(chunk)
+        if len(chunk) < size:
+            return
+        offset += len(chunk)
+
+
+async def list_clothes_with_inline_images(after_id: int, limit: int) -> List[int]:
+    """按 ID 顺序列出图片仍保存在 image_data 中的衣物（迁移到 blob 存储用）"""
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT id FROM clothes
+                WHERE id > %s AND image_hash IS NULL AND image_data IS NOT NULL
+                ORDER BY id
+                LIMIT %s
+                """,
+                (after_id, limit)
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+
+async def set_clothes_image_hash(clothes_id: int, image_hash: str, clear_data: bool = True) -> bool:
+    """
+    记录已迁移到 blob 存储的图片哈希
+
+    Args:
+        clear_data: 同时清空 image_data 释放数据库空间
+    """
+    sql = "UPDATE clothes SET image_hash = %s"
+    if clear_data:
+        sql += ", image_data = NULL"
+    sql += " WHERE id = %s AND image_hash IS NULL"
+
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(sql, (image_hash, clothes_id))
+            updated = cursor.rowcount > 0
+        await conn.commit()
+    return updated
+
+
 async def delete_clothes(clothes_id: int) -> bool:
     """MySQL 删除衣物"""
     pool = await get_mysql_pool()
@@ -162,8 +347,10 @@ async def delete_clothes(clothes_id: int) -> bool:
                 "update clothes set del_flag = 1 WHERE id = %s",
                 (clothes_id,)
             )
+            deleted = cursor.rowcount > 0
+            await cursor.execute("DELETE FROM clothes_season WHERE clothes_id = %s", (clothes_id,))
             await conn.commit()
-            return cursor.rowcount > 0
+            return deleted
 
 
 async def update_clothes(clothes_id: int, clothes: ClothesCreate) -> bool:
@@ -172,7 +359,7 @@ async def update_clothes(clothes_id: int, clothes: ClothesCreate) -> bool:
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
             # 先检查记录是否存在
-            await cursor.execute("SELECT id FROM clothes WHERE del_flag = 0 and id = %s", (clothes_id,))
+            await cursor.execute("SELECT id, user_id FROM clothes WHERE del_flag = 0 and id = %s", (clothes_id,))
             exists = await cursor.fetchone()
             print(f"clothes_id: {clothes_id}, exists: {exists}")
             if not exists:
@@ -199,6 +386,9 @@ async def update_clothes(clothes_id: int, clothes: ClothesCreate) -> bool:
                     clothes_id
                 )
             )
+            await _replace_clothes_seasons(
+                cursor, clothes_id, exists[1], clothes.category, clothes.season_semantics
+            )
 
             await conn.commit()
             return True
@@ -233,6 +423,7 @@ def _row_to_clothes_item(row: Dict[str, Any]) -> ClothesItem:
             color_semantics=row.get("color_semantics") or "",
             description=row.get("description") or "",
             image_url=f"/api/clothes/image/{row['id']}",
+            image_hash=row.get("image_hash"),
             created_at=created_at
         )
 
@@ -246,35 +437,289 @@ def _row_to_clothes_item(row: Dict[str, Any]) -> ClothesItem:
 
 
 
-# ==================== Api相关操作 ====================
+# ==================== 推荐候选衣物 ====================
 
-async def update_api_count(api_id: int) -> bool:
-    """MySQL 更新衣物信息"""
+def _normalize_seasons(seasons: Optional[List[str]]) -> List[str]:
+    """去除空白和重复的季节标签"""
+    normalized = []
+    for season in seasons or []:
+        season = str(season).strip()[:20]
+        if season and season not in normalized:
+            normalized.append(season)
+    return normalized
+
+
+async def _replace_clothes_seasons(cursor, clothes_id: int, user_id, category: str, seasons: List[str]):
+    """重写某件衣物在 clothes_season 中的季节行（调用方负责提交事务）"""
+    await cursor.execute("DELETE FROM clothes_season WHERE clothes_id = %s", (clothes_id,))
+    rows = [(clothes_id, user_id, category, season) for season in _normalize_seasons(seasons)]
+    if rows:
+        await cursor.executemany(
+            "INSERT INTO clothes_season (clothes_id, user_id, category, season) VALUES (%s, %s, %s, %s)",
+            rows
+        )
+
+
+async def _init_clothes_season_index():
+    """
+    创建 clothes_season 表，并为还没有季节行的衣物从 season_semantics 回填
+
+    按衣物逐条检查（LEFT JOIN 反连接）而不是只在表为空时回填，
+    滚动发布期间旧版本进程写入的衣物在下次启动时也会补上索引
+    """
     pool = await get_mysql_pool()
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
-            # 先检查记录是否存在
-            await cursor.execute("SELECT id FROM api_config WHERE del_flag = 0 and id = %s", (api_id,))
-            exists = await cursor.fetchone()
-            print(f"api_id: {api_id}, exists: {exists}")
-            if not exists:
-                return False
-
-            # 执行更新
+            await cursor.execute(CLOTHES_SEASON_TABLE_SQL_MYSQL)
+            # 只读取回填需要的字段，不读取图片数据
             await cursor.execute(
                 """
-                UPDATE api_config
-                SET usage_count = usage_count + 1
-                WHERE id = %s
-                """,
-                (
-                    api_id
+                SELECT c.id, c.user_id, c.category, c.season_semantics
+                FROM clothes c
+                LEFT JOIN clothes_season s ON s.clothes_id = c.id
+                WHERE c.del_flag = 0 AND s.clothes_id IS NULL
+                """
+            )
+            rows = []
+            for clothes_id, user_id, category, season_semantics in await cursor.fetchall():
+                try:
+                    seasons = json.loads(season_semantics or "[]")
+                except (TypeError, ValueError):
+                    continue
+                rows.extend(
+                    (clothes_id, user_id, category, season)
+                    for season in _normalize_seasons(seasons)
+                )
+            if rows:
+                await cursor.executemany(
+                    "INSERT IGNORE INTO clothes_season (clothes_id, user_id, category, season) VALUES (%s, %s, %s, %s)",
+                    rows
+                )
+        await conn.commit()
+    if rows:
+        print(f"✅ 已回填衣物季节索引: {len(rows)} 行")
+
+
+async def count_recommendation_candidates(user_id: str, seasons: List[str]) -> Dict[str, int]:
+    """
+    统计各分类可用于推荐的衣物数量
+
+    某分类没有适合当前季节的衣物时，返回该分类的全部衣物数量
+
+    Returns:
+        {分类: 数量}
+    """
+    seasons = _normalize_seasons(seasons)
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            matched: Dict[str, int] = {}
+            if seasons:
+                placeholders = ", ".join(["%s"] * len(seasons))
+                await cursor.execute(
+                    f"""
+                    SELECT category, COUNT(DISTINCT clothes_id)
+                    FROM clothes_season
+                    WHERE user_id = %s AND season IN ({placeholders})
+                    GROUP BY category
+                    """,
+                    (user_id, *seasons)
                 )
+                matched = {category: count for category, count in await cursor.fetchall()}
+
+            await cursor.execute(
+                "SELECT category, COUNT(*) FROM clothes WHERE del_flag = 0 AND user_id = %s GROUP BY category",
+                (user_id,)
             )
-            await conn.commit()
-            return True
+            totals = {category: count for category, count in await cursor.fetchall()}
+
+    return {category: matched.get(category) or total for category, total in totals.items()}
+
+
+async def sample_recommendation_candidates(
+    user_id: str,
+    category: str,
+    seasons: List[str],
+    limit: int = 1
+) -> List[ClothesItem]:
+    """
+    随机抽取指定分类的衣物，优先选择适合当前季节的
+
+    季节筛选和随机抽样都在数据库中完成，不读取图片数据
+
+    Args:
+        user_id: 用户ID
+        category: 衣物分类（top / bottom / shoes）
+        seasons: 适合的季节
+        limit: 抽取数量
+    """
+    seasons = _normalize_seasons(seasons)
+    if seasons:
+        placeholders = ", ".join(["%s"] * len(seasons))
+        season_match = (
+            "EXISTS (SELECT 1 FROM clothes_season s "
+            f"WHERE s.clothes_id = c.id AND s.season IN ({placeholders}))"
+        )
+    else:
+        season_match = "0"
+
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(
+                f"""
+                SELECT {_clothes_columns("c")}, {season_match} AS season_match
+                FROM clothes c
+                WHERE c.del_flag = 0 AND c.user_id = %s AND c.category = %s
+                ORDER BY season_match DESC, RAND()
+                LIMIT %s
+                """,
+                (*seasons, user_id, category, limit)
+            )
+            rows = await cursor.fetchall()
+
+    return [_row_to_clothes_item(row) for row in rows]
+
+
+
+# ==================== Api相关操作 ====================
+
+# API 配置进程内缓存（秒），避免每次分析都查询一次 api_config
+API_CONFIG_CACHE_TTL = float(os.getenv("API_CONFIG_CACHE_TTL", "30"))
+
+# api_type -> (过期时间, 配置列表)
+_api_config_cache: Dict[str, Tuple[float, List[ApiConfig]]] = {}
+_api_config_lock = asyncio.Lock()
+
+# 使用次数写回间隔（秒）
+API_USAGE_FLUSH_INTERVAL = float(os.getenv("API_USAGE_FLUSH_INTERVAL", "5"))
+
+# api_id -> 尚未写回数据库的使用次数
+_pending_usage: Dict[int, int] = {}
+_usage_flush_task: Optional[asyncio.Task] = None
+
+
+def invalidate_api_config_cache(api_type: Optional[str] = None) -> None:
+    """
+    使 API 配置缓存失效，修改 api_config 表后调用
+
+    Args:
+        api_type: 只清除指定类型，None 表示全部清除
+    """
+    if api_type is None:
+        _api_config_cache.clear()
+    else:
+        _api_config_cache.pop(api_type, None)
+
+
+def _bump_cached_usage(api_id: int) -> None:
+    """同步更新缓存中的使用次数，使最少使用的 Key 优先的选择逻辑在缓存期内依然生效"""
+    for _, configs in _api_config_cache.values():
+        for config in configs:
+            if config.id == api_id:
+                config.usage_count += 1
+                return
+
+
+async def update_api_count(api_id: int) -> bool:
+    """
+    记录一次 API 使用
+    只在内存中累加，由后台任务每 API_USAGE_FLUSH_INTERVAL 秒合并为一条 UPDATE 写回数据库
+    """
+    _pending_usage[api_id] = _pending_usage.get(api_id, 0) + 1
+    _bump_cached_usage(api_id)
+    return True
+
+
+async def flush_api_usage() -> int:
+    """
+    将内存中累计的使用次数批量写回 api_config
+
+    Returns:
+        本次写回的配置条数
+    """
+    if not _pending_usage:
+        return 0
+    pending = dict(_pending_usage)
+    _pending_usage.clear()
+
+    api_ids = list(pending.keys())
+    case_sql = " ".join(["WHEN %s THEN %s"] * len(api_ids))
+    in_sql = ", ".join(["%s"] * len(api_ids))
+    params = [value for api_id in api_ids for value in (api_id, pending[api_id])] + api_ids
+    try:
+        pool = await get_mysql_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"""
+                    UPDATE api_config
+                    SET usage_count = usage_count + CASE id {case_sql} ELSE 0 END
+                    WHERE del_flag = 0 AND id IN ({in_sql})
+                    """,
+                    params
+                )
+                await conn.commit()
+                if cursor.rowcount < len(api_ids):
+                    # 部分配置已被删除，缓存已过时
+                    invalidate_api_config_cache()
+    except Exception:
+        # 写回失败时把计数放回，等待下次重试
+        for api_id, count in pending.items():
+            _pending_usage[api_id] = _pending_usage.get(api_id, 0) + count
+        raise
+    return len(api_ids)
+
+
+async def _api_usage_flush_loop():
+    while True:
+        await asyncio.sleep(API_USAGE_FLUSH_INTERVAL)
+        try:
+            await flush_api_usage()
+        except Exception as e:
+            print(f"⚠️ API 使用次数写回失败: {e}")
+
+
+def start_api_usage_flusher() -> None:
+    """启动后台写回任务（应用启动时调用）"""
+    global _usage_flush_task
+    if _usage_flush_task is None:
+        _usage_flush_task = asyncio.create_task(_api_usage_flush_loop())
+
+
+async def stop_api_usage_flusher() -> None:
+    """停止后台写回任务并写回剩余计数（应用关闭时调用）"""
+    global _usage_flush_task
+    if _usage_flush_task is not None:
+        _usage_flush_task.cancel()
+        try:
+            await _usage_flush_task
+        except asyncio.CancelledError:
+            pass
+        _usage_flush_task = None
+    try:
+        await flush_api_usage()
+    except Exception as e:
+        print(f"⚠️ API 使用次数写回失败: {e}")
 
 async def get_api_config(api_type: str) -> List[ApiConfig]:
+    """
+    获取API配置（按使用次数升序）
+    结果在进程内缓存 API_CONFIG_CACHE_TTL 秒，缓存期内按本地累计的使用次数重新排序
+    """
+    cached = _api_config_cache.get(api_type)
+    if cached is None or cached[0] <= time.monotonic():
+        async with _api_config_lock:
+            # 等锁期间可能已被其他请求刷新
+            cached = _api_config_cache.get(api_type)
+            if cached is None or cached[0] <= time.monotonic():
+                configs = await _load_api_config(api_type)
+                cached = (time.monotonic() + API_CONFIG_CACHE_TTL, configs)
+                _api_config_cache[api_type] = cached
+    return sorted(cached[1], key=lambda c: c.usage_count)
+
+
+async def _load_api_config(api_type: str) -> List[ApiConfig]:
     """MySQL 获取API配置"""
     pool = await get_mysql_pool()
     async with pool.acquire() as conn:
@@ -299,6 +744,44 @@ async def get_api_config(api_type: str) -> List[ApiConfig]:
             ) for row in rows]
 
 
+# ==================== 分析结果缓存 ====================
+
+async def get_analysis_cache(cache_key: str, now: int) -> Optional[Dict[str, Any]]:
+    """MySQL 读取未过期的分析结果缓存"""
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(
+                "SELECT kind, result, expires_at FROM analysis_cache WHERE cache_key = %s AND expires_at > %s",
+                (cache_key, now)
+            )
+            row = await cursor.fetchone()
+            await conn.commit()
+            if not row:
+                return None
+            return {
+                "kind": row["kind"],
+                "result": json.loads(row["result"]),
+                "expires_at": row["expires_at"]
+            }
+
+
+async def save_analysis_cache(cache_key: str, kind: str, result: Dict[str, Any], expires_at: int) -> None:
+    """MySQL 写入分析结果缓存（已存在则覆盖）"""
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO analysis_cache (cache_key, kind, result, expires_at)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE kind = VALUES(kind), result = VALUES(result), expires_at = VALUES(expires_at)
+                """,
+                (cache_key, kind, json.dumps(result, ensure_ascii=False), expires_at)
+            )
+            await conn.commit()
+
+
 # ==================== 用户相关操作 ====================
 
 async def get_or_create_user(openid: str, user_data: Dict[str, Any]) -> int:
@@ -391,6 +874,39 @@ async def get_user_by_openid(openid: str) -> Optional[Dict[str, Any]]:
             return await cursor.fetchone()
 
 
+async def get_active_user_locations(since_days: int, limit: int) -> List[str]:
+    """
+    获取最近活跃用户的不同位置，按用户数从多到少排列
+
+    有 LocationID 时使用 LocationID，否则使用 "经度,纬度"（保留两位小数，与天气缓存的键一致）
+
+    Args:
+        since_days: 最近登录的天数
+        limit: 最多返回的位置数
+    """
+    pool = await get_mysql_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT location, COUNT(*) AS users FROM (
+                    SELECT COALESCE(
+                        NULLIF(location_id, ''),
+                        CONCAT(ROUND(longitude, 2), ',', ROUND(latitude, 2))
+                    ) AS location
+                    FROM users
+                    WHERE last_login >= NOW() - INTERVAL %s DAY
+                ) AS active
+                WHERE location IS NOT NULL
+                GROUP BY location
+                ORDER BY users DESC
+                LIMIT %s
+                """,
+                (since_days, limit)
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+
 async def update_user_location(openid: str, latitude: float, longitude: float, city: str):
     """MySQL 更新用户位置信息"""
     pool = await get_mysql_pool()
@@ -0,0 +1,151 @@
+"""
+本地 SQLite 任务队列存储
+异步分析任务（上传的图片、状态、结果）持久化到本地文件，服务重启后未完成的任务会重新排队
+"""
+import aiosqlite
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+from storage.models import ANALYSIS_JOBS_TABLE_SQL_SQLITE, ANALYSIS_JOBS_INDEX_SQL_SQLITE
+
+# 任务数据库文件路径
+_default_path = Path(__file__).parent.parent / "jobs.db"
+JOB_DB_PATH = Path(os.getenv("JOB_DB_PATH", _default_path))
+# 单个任务最多执行次数；执行中途进程退出的任务重启后重新排队，超过次数则标记为失败
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# 查询任务状态时返回的字段（不包含图片）
+_JOB_COLUMNS = "id, kind, status, callback_url, result, error, attempts, created_at, started_at, finished_at"
+
+
+def _connect() -> aiosqlite.Connection:
+    return aiosqlite.connect(JOB_DB_PATH, timeout=30)
+
+
+def _row_to_job(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "status": row[2],
+        "callback_url": row[3],
+        "result": json.loads(row[4]) if row[4] else None,
+        "error": row[5],
+        "attempts": row[6],
+        "created_at": row[7],
+        "started_at": row[8],
+        "finished_at": row[9],
+    }
+
+
+async def init_job_store() -> int:
+    """
+    创建任务表，并把上次退出时仍在执行中的任务重新排队
+
+    已执行 JOB_MAX_ATTEMPTS 次的任务不再排队，直接标记为失败，
+    避免每次执行都导致进程崩溃的任务在每次重启后无限重试
+
+    Returns:
+        重新排队的任务数
+    """
+    JOB_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    async with _connect() as db:
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute(ANALYSIS_JOBS_TABLE_SQL_SQLITE)
+        await db.execute(ANALYSIS_JOBS_INDEX_SQL_SQLITE)
+        cursor = await db.execute(
+            "UPDATE analysis_jobs SET status = 'failed', error = ?, finished_at = ?, image = NULL "
+            "WHERE status = 'running' AND attempts >= ?",
+            (f"任务执行 {JOB_MAX_ATTEMPTS} 次均中断，已放弃", time.time(), JOB_MAX_ATTEMPTS)
+        )
+        if cursor.rowcount:
+            print(f"⚠️ {cursor.rowcount} 个任务已达最大执行次数 ({JOB_MAX_ATTEMPTS})，标记为失败")
+        cursor = await db.execute(
+            "UPDATE analysis_jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+        )
+        await db.commit()
+        return cursor.rowcount
+
+
+async def enqueue_job(job_id: str, kind: str, image: bytes, callback_url: Optional[str]) -> None:
+    """写入一个待处理任务"""
+    async with _connect() as db:
+        await db.execute(
+            "INSERT INTO analysis_jobs (id, kind, status, image, callback_url, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, image, callback_url, time.time())
+        )
+        await db.commit()
+
+
+async def claim_next_job() -> Optional[Dict[str, Any]]:
+    """
+    取出最早的待处理任务并标记为执行中
+
+    Returns:
+        任务字典（包含 image 字段），没有待处理任务时返回 None
+    """
+    async with _connect() as db:
+        # BEGIN IMMEDIATE 先拿写锁，保证同一任务不会被两个工作协程领取
+        await db.execute("BEGIN IMMEDIATE")
+        async with db.execute(
+            f"SELECT {_JOB_COLUMNS}, image FROM analysis_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+        ) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            await db.rollback()
+            return None
+        started_at = time.time()
+        await db.execute(
+            "UPDATE analysis_jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+            (started_at, row[0])
+        )
+        await db.commit()
+        job = _row_to_job(row)
+        job["image"] = row[10]
+        job["status"] = "running"
+        job["started_at"] = started_at
+        job["attempts"] += 1
+        return job
+
+
+async def finish_job(job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+    """记录任务结果（error 为空表示成功），并清空已不需要的图片数据"""
+    async with _connect() as db:
+        await db.execute(
+            "UPDATE analysis_jobs SET status = ?, result = ?, error = ?, finished_at = ?, image = NULL WHERE id = ?",
+            (
+                "failed" if error else "succeeded",
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error,
+                time.time(),
+                job_id
+            )
+        )
+        await db.commit()
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """查询任务状态与结果"""
+    async with _connect() as db:
+        async with db.execute(f"SELECT {_JOB_COLUMNS} FROM analysis_jobs WHERE id = ?", (job_id,)) as cursor:
+            row = await cursor.fetchone()
+            return _row_to_job(row) if row else None
+
+
+async def count_jobs_by_status() -> Dict[str, int]:
+    """各状态的任务数"""
+    async with _connect() as db:
+        async with db.execute("SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status") as cursor:
+            return {status: count for status, count in await cursor.fetchall()}
+
+
+async def purge_finished_jobs(before: float) -> int:
+    """删除指定时间之前已结束的任务，返回删除条数"""
+    async with _connect() as db:
+        cursor = await db.execute(
+            "DELETE FROM analysis_jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+            (before,)
+        )
+        await db.commit()
+        return cursor.rowcount
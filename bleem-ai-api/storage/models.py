@@ -62,7 +62,8 @@ CREATE TABLE IF NOT EXISTS clothes (
     color_semantics VARCHAR(50) COMMENT '颜色语义，如 深色系 / 浅色系 / 中性色',
     description TEXT COMMENT '一句话语义总结',
     image_filename VARCHAR(255) NOT NULL COMMENT '上传的图片文件名',
-    image_data LONGBLOB COMMENT '图片二进制数据',
+    image_data LONGBLOB COMMENT '图片二进制数据（旧数据，新图片保存在 blob 存储中）',
+    image_hash CHAR(64) NULL COMMENT '图片内容哈希（SHA-256），对应 blob 存储中的对象',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '记录创建时间',
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_user_id (user_id)
@@ -99,6 +100,26 @@ CREATE INDEX idx_clothes_category ON clothes(category);
 CLOTHES_INDEX_SQL_SQLITE = """
 CREATE INDEX IF NOT EXISTS idx_clothes_category ON clothes(category);
 """
+
+# 为已有的 clothes 表添加图片内容哈希列
+CLOTHES_IMAGE_HASH_COLUMN_SQL_MYSQL = """
+ALTER TABLE clothes ADD COLUMN image_hash CHAR(64) NULL COMMENT '图片内容哈希（SHA-256），对应 blob 存储中的对象' AFTER image_data
+"""
+
+# MySQL 衣物季节索引表（由 clothes.season_semantics 展开，每个季节一行，用于推荐时按 用户+季节+分类 筛选）
+CLOTHES_SEASON_TABLE_SQL_MYSQL = """
+CREATE TABLE IF NOT EXISTS clothes_season (
+    clothes_id INT NOT NULL COMMENT '衣物ID',
+    user_id INT NOT NULL COMMENT '用户ID（冗余，便于按用户筛选）',
+    category VARCHAR(50) NOT NULL COMMENT '衣物分类（冗余）：top, bottom, shoes',
+    season VARCHAR(20) NOT NULL COMMENT '季节：春、夏、秋、冬',
+    PRIMARY KEY (clothes_id, season),
+    INDEX idx_clothes_season_user (user_id, season, category)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_unicode_ci
+COMMENT='衣物季节索引';
+"""
 # 
 API_CONFIG_TABLE_SQL_MYSQL = """
 CREATE TABLE `api_config` (
@@ -112,4 +133,53 @@ CREATE TABLE `api_config` (
   `created_at` timestamp NULL DEFAULT current_timestamp() COMMENT '记录创建时间',
   PRIMARY KEY (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=0 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='API 配置';
-"""
\ No newline at end of file
+"""
+
+# ==================== 分析结果缓存表 ====================
+
+# MySQL 分析结果缓存表（按 图片哈希+Prompt+模型 缓存 LLM 识别结果）
+ANALYSIS_CACHE_TABLE_SQL_MYSQL = """
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    cache_key CHAR(64) NOT NULL PRIMARY KEY COMMENT '图片哈希+Prompt+模型 的 SHA-256',
+    kind VARCHAR(20) NOT NULL COMMENT '结果类型：clothes, items',
+    result LONGTEXT NOT NULL COMMENT '识别结果 JSON',
+    expires_at BIGINT NOT NULL COMMENT '过期时间（Unix 时间戳）',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '记录创建时间',
+    INDEX idx_analysis_cache_expires (expires_at)
+) ENGINE=InnoDB
+DEFAULT CHARSET=utf8mb4
+COLLATE=utf8mb4_unicode_ci
+COMMENT='图片分析结果缓存';
+"""
+
+# SQLite 分析结果缓存表
+ANALYSIS_CACHE_TABLE_SQL_SQLITE = """
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    cache_key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    result TEXT NOT NULL,  -- JSON
+    expires_at INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# SQLite 异步分析任务表（本地持久队列）
+ANALYSIS_JOBS_TABLE_SQL_SQLITE = """
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,  -- clothes, items
+    status TEXT NOT NULL,  -- queued, running, succeeded, failed
+    image BLOB,  -- 待处理的原始图片，任务结束后清空
+    callback_url TEXT,
+    result TEXT,  -- JSON
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+"""
+
+ANALYSIS_JOBS_INDEX_SQL_SQLITE = """
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs(status, created_at);
+"""
@@ -0,0 +1,8 @@
+"""
+pytest 配置
+把项目根目录加入导入路径，与在项目目录下启动 uvicorn 时的导入方式一致
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,224 @@
+"""
+分析流水线测试：分析缓存优先、去背景图片写入 blob 存储、批量分析的多图合并请求
+"""
+import asyncio
+import io
+import json
+import pytest
+from PIL import Image
+from domain.clothes import ClothesSemantics
+from services import analysis_cache, analyze_pipeline
+from storage import blob_store
+from storage.blob_store import LocalBlobStore
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    calls = {"segment": [], "llm": 0}
+
+    async def segment(raw_bytes, full_resolution=False):
+        calls["segment"].append(full_resolution)
+        return b"cutout:" + raw_bytes
+
+    async def analyze(processed_bytes):
+        calls["llm"] += 1
+        return ClothesSemantics(
+            category="top", item="T恤", style_semantics=["休闲"], season_semantics=["夏"],
+            usage_semantics=[], color_semantics="白色", description="白色短袖 T 恤"
+        )
+
+    async def lookup_segment(raw_bytes):
+        return None, None
+
+    async def model():
+        return "test-model"
+
+    async def pregenerate(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(analyze_pipeline, "_run_background_removal", segment)
+    monkeypatch.setattr(analyze_pipeline, "analyze_clothes_openai", analyze)
+    monkeypatch.setattr(analyze_pipeline, "lookup_segment", lookup_segment)
+    monkeypatch.setattr(analyze_pipeline, "get_llm_model", model)
+    monkeypatch.setattr(analyze_pipeline, "pregenerate_variants", pregenerate)
+    monkeypatch.setattr(blob_store, "_store", LocalBlobStore(str(tmp_path / "blobs")))
+    monkeypatch.setattr(analysis_cache, "ANALYSIS_CACHE_PERSIST", "none")
+    monkeypatch.setattr(analysis_cache, "_lru", type(analysis_cache._lru)())
+    # 阶段信号量会绑定到首次等待时的事件循环，每个测试使用新的实例
+    for name in ("_decode_slots", "_segment_slots", "_llm_slots"):
+        monkeypatch.setattr(analyze_pipeline, name, asyncio.Semaphore(2))
+    return calls
+
+
+def _png(color) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (20, 30), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_repeat_upload_skips_segmentation_and_llm(pipeline):
+    raw = _png("white")
+
+    async def main():
+        first = await analyze_pipeline.analyze_and_store_clothes_image(raw)
+        second = await analyze_pipeline.analyze_and_store_clothes_image(raw)
+        return first, second
+
+    (semantics, image_hash), (cached_semantics, cached_hash) = asyncio.run(main())
+    assert pipeline["segment"] == [True]
+    assert pipeline["llm"] == 1
+    assert cached_semantics == semantics
+    assert cached_hash == image_hash
+    assert asyncio.run(blob_store.get_blob_store().get(image_hash)) == b"cutout:" + raw
+
+
+def test_missing_blob_redoes_segmentation_but_reuses_semantics(pipeline):
+    raw = _png("white")
+
+    async def main():
+        _, image_hash = await analyze_pipeline.analyze_and_store_clothes_image(raw)
+        await blob_store.get_blob_store().delete(image_hash)
+        return image_hash, await analyze_pipeline.analyze_and_store_clothes_image(raw)
+
+    image_hash, (_, restored_hash) = asyncio.run(main())
+    assert restored_hash == image_hash
+    assert pipeline["segment"] == [True, True]
+    assert pipeline["llm"] == 1
+    assert asyncio.run(blob_store.get_blob_store().exists(image_hash))
+
+
+
+def test_batch_results_include_image_hash(pipeline):
+    files = [("a.png", _png("red")), ("broken.jpg", b"not an image"), ("c.png", _png("blue"))]
+
+    async def main():
+        return [result async for result in analyze_pipeline.analyze_clothes_batch(files)]
+
+    results = {result["filename"]: result for result in asyncio.run(main())}
+    assert results["broken.jpg"]["ok"] is False
+    for filename in ("a.png", "c.png"):
+        image_hash = results[filename]["image_hash"]
+        assert asyncio.run(blob_store.get_blob_store().get(image_hash)) == b"cutout:" + dict(files)[filename]
+    assert pipeline["segment"] == [True, True]
+
+
+def test_clothes_job_result_includes_image_hash(pipeline, monkeypatch):
+    from services import job_queue
+
+    result = asyncio.run(job_queue._run_job({"kind": "clothes", "image": _png("green")}))
+    assert result["item"] == "T恤"
+    assert asyncio.run(blob_store.get_blob_store().exists(result["image_hash"]))
+
+
+def _clothes(image_hash):
+    from domain.clothes import ClothesCreate
+    return ClothesCreate(
+        category="top", item="T恤", style_semantics=[], season_semantics=[], usage_semantics=[],
+        color_semantics="白色", description="", image_filename="a.png", image_hash=image_hash
+    )
+
+
+@pytest.mark.parametrize("image_hash", ["not-a-hash", "A" * 64, "../" + "a" * 61, "a" * 64])
+def test_add_clothes_rejects_invalid_or_missing_image_hash(pipeline, image_hash):
+    from storage import db_mysql
+
+    with pytest.raises(ValueError):
+        asyncio.run(db_mysql.add_clothes(_clothes(image_hash)))
+
+
+def _semantics(item):
+    return ClothesSemantics(
+        category="top", item=item, style_semantics=[], season_semantics=[],
+        usage_semantics=[], color_semantics="", description=""
+    )
+
+
+@pytest.fixture
+def grouped_llm(pipeline, monkeypatch):
+    """记录合并请求的分组和逐张回退的图片；multi_results 按图片返回合并分析结果（None 表示无效）"""
+    calls = {"groups": [], "singles": [], "multi_results": {}}
+
+    async def analyze_multi(images):
+        calls["groups"].append(list(images))
+        return [calls["multi_results"].get(image, _semantics(f"multi:{image.decode()}")) for image in images]
+
+    async def analyze_single(image):
+        calls["singles"].append(image)
+        return _semantics(f"single:{image.decode()}")
+
+    monkeypatch.setattr(analyze_pipeline, "analyze_clothes_multi_openai", analyze_multi)
+    monkeypatch.setattr(analyze_pipeline, "analyze_clothes_openai", analyze_single)
+    return calls
+
+
+def test_grouper_flushes_after_wait_with_partial_group(grouped_llm):
+    async def main():
+        grouper = analyze_pipeline._LLMGrouper(group_size=4, wait=0.05)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await asyncio.gather(grouper.analyze(b"a"), grouper.analyze(b"b"))
+        return results, loop.time() - started
+
+    results, elapsed = asyncio.run(main())
+    assert [r.item for r in results] == ["multi:a", "multi:b"]
+    assert grouped_llm["groups"] == [[b"a", b"b"]]
+    assert elapsed >= 0.05
+
+
+def test_grouper_flushes_immediately_when_full(grouped_llm):
+    async def main():
+        grouper = analyze_pipeline._LLMGrouper(group_size=2, wait=60)
+        return await asyncio.wait_for(
+            asyncio.gather(*(grouper.analyze(image) for image in (b"a", b"b", b"c", b"d"))), timeout=1
+        )
+
+    results = asyncio.run(main())
+    assert [r.item for r in results] == ["multi:a", "multi:b", "multi:c", "multi:d"]
+    assert grouped_llm["groups"] == [[b"a", b"b"], [b"c", b"d"]]
+
+
+def test_grouper_falls_back_to_single_analysis_for_invalid_entries(grouped_llm):
+    # 合并结果缺少 b（结果列表过短、重复 index 等都表现为该位置为 None）
+    grouped_llm["multi_results"][b"b"] = None
+
+    async def main():
+        grouper = analyze_pipeline._LLMGrouper(group_size=3, wait=60)
+        return await asyncio.gather(*(grouper.analyze(image) for image in (b"a", b"b", b"c")))
+
+    results = asyncio.run(main())
+    assert [r.item for r in results] == ["multi:a", "single:b", "multi:c"]
+    assert grouped_llm["singles"] == [b"b"]
+
+
+def test_grouper_falls_back_for_every_image_when_group_request_fails(grouped_llm, monkeypatch):
+    async def failing_multi(images):
+        raise ValueError("请先配置 API Key")
+
+    monkeypatch.setattr(analyze_pipeline, "analyze_clothes_multi_openai", failing_multi)
+
+    async def main():
+        grouper = analyze_pipeline._LLMGrouper(group_size=2, wait=60)
+        return await asyncio.gather(grouper.analyze(b"a"), grouper.analyze(b"b"))
+
+    assert [r.item for r in asyncio.run(main())] == ["single:a", "single:b"]
+
+
+def test_short_multi_response_falls_back_end_to_end(grouped_llm, monkeypatch):
+    from services import llm_compatible
+
+    async def analyze_images(prompt, images_bytes, max_tokens=1000):
+        # 只返回了第一张图片的结果
+        return json.dumps({"results": [{
+            "index": 0, "category": "top", "item": "T恤", "style_semantics": [], "season_semantics": [],
+            "usage_semantics": [], "color_semantics": "白色", "description": ""
+        }]}, ensure_ascii=False)
+
+    monkeypatch.setattr(llm_compatible, "_analyze_images", analyze_images)
+    monkeypatch.setattr(analyze_pipeline, "analyze_clothes_multi_openai", llm_compatible.analyze_clothes_multi_openai)
+
+    async def main():
+        grouper = analyze_pipeline._LLMGrouper(group_size=2, wait=60)
+        return await asyncio.gather(grouper.analyze(b"a"), grouper.analyze(b"b"))
+
+    assert [r.item for r in asyncio.run(main())] == ["T恤", "single:b"]
+    assert grouped_llm["singles"] == [b"b"]
@@ -0,0 +1,125 @@
+"""
+衣物图片接口的 Range / ETag 解析测试
+"""
+import pytest
+from fastapi import HTTPException
+from api.clothes_image import _etag_matches, _parse_range
+
+ETAG = '"' + "a" * 64 + '"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 100)),
+    ("bytes=100-", (100, 1000)),
+    ("bytes=-100", (900, 1000)),
+    ("bytes=-5000", (0, 1000)),
+    ("bytes=900-5000", (900, 1000)),
+    (" bytes=0-0 ", (0, 1)),
+    # 多区间、其他单位、格式错误时返回完整内容
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=-", None),
+    ("bytes=a-b", None),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-1001", "bytes=50-10", "bytes=-0"])
+def test_unsatisfiable_range_raises_416(header):
+    with pytest.raises(HTTPException) as exc_info:
+        _parse_range(header, 1000)
+    assert exc_info.value.status_code == 416
+    assert exc_info.value.headers["Content-Range"] == "bytes */1000"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    (ETAG, True),
+    ("*", True),
+    (f'"other", {ETAG}', True),
+    (f"W/{ETAG}", True),
+    ('"other"', False),
+    (ETAG.strip('"'), False),
+])
+def test_etag_matches(header, expected):
+    assert _etag_matches(header, ETAG) is expected
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    import api.clothes_image as clothes_image
+
+    data = bytes(range(256)) * 4
+
+    async def get_info(clothes_id):
+        if clothes_id != 1:
+            return None
+        return {"id": 1, "image_hash": None, "data_hash": "a" * 64, "image_filename": "a.png", "size": len(data)}
+
+    async def iter_image(clothes_id, start=0, end=None):
+        yield data[start:end]
+
+    monkeypatch.setattr(clothes_image, "get_clothes_image_info", get_info)
+    monkeypatch.setattr(clothes_image, "iter_clothes_image", iter_image)
+    app = FastAPI()
+    app.include_router(clothes_image.router, prefix="/api")
+    return TestClient(app), data
+
+
+def test_endpoint_returns_304_for_matching_etag(client):
+    test_client, _ = client
+    response = test_client.get("/api/clothes/image/1", headers={"If-None-Match": ETAG})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == ETAG
+
+
+def test_endpoint_serves_single_range(client):
+    test_client, data = client
+    response = test_client.get("/api/clothes/image/1", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(data)}"
+    assert response.content == data[10:20]
+
+
+def test_endpoint_head_has_length_without_body(client):
+    test_client, data = client
+    response = test_client.head("/api/clothes/image/1")
+    assert response.status_code == 200
+    assert response.headers["Content-Length"] == str(len(data))
+    assert response.content == b""
+
+
+def test_endpoint_missing_image_is_404(client):
+    test_client, _ = client
+    assert test_client.get("/api/clothes/image/2").status_code == 404
+
+
+def test_variant_is_streamed_from_open_handle_after_eviction(client, monkeypatch, tmp_path):
+    import api.clothes_image as clothes_image
+    test_client, _ = client
+    body = b"variant-bytes" * 100
+    path = tmp_path / "variant.webp"
+    path.write_bytes(body)
+
+    async def open_variant(digest, width, fmt, load_original):
+        f = open(path, "rb")
+        # 打开后、发送前缓存条目被淘汰删除
+        path.unlink()
+        return f
+
+    monkeypatch.setattr(clothes_image, "open_variant", open_variant)
+    response = test_client.get("/api/clothes/image/1?w=200")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"' + "a" * 64 + '-256.webp"'
+    assert response.content == body
+
+    path.write_bytes(body)
+    response = test_client.get("/api/clothes/image/1?w=200", headers={"Range": "bytes=5-9"})
+    assert response.status_code == 206
+    assert response.content == body[5:10]
@@ -0,0 +1,162 @@
+"""
+对冲请求测试：触发时机、先成功者胜出、落败请求的取消与预算限制
+"""
+import asyncio
+import gc
+import pytest
+from services.hedging import Hedger
+from services.provider_router import ProviderRouter
+
+
+def _hedger(**overrides) -> Hedger:
+    options = dict(
+        enabled=True, percentile=90, default_delay=0.05, min_samples=5, max_rate=1.0, window=100
+    )
+    options.update(overrides)
+    return Hedger("test", **options)
+
+
+def _accept(result):
+    return result is not None and not result.startswith("error")
+
+
+def test_hedge_delay_uses_default_until_enough_samples():
+    hedger = _hedger(default_delay=3.0, min_samples=5)
+    hedger.latencies.extend([0.1, 0.2, 0.3, 0.4])
+    assert hedger.hedge_delay() == 3.0
+    hedger.latencies.extend([0.5 + i / 10 for i in range(6)])
+    # 10 个样本的第 90 百分位
+    assert hedger.hedge_delay() == pytest.approx(1.0)
+
+
+def test_fast_primary_does_not_fire_hedge():
+    hedger = _hedger()
+    backups = []
+
+    async def primary():
+        return "primary"
+
+    async def backup():
+        backups.append(1)
+        return "backup"
+
+    assert asyncio.run(hedger.run(primary, backup, _accept)) == "primary"
+    assert backups == []
+    assert hedger.stats["hedges_fired"] == 0
+
+
+def test_slow_primary_loses_to_hedge_and_is_cancelled():
+    hedger = _hedger()
+    router = ProviderRouter("llm")
+
+    def request(api_id, delay, result):
+        async def send():
+            router.start(api_id)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                router.cancel(api_id)
+                raise
+            router.finish(api_id, 0.0, ok=True)
+            return result
+        return send
+
+    async def main():
+        result = await hedger.run(request(1, 1.0, "primary"), request(2, 0.01, "backup"), _accept)
+        # 让被取消的主请求执行完取消处理
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "backup"
+    assert hedger.stats["hedges_fired"] == 1
+    assert hedger.stats["hedge_wins"] == 1
+    stats = router.stats()
+    assert stats["1"]["outstanding"] == 0
+    assert stats["1"]["failures"] == 0
+    assert stats["2"]["outstanding"] == 0
+
+
+def test_failed_result_does_not_win():
+    hedger = _hedger()
+
+    async def primary():
+        await asyncio.sleep(0.2)
+        return "primary"
+
+    async def backup():
+        return "error: 503"
+
+    assert asyncio.run(hedger.run(primary, backup, _accept)) == "primary"
+    assert hedger.stats["primary_wins"] == 1
+
+
+def test_both_failing_returns_primary_result():
+    hedger = _hedger()
+
+    async def primary():
+        await asyncio.sleep(0.1)
+        return "error: primary"
+
+    async def backup():
+        return "error: backup"
+
+    assert asyncio.run(hedger.run(primary, backup, _accept)) == "error: primary"
+
+
+def test_loser_exception_is_retrieved():
+    hedger = _hedger()
+    unretrieved = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+        gate = asyncio.Event()
+
+        async def primary():
+            await gate.wait()
+            raise ConnectionError("reset")
+
+        async def backup():
+            gate.set()
+            return "backup"
+
+        result = await hedger.run(primary, backup, _accept)
+        await asyncio.sleep(0.01)
+        gc.collect()
+        return result
+
+    for _ in range(5):
+        assert asyncio.run(main()) == "backup"
+    gc.collect()
+    assert unretrieved == []
+
+
+def test_hedge_rate_is_limited_by_budget():
+    hedger = _hedger(max_rate=0.5, default_delay=0.01, min_samples=100)
+
+    async def primary():
+        await asyncio.sleep(0.03)
+        return "primary"
+
+    async def backup():
+        return "backup"
+
+    async def main():
+        return [await hedger.run(primary, backup, _accept) for _ in range(6)]
+
+    results = asyncio.run(main())
+    # 对冲请求数不超过总请求数的一半
+    assert hedger.stats["hedges_fired"] == 3
+    assert hedger.stats["skipped_budget"] == 3
+    assert results.count("backup") == 3
+
+
+def test_disabled_or_missing_backup_runs_primary_only():
+    async def primary():
+        await asyncio.sleep(0.02)
+        return "primary"
+
+    assert asyncio.run(_hedger(enabled=False).run(primary, primary, _accept)) == "primary"
+    hedger = _hedger()
+    assert asyncio.run(hedger.run(primary, None, _accept)) == "primary"
+    assert hedger.stats["hedges_fired"] == 0
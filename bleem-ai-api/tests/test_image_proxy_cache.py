@@ -0,0 +1,93 @@
+"""
+图片代理缓存测试：并发合并、缓存命中、淘汰与限制
+"""
+import asyncio
+import httpx
+import pytest
+from services import image_proxy_cache
+from services.image_proxy_cache import ImageProxyError, cache_key, fetch_image
+
+BODY = b"\x89PNG" + b"x" * 200_000
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    monkeypatch.setattr(image_proxy_cache, "IMAGE_PROXY_CACHE_DIR", tmp_path / "proxy")
+    monkeypatch.setattr(image_proxy_cache, "_index", {})
+    monkeypatch.setattr(image_proxy_cache, "_index_loaded", False)
+    monkeypatch.setattr(image_proxy_cache, "_total_bytes", 0)
+    monkeypatch.setattr(image_proxy_cache, "_inflight", {})
+    monkeypatch.setattr(image_proxy_cache, "_stats", dict.fromkeys(image_proxy_cache._stats, 0))
+
+    state = {"requests": 0, "content_type": "image/png", "body": BODY}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        state["requests"] += 1
+        return httpx.Response(200, headers={"content-type": state["content_type"]}, content=state["body"])
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(image_proxy_cache, "get_http_client", lambda name: client)
+    return state
+
+
+async def _read(result) -> bytes:
+    return b"".join([chunk async for chunk in result["stream"]])
+
+
+def test_concurrent_requests_share_one_download(upstream):
+    async def main():
+        results = await asyncio.gather(*(fetch_image("http://img/a.png") for _ in range(4)))
+        return await asyncio.gather(*(_read(result) for result in results))
+
+    bodies = asyncio.run(main())
+    assert all(body == BODY for body in bodies)
+    assert upstream["requests"] == 1
+
+
+def test_hit_is_served_from_cache(upstream):
+    async def main():
+        await _read(await fetch_image("http://img/a.png"))
+        result = await fetch_image("http://img/a.png")
+        return result, await _read(result)
+
+    result, body = asyncio.run(main())
+    assert body == BODY
+    assert result["size"] == len(BODY)
+    assert upstream["requests"] == 1
+
+
+def test_evicted_file_stays_readable_through_open_handle(upstream):
+    async def main():
+        url = "http://img/a.png"
+        await _read(await fetch_image(url))
+        result = await fetch_image(url)
+        # 返回后、发送前条目被淘汰删除
+        image_proxy_cache._remove_files(cache_key(url))
+        body = await _read(result)
+        # 索引仍有条目但文件已不存在时重新下载
+        refetched = await _read(await fetch_image(url))
+        return body, refetched
+
+    body, refetched = asyncio.run(main())
+    assert body == BODY
+    assert refetched == BODY
+    assert upstream["requests"] == 2
+
+
+def test_non_image_is_rejected(upstream):
+    upstream["content_type"] = "text/html"
+    with pytest.raises(ImageProxyError) as exc_info:
+        asyncio.run(fetch_image("http://img/page"))
+    assert exc_info.value.status_code == 415
+
+
+def test_oversized_body_is_rejected(upstream, monkeypatch):
+    monkeypatch.setattr(image_proxy_cache, "IMAGE_PROXY_MAX_BYTES", 1000)
+
+    async def main():
+        return await _read(await fetch_image("http://img/big.png"))
+
+    with pytest.raises(ImageProxyError) as exc_info:
+        asyncio.run(main())
+    assert exc_info.value.status_code == 413
+    assert list(image_proxy_cache.IMAGE_PROXY_CACHE_DIR.glob("*.bin")) == []
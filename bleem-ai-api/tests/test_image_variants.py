@@ -0,0 +1,216 @@
+"""
+缩略图生成的并发合并与磁盘缓存测试
+"""
+import asyncio
+import io
+import os
+from pathlib import Path
+import pytest
+from PIL import Image
+from services import image_variants
+from services.image_variants import bucket_width, get_variant_path
+
+DIGEST = "a" * 64
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(image_variants, "IMAGE_VARIANT_CACHE_DIR", tmp_path / "variants")
+    monkeypatch.setattr(image_variants, "IMAGE_VARIANT_WIDTHS", [128, 256, 512, 1024])
+    monkeypatch.setattr(image_variants, "_index", {})
+    monkeypatch.setattr(image_variants, "_index_loaded", False)
+    monkeypatch.setattr(image_variants, "_total_bytes", 0)
+    monkeypatch.setattr(image_variants, "_inflight", {})
+    monkeypatch.setattr(image_variants, "_stats", dict.fromkeys(image_variants._stats, 0))
+
+
+def _run(coro):
+    async def main():
+        # 信号量与事件循环绑定，每个测试使用新的实例
+        image_variants._render_slots = asyncio.Semaphore(2)
+        return await coro
+    return asyncio.run(main())
+
+
+def _png(size=(600, 400)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("width, expected", [(1, 128), (128, 128), (129, 256), (700, 1024), (4096, 1024)])
+def test_bucket_width(width, expected):
+    assert bucket_width(width) == expected
+
+
+def test_concurrent_requests_share_one_generation():
+    loads = 0
+
+    async def load():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.05)
+        return _png()
+
+    async def main():
+        return await asyncio.gather(*(get_variant_path(DIGEST, 256, "webp", load) for _ in range(5)))
+
+    paths = _run(main())
+    assert loads == 1
+    assert len(set(paths)) == 1
+    assert image_variants._stats["coalesced"] == 4
+    with Image.open(paths[0]) as img:
+        assert img.width == 256
+    # 再次请求直接命中磁盘缓存
+    assert _run(get_variant_path(DIGEST, 256, "webp", load)) == paths[0]
+    assert loads == 1
+
+
+def test_waiters_receive_generation_error():
+    async def load():
+        await asyncio.sleep(0.05)
+        raise ValueError("原图损坏")
+
+    async def main():
+        return await asyncio.gather(
+            *(get_variant_path(DIGEST, 256, "webp", load) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    results = _run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert image_variants._inflight == {}
+
+
+def test_waiter_takes_over_when_leader_is_cancelled():
+    async def main():
+        leader_started = asyncio.Event()
+
+        async def slow_load():
+            leader_started.set()
+            await asyncio.sleep(10)
+            return _png()
+
+        async def fast_load():
+            return _png()
+
+        leader = asyncio.create_task(get_variant_path(DIGEST, 256, "webp", slow_load))
+        await leader_started.wait()
+        waiter = asyncio.create_task(get_variant_path(DIGEST, 256, "webp", fast_load))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        path = await asyncio.wait_for(waiter, timeout=5)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return path
+
+    assert _run(main()).endswith(f"{DIGEST}-256.webp")
+    assert image_variants._inflight == {}
+
+
+def test_cancelled_waiter_does_not_affect_leader():
+    async def main():
+        async def load():
+            await asyncio.sleep(0.05)
+            return _png()
+
+        leader = asyncio.create_task(get_variant_path(DIGEST, 256, "webp", load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(get_variant_path(DIGEST, 256, "webp", load))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert _run(main()).endswith(f"{DIGEST}-256.webp")
+
+
+def test_missing_original_returns_none():
+    async def load():
+        return None
+
+    assert _run(get_variant_path(DIGEST, 256, "webp", load)) is None
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(image_variants, "IMAGE_VARIANT_CACHE_MAX_BYTES", 1)
+
+    async def load():
+        return _png()
+
+    async def main():
+        first = await get_variant_path("b" * 64, 128, "webp", load)
+        second = await get_variant_path("c" * 64, 128, "webp", load)
+        return first, second
+
+    first, second = _run(main())
+    assert not Path(first).exists()
+    assert Path(second).exists()
+    assert image_variants._stats["evictions"] == 1
+
+
+async def _read_variant(f):
+    size = os.fstat(f.fileno()).st_size
+    return b"".join([chunk async for chunk in image_variants.iter_variant(f, 0, size)])
+
+
+def test_evicted_variant_stays_readable_through_open_handle():
+    async def load():
+        return _png()
+
+    async def main():
+        f = await image_variants.open_variant(DIGEST, 256, "webp", load)
+        expected = (image_variants.IMAGE_VARIANT_CACHE_DIR / f"{DIGEST}-256.webp").read_bytes()
+        # 返回后、发送前条目被淘汰删除
+        (image_variants.IMAGE_VARIANT_CACHE_DIR / f"{DIGEST}-256.webp").unlink()
+        body = await _read_variant(f)
+        return f, body, expected
+
+    f, body, expected = _run(main())
+    assert body == expected
+    assert f.closed
+
+
+def test_variant_removed_before_open_is_regenerated(monkeypatch):
+    loads = 0
+
+    async def load():
+        nonlocal loads
+        loads += 1
+        return _png()
+
+    original_lookup = image_variants._lookup_sync
+    removed = []
+
+    def lookup(name):
+        path = original_lookup(name)
+        # 第一次命中后、打开前文件被删除
+        if path is not None and not removed:
+            Path(path).unlink()
+            removed.append(path)
+        return path
+
+    async def main():
+        await get_variant_path(DIGEST, 256, "webp", load)
+        monkeypatch.setattr(image_variants, "_lookup_sync", lookup)
+        f = await image_variants.open_variant(DIGEST, 256, "webp", load)
+        return await _read_variant(f)
+
+    body = _run(main())
+    assert removed
+    assert loads == 2
+    assert Image.open(io.BytesIO(body)).width == 256
+
+
+def test_iter_variant_reads_range():
+    async def load():
+        return _png()
+
+    async def main():
+        f = await image_variants.open_variant(DIGEST, 128, "webp", load)
+        return b"".join([chunk async for chunk in image_variants.iter_variant(f, 2, 10)])
+
+    body = _run(main())
+    full = (image_variants.IMAGE_VARIANT_CACHE_DIR / f"{DIGEST}-128.webp").read_bytes()
+    assert body == full[2:10]
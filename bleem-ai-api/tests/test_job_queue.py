@@ -0,0 +1,107 @@
+"""
+异步任务队列测试：回调地址校验与结果记录重试
+"""
+import asyncio
+import types
+import pytest
+from services import job_queue
+from services.job_queue import check_callback_url
+
+
+@pytest.fixture(autouse=True)
+def _no_allowlist(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_CALLBACK_ALLOWED_HOSTS", set())
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://localhost:8080/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+])
+def test_internal_callback_urls_are_rejected(url):
+    with pytest.raises(ValueError):
+        asyncio.run(check_callback_url(url))
+
+
+@pytest.mark.parametrize("url", ["ftp://example.com/hook", "http:///hook", "http://example.com:99999/hook"])
+def test_malformed_callback_urls_are_rejected(url):
+    with pytest.raises(ValueError):
+        asyncio.run(check_callback_url(url))
+
+
+def test_public_address_is_allowed():
+    asyncio.run(check_callback_url("https://8.8.8.8:8443/hook"))
+
+
+def test_allowlist_restricts_hosts(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_CALLBACK_ALLOWED_HOSTS", {"hooks.internal"})
+    asyncio.run(check_callback_url("http://hooks.internal/hook"))
+    with pytest.raises(ValueError):
+        asyncio.run(check_callback_url("https://8.8.8.8/hook"))
+
+
+def test_finish_is_retried_then_marked_failed(monkeypatch):
+    calls = []
+
+    async def finish_job(job_id, result=None, error=None):
+        calls.append((result, error))
+        if len(calls) <= job_queue.JOB_FINISH_ATTEMPTS:
+            raise RuntimeError("database is locked")
+
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(job_queue, "finish_job", finish_job)
+    monkeypatch.setattr(job_queue.asyncio, "sleep", no_sleep)
+    asyncio.run(job_queue._finish_with_retry("job", {"item": "T恤"}, None))
+    assert calls[:-1] == [({"item": "T恤"}, None)] * job_queue.JOB_FINISH_ATTEMPTS
+    assert calls[-1] == (None, "保存分析结果失败")
+
+
+def test_segment_queue_full_retry_gives_up_after_deadline(monkeypatch):
+    calls = []
+
+    async def analyze(image):
+        calls.append(image)
+        raise job_queue.SegmentQueueFullError("背景移除队列已满")
+
+    async def no_sleep(seconds):
+        pass
+
+    clock = iter(range(0, 1000, 100))
+    fake_time = types.SimpleNamespace(monotonic=lambda: next(clock))
+    monkeypatch.setattr(job_queue, "JOB_SEGMENT_RETRY_TIMEOUT", 300.0)
+    monkeypatch.setattr(job_queue, "analyze_and_store_clothes_image", analyze)
+    monkeypatch.setattr(job_queue.asyncio, "sleep", no_sleep)
+    monkeypatch.setattr(job_queue, "time", fake_time)
+    with pytest.raises(job_queue.SegmentQueueFullError):
+        asyncio.run(job_queue._run_job({"kind": "clothes", "image": b"img"}))
+    assert len(calls) == 3
+
+
+def test_interrupted_jobs_are_requeued_until_max_attempts(monkeypatch, tmp_path):
+    from storage import job_store
+    monkeypatch.setattr(job_store, "JOB_DB_PATH", tmp_path / "jobs.db")
+    monkeypatch.setattr(job_store, "JOB_MAX_ATTEMPTS", 2)
+
+    async def main():
+        await job_store.init_job_store()
+        await job_store.enqueue_job("crash", "clothes", b"img", None)
+        states = []
+        for _ in range(3):
+            # 领取后不记录结果，模拟执行过程中进程崩溃，随后重启
+            await job_store.claim_next_job()
+            await job_store.init_job_store()
+            states.append((await job_store.get_job("crash"))["status"])
+        return states, await job_store.get_job("crash"), await job_store.claim_next_job()
+
+    states, job, next_job = asyncio.run(main())
+    assert states == ["queued", "failed", "failed"]
+    assert job["attempts"] == 2
+    assert job["error"]
+    assert next_job is None
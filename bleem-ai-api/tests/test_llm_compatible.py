@@ -0,0 +1,97 @@
+"""
+OpenAI 兼容 API 调用测试：单次请求的健康记录、多图分析结果按 index 对应回输入
+"""
+import asyncio
+import json
+import httpx
+import pytest
+from domain.config import ApiConfig
+from services import llm_compatible, provider_router
+from services.provider_router import ProviderRouter
+
+CONFIG = ApiConfig(id=1, api_key="k1", api_base="http://llm.test/v1", model="m", usage_count=0)
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(provider_router, "ROUTER_CIRCUIT_OPEN_SECONDS", 30.0)
+    monkeypatch.setattr(llm_compatible, "LLM_STREAM_ANALYSIS", False)
+    return ProviderRouter("llm")
+
+
+def _send(router, handler):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await llm_compatible._send_vision(
+                router, client, CONFIG, "prompt", [("aGk=", "image/png")], 100, httpx.Timeout(5.0)
+            )
+    return asyncio.run(main())
+
+
+def test_unparseable_200_is_a_failure_without_opening_circuit(router):
+    with pytest.raises(ValueError):
+        _send(router, lambda request: httpx.Response(200, text="not json"))
+    stats = router.stats()["1"]
+    assert stats["failures"] == 1
+    assert stats["circuit_open"] is False
+    assert stats["outstanding"] == 0
+
+
+def test_network_error_opens_circuit(router):
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    config, response, text = _send(router, handler)
+    assert response is None
+    assert router.stats()["1"]["circuit_open"] is True
+
+
+def test_success_returns_content(router):
+    body = {"choices": [{"message": {"content": '{"ok": true}'}}]}
+    config, response, text = _send(router, lambda request: httpx.Response(200, json=body))
+    assert response.status_code == 200
+    assert text == '{"ok": true}'
+    assert router.stats()["1"]["failures"] == 0
+
+
+def _item(index, name, **extra):
+    return {
+        "index": index, "category": "top", "item": name, "style_semantics": ["休闲"],
+        "season_semantics": ["夏"], "usage_semantics": [], "color_semantics": "白色",
+        "description": name, **extra
+    }
+
+
+def _multi(monkeypatch, payload, count):
+    async def analyze_images(prompt, images_bytes, max_tokens=1000):
+        assert len(images_bytes) == count
+        return payload if isinstance(payload, str) else json.dumps({"results": payload}, ensure_ascii=False)
+
+    monkeypatch.setattr(llm_compatible, "_analyze_images", analyze_images)
+    results = asyncio.run(llm_compatible.analyze_clothes_multi_openai([b"%d" % i for i in range(count)]))
+    return [result.item if result else None for result in results]
+
+
+def test_multi_results_are_mapped_back_by_index(monkeypatch):
+    payload = [_item(2, "鞋"), _item(0, "T恤"), _item(1, "裤子")]
+    assert _multi(monkeypatch, payload, 3) == ["T恤", "裤子", "鞋"]
+
+
+def test_multi_duplicate_index_leaves_other_position_empty(monkeypatch):
+    payload = [_item(0, "T恤"), _item(0, "衬衫")]
+    assert _multi(monkeypatch, payload, 2) == ["T恤", None]
+
+
+def test_multi_short_or_invalid_results_leave_positions_empty(monkeypatch):
+    payload = [_item(0, "T恤"), _item(7, "越界"), {"index": 2, "category": "top"}, "not an object"]
+    assert _multi(monkeypatch, payload, 3) == ["T恤", None, None]
+
+
+def test_multi_missing_index_falls_back_to_position(monkeypatch):
+    payload = [_item(0, "T恤"), {k: v for k, v in _item(1, "裤子").items() if k != "index"}]
+    assert _multi(monkeypatch, payload, 2) == ["T恤", "裤子"]
+
+
+@pytest.mark.parametrize("payload", ["not json at all", '{"items": []}', '{"results": "none"}'])
+def test_multi_unusable_response_returns_all_none(monkeypatch, payload):
+    assert _multi(monkeypatch, payload, 2) == [None, None]
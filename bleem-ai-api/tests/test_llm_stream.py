@@ -0,0 +1,92 @@
+"""
+IncrementalJSONParser / extract_json_object 测试
+"""
+import asyncio
+import pytest
+from services.llm_stream import IncrementalJSONParser, extract_json_object, read_json_from_stream
+from services.llm_compatible import extract_json_from_response
+
+
+def _feed_chunks(text: str, size: int):
+    parser = IncrementalJSONParser()
+    for i in range(0, len(text), size):
+        if parser.feed(text[i:i + size]) is not None:
+            break
+    return parser
+
+
+def test_extracts_object_surrounded_by_text():
+    text = '好的，结果如下：{"category": "top", "item": "T恤"} 希望有帮助'
+    assert extract_json_object(text) == {"category": "top", "item": "T恤"}
+
+
+def test_braces_inside_strings_are_ignored():
+    text = '{"description": "带 { 和 } 的说明", "escaped": "引号 \\" 和 }"}'
+    assert extract_json_object(text) == {"description": "带 { 和 } 的说明", "escaped": '引号 " 和 }'}
+
+
+def test_invalid_top_level_object_never_returns_nested_object():
+    # 模型照抄了 Prompt 示例中的 // 注释，整体不是合法 JSON
+    text = '''{
+  "category": "上衣",
+  "attrs": {"color": "白色", "size": "小"}, // 识别置信度
+  "confidence": 0.9
+}'''
+    assert extract_json_object(text) is None
+    with pytest.raises(ValueError):
+        extract_json_from_response(text)
+
+
+def test_skips_invalid_top_level_object_and_finds_next_one():
+    text = '说明 {不是 JSON {"inner": 1}} 然后 {"ok": true}'
+    assert extract_json_object(text) == {"ok": True}
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64])
+def test_chunked_feed_matches_whole_text(size):
+    text = '前缀 {"a": {"b": [1, 2, {"c": "}"}]}, "d": "x"} 后缀 {"e": 1}'
+    parser = _feed_chunks(text, size)
+    assert parser.result == {"a": {"b": [1, 2, {"c": "}"}]}, "d": "x"}
+    assert parser.json_text == '{"a": {"b": [1, 2, {"c": "}"}]}, "d": "x"}'
+
+
+def test_chunked_feed_does_not_return_nested_object_of_invalid_outer():
+    text = '{"attrs": {"color": "白色"}, // 注释\n "x": 1}'
+    parser = _feed_chunks(text, 2)
+    assert parser.result is None
+
+
+def test_result_is_stable_after_first_object():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"a": 1}') == {"a": 1}
+    assert parser.feed('{"b": 2}') == {"a": 1}
+
+
+class _FakeSSEResponse:
+    def __init__(self, lines):
+        self.lines = lines
+        self.read = 0
+
+    async def aiter_lines(self):
+        for line in self.lines:
+            self.read += 1
+            yield line
+
+
+def _sse(content: str) -> str:
+    import json
+    return "data: " + json.dumps({"choices": [{"delta": {"content": content}}]})
+
+
+def test_stream_stops_reading_after_top_level_object_closes():
+    response = _FakeSSEResponse([_sse('{"a": '), _sse('{"b": 1}}'), _sse(" 多余的内容"), "data: [DONE]"])
+    text = asyncio.run(read_json_from_stream(response))
+    assert text == '{"a": {"b": 1}}'
+    assert response.read == 2
+
+
+def test_stream_with_invalid_object_reads_to_end():
+    response = _FakeSSEResponse([_sse('{"a": {"b": 1}, // 注释\n'), _sse("}"), "data: [DONE]"])
+    text = asyncio.run(read_json_from_stream(response))
+    assert text == '{"a": {"b": 1}, // 注释\n}'
+    assert response.read == 3
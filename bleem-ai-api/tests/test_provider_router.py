@@ -0,0 +1,105 @@
+"""
+多 Key 路由的健康跟踪与熔断测试
+"""
+import asyncio
+import pytest
+from domain.config import ApiConfig
+from services import provider_router
+from services.provider_router import ProviderRouter, is_circuit_breaking_status
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(provider_router, "ROUTER_CIRCUIT_OPEN_SECONDS", 30.0)
+    monkeypatch.setattr(provider_router, "ROUTER_CIRCUIT_MAX_SECONDS", 300.0)
+    configs = [ApiConfig(id=1, api_key="k1", usage_count=0), ApiConfig(id=2, api_key="k2", usage_count=5)]
+
+    async def get_api_config(api_type):
+        return configs
+
+    monkeypatch.setattr(provider_router, "get_api_config", get_api_config)
+    return ProviderRouter("llm")
+
+
+def _fail(router: ProviderRouter, api_id: int, status_code=None):
+    router.finish(api_id, router.start(api_id), ok=False, status_code=status_code)
+
+
+def _candidate_ids(router: ProviderRouter):
+    return [config.id for config in asyncio.run(router.candidates())]
+
+
+@pytest.mark.parametrize("status_code, expected", [
+    (None, True), (429, True), (500, True), (503, True),
+    (400, False), (401, False), (402, False), (403, False), (404, False),
+])
+def test_circuit_breaking_status(status_code, expected):
+    assert is_circuit_breaking_status(status_code) is expected
+
+
+def test_rate_limit_opens_circuit_and_moves_key_last(router):
+    assert _candidate_ids(router) == [1, 2]
+    _fail(router, 1, 429)
+    assert router.stats()["1"]["circuit_open"] is True
+    assert _candidate_ids(router) == [2, 1]
+
+
+def test_client_errors_do_not_open_circuit(router):
+    for status_code in (400, 402, 403):
+        _fail(router, 1, status_code)
+    stats = router.stats()["1"]
+    assert stats["circuit_open"] is False
+    assert stats["failures"] == 3
+
+
+def test_open_duration_doubles_and_is_capped(router):
+    durations = []
+    for _ in range(6):
+        _fail(router, 1, 503)
+        durations.append(router.stats()["1"]["circuit_remaining_s"])
+    assert durations[:4] == pytest.approx([30, 60, 120, 240], abs=1)
+    assert durations[-1] == pytest.approx(300, abs=1)
+
+
+def test_success_closes_circuit(router):
+    _fail(router, 1, None)
+    router.finish(1, router.start(1), ok=True)
+    stats = router.stats()["1"]
+    assert stats["circuit_open"] is False
+    assert stats["outstanding"] == 0
+    assert stats["circuit_remaining_s"] == 0
+
+
+def test_outstanding_requests_are_balanced(router):
+    router.start(1)
+    assert _candidate_ids(router) == [2, 1]
+    router.cancel(1)
+    assert _candidate_ids(router) == [1, 2]
+
+
+def test_removebg_client_error_does_not_open_circuit(monkeypatch, router):
+    from services import analyze_pipeline
+    from services.removebg import RemoveBgError
+
+    monkeypatch.setenv("REMOVEBG_TYPE", "removebg")
+    monkeypatch.setattr(analyze_pipeline, "get_router", lambda api_type: router)
+
+    async def out_of_credits(*args, **kwargs):
+        raise RemoveBgError("余额不足", 402)
+
+    async def local(raw_bytes, full_resolution=False):
+        return b"local"
+
+    monkeypatch.setattr(analyze_pipeline, "remove_background_api", out_of_credits)
+    monkeypatch.setattr(analyze_pipeline, "submit_remove_background", local)
+
+    assert asyncio.run(analyze_pipeline._run_background_removal(b"raw")) == b"local"
+    assert not any(stats["circuit_open"] for stats in router.stats().values())
+
+
+def test_non_breaking_failure_is_recorded_without_opening_circuit(router):
+    router.finish(1, router.start(1), ok=False, breaking=False)
+    stats = router.stats()["1"]
+    assert stats["circuit_open"] is False
+    assert stats["failures"] == 1
+    assert stats["outstanding"] == 0
@@ -0,0 +1,109 @@
+"""
+穿搭推荐测试：LLM 请求记录 Key 健康状态并在失败时切换 Key
+"""
+import asyncio
+import json
+import httpx
+import pytest
+from domain.config import ApiConfig
+from services import provider_router, recommendation
+from services.provider_router import ProviderRouter
+from services.weather import WeatherInfo
+
+WEATHER = WeatherInfo(
+    temperature=22, feelsLike=22, condition="晴", icon="100", humidity=40,
+    windDir="东风", windScale="2", location="101010100", obsTime="2026-10-18T08:00+08:00"
+)
+CONFIGS = [
+    ApiConfig(id=1, api_key="k1", api_base="http://one.test/v1", model="m1", usage_count=0),
+    ApiConfig(id=2, api_key="k2", api_base="http://two.test/v1", model="m2", usage_count=1),
+]
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """handlers[host] 返回该 Key 的响应；返回 router 和各 host 的请求次数"""
+    router = ProviderRouter("llm")
+    handlers = {}
+    calls = {}
+
+    async def get_api_config(api_type):
+        return CONFIGS
+
+    def handle(request):
+        calls[request.url.host] = calls.get(request.url.host, 0) + 1
+        return handlers[request.url.host](request)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    monkeypatch.setattr(provider_router, "get_api_config", get_api_config)
+    monkeypatch.setattr(recommendation, "get_router", lambda api_type: router)
+    monkeypatch.setattr(recommendation, "get_http_client", lambda name: client)
+    return router, handlers, calls
+
+
+def _completion(text):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def _sse(*parts):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': p}}]})}\n\n" for p in parts]
+    return httpx.Response(
+        200, headers={"content-type": "text/event-stream"}, content=("".join(lines) + "data: [DONE]\n\n").encode()
+    )
+
+
+def _recommend():
+    return asyncio.run(recommendation.get_llm_recommendation(WEATHER, ["秋"], {"top": 1}))
+
+
+def _stream():
+    async def main():
+        return [text async for text in recommendation.stream_llm_recommendation(WEATHER, ["秋"], {"top": 1})]
+    return asyncio.run(main())
+
+
+def test_rate_limited_key_fails_over_and_opens_circuit(llm):
+    router, handlers, calls = llm
+    handlers["one.test"] = lambda request: httpx.Response(429)
+    handlers["two.test"] = lambda request: _completion(" 穿风衣 ")
+    assert _recommend() == "穿风衣"
+    stats = router.stats()
+    assert stats["1"]["circuit_open"] is True
+    assert stats["2"]["failures"] == 0
+    assert stats["2"]["outstanding"] == 0
+    # 熔断中的 Key 排到最后，下一次请求直接使用健康的 Key
+    assert _recommend() == "穿风衣"
+    assert calls == {"one.test": 1, "two.test": 2}
+
+
+def test_client_error_falls_back_to_basic_recommendation(llm):
+    router, handlers, calls = llm
+    handlers["one.test"] = lambda request: httpx.Response(401)
+    text = _recommend()
+    assert text == recommendation.generate_basic_recommendation(WEATHER, ["秋"])
+    assert calls == {"one.test": 1}
+    assert router.stats()["1"]["circuit_open"] is False
+
+
+def test_stream_fails_over_before_first_token(llm):
+    router, handlers, calls = llm
+
+    def refused(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    handlers["one.test"] = refused
+    handlers["two.test"] = lambda request: _sse("今天", "穿风衣")
+    assert _stream() == ["今天", "穿风衣"]
+    stats = router.stats()
+    assert stats["1"]["circuit_open"] is True
+    assert stats["2"]["requests"] == 1
+    assert stats["2"]["failures"] == 0
+    assert stats["2"]["outstanding"] == 0
+
+
+def test_stream_all_keys_failing_yields_basic_recommendation(llm):
+    router, handlers, calls = llm
+    handlers["one.test"] = lambda request: httpx.Response(503)
+    handlers["two.test"] = lambda request: httpx.Response(502)
+    assert _stream() == [recommendation.generate_basic_recommendation(WEATHER, ["秋"])]
+    assert {stats["failures"] for stats in router.stats().values()} == {1}
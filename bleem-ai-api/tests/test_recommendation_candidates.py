@@ -0,0 +1,170 @@
+"""
+推荐候选衣物查询测试：季节索引回填、按季节统计（无匹配时回退到全部）和抽样
+
+用 SQLite 内存库模拟 MySQL 连接池，只转换本模块用到的方言差异（占位符、RAND、INSERT IGNORE）
+"""
+import asyncio
+import json
+import sqlite3
+import pytest
+from storage import db_mysql
+
+SCHEMA = """
+CREATE TABLE clothes (
+    id INTEGER PRIMARY KEY, user_id INTEGER, category TEXT, item TEXT,
+    style_semantics TEXT, season_semantics TEXT, usage_semantics TEXT, color_semantics TEXT,
+    description TEXT, image_filename TEXT, image_hash TEXT, created_at TEXT, del_flag INTEGER DEFAULT 0
+);
+CREATE TABLE clothes_season (
+    clothes_id INTEGER, user_id INTEGER, category TEXT, season TEXT, PRIMARY KEY (clothes_id, season)
+);
+"""
+
+
+def _translate(sql: str) -> str:
+    return sql.replace("%s", "?").replace("RAND()", "RANDOM()").replace("INSERT IGNORE", "INSERT OR IGNORE")
+
+
+class _Cursor:
+    def __init__(self, db: sqlite3.Connection, as_dict: bool):
+        self._cursor = db.cursor()
+        self._as_dict = as_dict
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._cursor.close()
+
+    async def execute(self, sql, args=()):
+        # 表结构由测试预先创建
+        if sql.lstrip().upper().startswith("CREATE TABLE"):
+            return
+        self._cursor.execute(_translate(sql), tuple(args))
+
+    async def executemany(self, sql, rows):
+        self._cursor.executemany(_translate(sql), rows)
+
+    def _convert(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return dict(zip([column[0] for column in self._cursor.description], row))
+
+    async def fetchone(self):
+        return self._convert(self._cursor.fetchone())
+
+    async def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+
+class _Connection:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def cursor(self, cursor_class=None):
+        return _Cursor(self.db, cursor_class is not None)
+
+    async def commit(self):
+        self.db.commit()
+
+
+class _Pool:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def acquire(self):
+        return _Connection(self.db)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA)
+    pool = _Pool(conn)
+
+    async def get_pool():
+        return pool
+
+    monkeypatch.setattr(db_mysql, "get_mysql_pool", get_pool)
+    yield conn
+    conn.close()
+
+
+def _add(conn, clothes_id, category, seasons, user_id=1, deleted=0, indexed=True):
+    season_json = seasons if isinstance(seasons, str) else json.dumps(seasons, ensure_ascii=False)
+    conn.execute(
+        "INSERT INTO clothes (id, user_id, category, item, season_semantics, del_flag) VALUES (?, ?, ?, ?, ?, ?)",
+        (clothes_id, user_id, category, f"item{clothes_id}", season_json, deleted)
+    )
+    if indexed and not isinstance(seasons, str):
+        conn.executemany(
+            "INSERT INTO clothes_season VALUES (?, ?, ?, ?)",
+            [(clothes_id, user_id, category, season) for season in seasons]
+        )
+
+
+def _index(conn):
+    return sorted(conn.execute("SELECT clothes_id, season FROM clothes_season").fetchall())
+
+
+def test_backfill_indexes_only_clothes_without_season_rows(db):
+    _add(db, 1, "top", ["夏"])
+    # 旧版本进程写入、尚未建立索引的衣物
+    _add(db, 2, "top", ["春", " 秋 ", "春"], indexed=False)
+    _add(db, 3, "bottom", "not json", indexed=False)
+    _add(db, 4, "shoes", ["冬"], deleted=1, indexed=False)
+
+    asyncio.run(db_mysql._init_clothes_season_index())
+    assert _index(db) == [(1, "夏"), (2, "春"), (2, "秋")]
+
+    # 再次启动时不会重复写入
+    asyncio.run(db_mysql._init_clothes_season_index())
+    assert _index(db) == [(1, "夏"), (2, "春"), (2, "秋")]
+
+
+def test_count_falls_back_to_all_clothes_when_no_season_matches(db):
+    _add(db, 1, "top", ["春", "秋"])
+    _add(db, 2, "top", ["夏"])
+    _add(db, 3, "top", ["秋"])
+    _add(db, 4, "bottom", ["冬"])
+    _add(db, 5, "bottom", ["冬"])
+    _add(db, 6, "shoes", ["秋"], user_id=2)
+
+    counts = asyncio.run(db_mysql.count_recommendation_candidates("1", ["秋", "春"]))
+    assert counts == {"top": 2, "bottom": 2}
+    assert asyncio.run(db_mysql.count_recommendation_candidates("1", [])) == {"top": 3, "bottom": 2}
+
+
+def test_sample_prefers_matching_season(db):
+    _add(db, 1, "top", ["夏"])
+    _add(db, 2, "top", ["秋"])
+    _add(db, 3, "top", ["冬"])
+    _add(db, 4, "top", ["秋"], deleted=1)
+    _add(db, 5, "top", ["秋"], user_id=2)
+
+    for _ in range(10):
+        (item,) = asyncio.run(db_mysql.sample_recommendation_candidates("1", "top", ["秋"]))
+        assert item.id == 2
+    items = asyncio.run(db_mysql.sample_recommendation_candidates("1", "top", ["秋"], limit=5))
+    assert items[0].id == 2
+    assert sorted(item.id for item in items) == [1, 2, 3]
+
+
+def test_sample_without_season_match_uses_whole_category(db):
+    _add(db, 1, "bottom", ["夏"])
+    _add(db, 2, "bottom", ["冬"])
+    _add(db, 3, "top", ["春"])
+
+    seen = {
+        item.id
+        for _ in range(30)
+        for item in asyncio.run(db_mysql.sample_recommendation_candidates("1", "bottom", ["春"]))
+    }
+    assert seen == {1, 2}
+    assert asyncio.run(db_mysql.sample_recommendation_candidates("1", "shoes", ["春"])) == []
@@ -0,0 +1,65 @@
+"""
+重试策略测试：Retry-After 解析与退避预算
+"""
+import time
+from email.utils import formatdate
+import httpx
+import pytest
+from services.retry_policy import RetryPolicy, parse_retry_after
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None),
+    ("", None),
+    ("120", 120.0),
+    (" 1.5 ", 1.5),
+    ("-3", 0.0),
+    ("soon", None),
+])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    value = formatdate(time.time() + 60, usegmt=True)
+    assert 55 <= parse_retry_after(value) <= 60
+
+
+def test_parse_retry_after_past_date_is_zero():
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def _response(status_code: int, retry_after: str = None) -> httpx.Response:
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return httpx.Response(status_code, headers=headers)
+
+
+def test_retry_after_is_honoured_within_budget():
+    budget = RetryPolicy("test", max_attempts=3, base_delay=0.1, max_delay=1.0, deadline=30.0).begin()
+    budget.attempt()
+    assert budget.next_delay(_response(429, "2")) == 2.0
+    assert budget.policy.stats["retry_after_honoured"] == 1
+
+
+def test_gives_up_when_retry_after_exceeds_deadline():
+    budget = RetryPolicy("test", max_attempts=3, base_delay=0.1, max_delay=1.0, deadline=5.0).begin()
+    budget.attempt()
+    assert budget.next_delay(_response(503, "60")) is None
+    assert budget.policy.stats["gave_up_deadline"] == 1
+
+
+def test_gives_up_after_max_attempts():
+    budget = RetryPolicy("test", max_attempts=2, base_delay=0.1, max_delay=1.0, deadline=30.0).begin()
+    budget.attempt()
+    assert budget.next_delay() is not None
+    budget.attempt()
+    assert budget.next_delay() is None
+    assert budget.policy.stats["gave_up_attempts"] == 1
+
+
+def test_jittered_delay_stays_within_bounds():
+    budget = RetryPolicy("test", max_attempts=100, base_delay=0.5, max_delay=2.0, deadline=300.0).begin()
+    for _ in range(50):
+        budget.attempt()
+        delay = budget.next_delay()
+        assert 0.5 <= delay <= 2.0
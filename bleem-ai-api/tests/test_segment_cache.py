@@ -0,0 +1,107 @@
+"""
+去背景感知哈希缓存的复用判断测试
+"""
+import asyncio
+import io
+import pytest
+from PIL import Image, ImageDraw, ImageEnhance
+from services import segment_cache
+from services.segment_cache import ImageSignature, compute_signature, is_same_image
+
+
+@pytest.fixture(autouse=True)
+def _defaults(monkeypatch, tmp_path):
+    monkeypatch.setattr(segment_cache, "SEGMENT_CACHE_THRESHOLD", 4)
+    monkeypatch.setattr(segment_cache, "SEGMENT_CACHE_COLOR_TOLERANCE", 12.0)
+    monkeypatch.setattr(segment_cache, "SEGMENT_CACHE_ASPECT_TOLERANCE", 0.03)
+    monkeypatch.setattr(segment_cache, "SEGMENT_CACHE_ENABLED", True)
+    monkeypatch.setattr(segment_cache, "SEGMENT_CACHE_DIR", tmp_path / "segment")
+    monkeypatch.setattr(segment_cache, "_index", {})
+    monkeypatch.setattr(segment_cache, "_index_loaded", False)
+    monkeypatch.setattr(segment_cache, "_total_bytes", 0)
+
+
+def _garment(color, size=(400, 500)) -> Image.Image:
+    """浅灰背景上的同款衣物轮廓"""
+    img = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((100, 100, 300, 420), fill=color)
+    draw.polygon([(100, 100), (40, 200), (100, 220)], fill=color)
+    return img
+
+
+def _jpeg(img: Image.Image, quality: int = 90) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+RED = (200, 30, 30)
+BLUE = (30, 30, 200)
+
+
+def test_recompressed_and_resized_copies_are_reused():
+    original = compute_signature(_jpeg(_garment(RED)))
+    assert is_same_image(original, compute_signature(_jpeg(_garment(RED), quality=60)))
+    assert is_same_image(original, compute_signature(_jpeg(_garment(RED).resize((320, 400)))))
+
+
+def test_same_shape_in_another_color_is_not_reused():
+    red = compute_signature(_jpeg(_garment(RED)))
+    blue = compute_signature(_jpeg(_garment(BLUE)))
+    # dHash 只看灰度梯度，无法区分颜色
+    assert (red.dhash ^ blue.dhash).bit_count() <= segment_cache.SEGMENT_CACHE_THRESHOLD
+    assert not is_same_image(red, blue)
+
+
+def test_darkened_copy_is_not_reused():
+    red = _garment(RED)
+    dark = ImageEnhance.Brightness(red).enhance(0.15)
+    assert not is_same_image(compute_signature(_jpeg(red)), compute_signature(_jpeg(dark)))
+
+
+def test_different_aspect_ratio_is_not_reused():
+    red = _garment(RED)
+    cropped = red.crop((0, 0, 400, 400))
+    assert not is_same_image(compute_signature(_jpeg(red)), compute_signature(_jpeg(cropped)))
+
+
+def test_signature_name_round_trip():
+    signature = compute_signature(_jpeg(_garment(RED)))
+    assert ImageSignature.from_name(signature.name) == signature
+
+
+def test_hash_only_names_are_rejected():
+    with pytest.raises(ValueError):
+        ImageSignature.from_name("0123456789abcdef")
+
+
+def test_lookup_reuses_only_matching_cutout():
+    async def run():
+        signature, cached = await segment_cache.lookup_segment(_jpeg(_garment(RED)))
+        assert cached is None
+        await segment_cache.store_segment(signature, b"red cutout")
+
+        _, cached = await segment_cache.lookup_segment(_jpeg(_garment(RED), quality=70))
+        assert cached == b"red cutout"
+        _, cached = await segment_cache.lookup_segment(_jpeg(_garment(BLUE)))
+        assert cached is None
+
+    asyncio.run(run())
+
+
+def test_index_is_rebuilt_from_disk_and_legacy_files_are_dropped():
+    async def run():
+        signature, _ = await segment_cache.lookup_segment(_jpeg(_garment(RED)))
+        await segment_cache.store_segment(signature, b"red cutout")
+        legacy = segment_cache.SEGMENT_CACHE_DIR / "0123456789abcdef.png"
+        legacy.write_bytes(b"legacy")
+
+        segment_cache._index.clear()
+        segment_cache._index_loaded = False
+        segment_cache._total_bytes = 0
+        _, cached = await segment_cache.lookup_segment(_jpeg(_garment(RED)))
+        assert cached == b"red cutout"
+        assert not legacy.exists()
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+"""
+背景移除引擎测试：排队名额在执行器侧的任务结束时才释放
+"""
+import asyncio
+import threading
+import pytest
+from services import local_segment, segment_engine
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def remove_background(image_bytes, session=None, full_resolution=False):
+        started.set()
+        release.wait(5)
+        return b"cutout:" + image_bytes
+
+    monkeypatch.setattr(local_segment, "remove_background", remove_background)
+    monkeypatch.setattr(segment_engine, "SEGMENT_WORKERS", 0)
+    monkeypatch.setattr(segment_engine, "SEGMENT_MAX_QUEUE", 0)
+    monkeypatch.setattr(segment_engine, "_pending", 0)
+    monkeypatch.setattr(segment_engine, "_thread_executor", None)
+    yield started, release
+    release.set()
+
+
+def test_cancelled_request_keeps_slot_until_inference_ends(engine):
+    started, release = engine
+
+    async def main():
+        task = asyncio.ensure_future(segment_engine.submit_remove_background(b"img"))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # 推理仍在执行，新的请求应被拒绝
+        assert segment_engine._pending == 1
+        with pytest.raises(segment_engine.SegmentQueueFullError):
+            await segment_engine.submit_remove_background(b"other")
+        release.set()
+        await segment_engine.stop_segment_engine()
+        return segment_engine._pending
+
+    assert asyncio.run(main()) == 0
+
+
+def test_completed_request_releases_slot(engine):
+    started, release = engine
+    release.set()
+
+    async def main():
+        result = await segment_engine.submit_remove_background(b"img")
+        await segment_engine.stop_segment_engine()
+        return result
+
+    assert asyncio.run(main()) == b"cutout:img"
+    assert segment_engine._pending == 0
+
+
+def test_stop_does_not_block_event_loop(engine):
+    started, release = engine
+
+    async def main():
+        task = asyncio.ensure_future(segment_engine.submit_remove_background(b"img"))
+        await asyncio.to_thread(started.wait, 5)
+        stopping = asyncio.ensure_future(segment_engine.stop_segment_engine())
+        # 关闭等待推理结束期间，事件循环仍能调度其他协程
+        await asyncio.sleep(0.05)
+        assert not stopping.done()
+        release.set()
+        await stopping
+        return await task
+
+    assert asyncio.run(main()) == b"cutout:img"
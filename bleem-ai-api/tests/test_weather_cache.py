@@ -0,0 +1,175 @@
+"""
+实时天气缓存测试：并发合并、旧数据后台刷新、失败缓存、有效期与容量上限
+"""
+import asyncio
+import types
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import pytest
+from services import weather
+from services.weather import WeatherNow, WeatherResponse, get_qweather_now, refresh_qweather_now
+
+NOW = datetime(2026, 10, 18, 8, 0, tzinfo=timezone(timedelta(hours=8)))
+
+
+def _response(obs_time: datetime = NOW, temp: str = "20") -> WeatherResponse:
+    stamp = obs_time.isoformat(timespec="minutes")
+    return WeatherResponse(code="200", updateTime=stamp, fxLink="", now=WeatherNow(
+        obsTime=stamp, temp=temp, feelsLike=temp, icon="100", text="晴", wind360="90", windDir="东风",
+        windScale="2", windSpeed="8", humidity="40", precip="0.0", pressure="1013", vis="20"
+    ))
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """stub 上游请求和时钟；state["responses"] 依次返回，state["calls"] 记录请求的位置"""
+    state = {"now": NOW.timestamp(), "calls": [], "responses": [], "delay": 0.0}
+
+    async def fetch(location):
+        state["calls"].append(location)
+        await asyncio.sleep(state["delay"])
+        response = state["responses"].pop(0) if state["responses"] else _response()
+        return response
+
+    monkeypatch.setattr(weather, "_fetch_qweather_now", fetch)
+    monkeypatch.setattr(weather, "time", types.SimpleNamespace(time=lambda: state["now"]))
+    monkeypatch.setattr(weather, "_weather_cache", OrderedDict())
+    monkeypatch.setattr(weather, "_weather_failures", {})
+    monkeypatch.setattr(weather, "_weather_inflight", {})
+    monkeypatch.setattr(weather, "_weather_stats", dict.fromkeys(weather._weather_stats, 0))
+    monkeypatch.setattr(weather, "WEATHER_CACHE_INTERVAL", 600)
+    monkeypatch.setattr(weather, "WEATHER_CACHE_MIN_TTL", 60)
+    monkeypatch.setattr(weather, "WEATHER_CACHE_MAX_TTL", 1800)
+    monkeypatch.setattr(weather, "WEATHER_CACHE_STALE", 3600)
+    monkeypatch.setattr(weather, "WEATHER_CACHE_ERROR_TTL", 30)
+    return state
+
+
+def test_concurrent_misses_share_one_fetch(upstream):
+    upstream["delay"] = 0.02
+
+    async def main():
+        return await asyncio.gather(*(get_qweather_now("101010100") for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert upstream["calls"] == ["101010100"]
+    assert all(result is results[0] for result in results)
+    assert weather._weather_stats["coalesced"] == 4
+
+
+def test_fresh_entry_is_served_from_cache(upstream):
+    async def main():
+        await get_qweather_now("101010100")
+        upstream["now"] += 300
+        return await get_qweather_now("101010100")
+
+    assert asyncio.run(main()).now.temp == "20"
+    assert len(upstream["calls"]) == 1
+    assert weather._weather_stats["hits"] == 1
+
+
+def test_stale_hit_returns_immediately_and_refreshes_in_background(upstream):
+    upstream["responses"] = [_response(temp="20"), _response(NOW + timedelta(minutes=20), temp="15")]
+    upstream["delay"] = 0.01
+
+    async def main():
+        await get_qweather_now("101010100")
+        # 过期（obsTime + 600 秒）但仍在可返回旧数据的时间内
+        upstream["now"] += 900
+        stale = await get_qweather_now("101010100")
+        # 返回旧数据时刷新已在后台开始，不等待上游
+        refreshing = "101010100" in weather._weather_inflight
+        await asyncio.sleep(0.05)
+        return stale, refreshing, await get_qweather_now("101010100")
+
+    stale, refreshing, refreshed = asyncio.run(main())
+    assert stale.now.temp == "20"
+    assert refreshing
+    assert len(upstream["calls"]) == 2
+    assert refreshed.now.temp == "15"
+    assert weather._weather_stats["stale_hits"] == 1
+    assert weather._weather_stats["background_refreshes"] == 1
+
+
+def test_entry_past_stale_window_is_refetched(upstream):
+    async def main():
+        await get_qweather_now("101010100")
+        upstream["now"] += 600 + 3600 + 1
+        return await get_qweather_now("101010100")
+
+    asyncio.run(main())
+    assert len(upstream["calls"]) == 2
+    assert weather._weather_stats["misses"] == 2
+
+
+def test_failure_is_cached_for_error_ttl(upstream):
+    upstream["responses"] = [None]
+
+    async def main():
+        first = await get_qweather_now("101010100")
+        upstream["now"] += 29
+        during = await get_qweather_now("101010100")
+        during_refresh = await refresh_qweather_now("101010100")
+        upstream["now"] += 2
+        after = await get_qweather_now("101010100")
+        return first, during, during_refresh, after
+
+    first, during, during_refresh, after = asyncio.run(main())
+    assert first is None and during is None
+    assert during_refresh is False
+    assert after is not None
+    assert len(upstream["calls"]) == 2
+    assert weather._weather_stats["errors"] == 1
+
+
+def test_coordinates_are_rounded_into_the_key(upstream):
+    async def main():
+        await get_qweather_now("116.4074,39.9042")
+        await get_qweather_now(" 116.41,39.90 ")
+        await get_qweather_now("116.404,39.901")
+
+    asyncio.run(main())
+    assert upstream["calls"] == ["116.41,39.90", "116.40,39.90"]
+    assert weather._normalize_location("101010100") == "101010100"
+    assert weather._normalize_location("abc,def") == "abc,def"
+
+
+@pytest.mark.parametrize("obs_offset, expected_ttl", [
+    (timedelta(0), 600),
+    # 观测时间较早，下一次更新很快到来，至少缓存 MIN_TTL
+    (timedelta(minutes=-9, seconds=-50), 60),
+    # 观测时间在未来（时钟偏差），最多缓存 MAX_TTL
+    (timedelta(hours=2), 1800),
+])
+def test_ttl_follows_obs_time_within_bounds(upstream, obs_offset, expected_ttl):
+    upstream["responses"] = [_response(NOW + obs_offset)]
+    asyncio.run(get_qweather_now("101010100"))
+    expires_at, stale_until, _ = weather._weather_cache["101010100"]
+    assert expires_at - upstream["now"] == pytest.approx(expected_ttl)
+    assert stale_until - expires_at == 3600
+
+
+def test_cache_evicts_least_recently_used(upstream, monkeypatch):
+    monkeypatch.setattr(weather, "WEATHER_CACHE_MAX_ENTRIES", 2)
+
+    async def main():
+        await get_qweather_now("a")
+        await get_qweather_now("b")
+        # 访问 a 后 b 成为最久未使用
+        await get_qweather_now("a")
+        await get_qweather_now("c")
+
+    asyncio.run(main())
+    assert list(weather._weather_cache) == ["a", "c"]
+
+
+def test_refresh_skips_fresh_entries(upstream):
+    async def main():
+        first = await refresh_qweather_now("101010100")
+        second = await refresh_qweather_now("101010100")
+        upstream["now"] += 601
+        third = await refresh_qweather_now("101010100")
+        return first, second, third
+
+    assert asyncio.run(main()) == (True, None, True)
+    assert len(upstream["calls"]) == 2
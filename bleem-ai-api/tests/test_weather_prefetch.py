@@ -0,0 +1,146 @@
+"""
+天气预取测试：下一次执行时间、按速率限速、跳过仍有效的缓存和失败冷却中的位置
+"""
+import asyncio
+import types
+from collections import OrderedDict
+from datetime import datetime
+import pytest
+from services import weather, weather_prefetch
+from services.weather_prefetch import _next_run, _parse_times
+
+TIMES = [(6, 45), (7, 45)]
+
+
+def test_parse_times_sorts_and_skips_invalid_items():
+    assert _parse_times("07:45, 06:45,bad,25:00,6:60,") == TIMES
+    assert _parse_times("") == []
+
+
+@pytest.mark.parametrize("now, expected", [
+    (datetime(2026, 10, 18, 5, 0), datetime(2026, 10, 18, 6, 45)),
+    (datetime(2026, 10, 18, 6, 45), datetime(2026, 10, 18, 7, 45)),
+    (datetime(2026, 10, 18, 7, 0), datetime(2026, 10, 18, 7, 45)),
+    (datetime(2026, 10, 18, 23, 59), datetime(2026, 10, 19, 6, 45)),
+    (datetime(2026, 12, 31, 8, 0), datetime(2027, 1, 1, 6, 45)),
+])
+def test_next_run(now, expected):
+    assert _next_run(now, TIMES) == expected
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """stub 单调时钟和 asyncio.sleep：sleep 只推进时钟并记录时长"""
+    state = {"now": 1000.0, "sleeps": []}
+
+    async def sleep(seconds):
+        state["sleeps"].append(round(seconds, 6))
+        state["now"] += seconds
+
+    monkeypatch.setattr(weather_prefetch, "time", types.SimpleNamespace(monotonic=lambda: state["now"]))
+    monkeypatch.setattr(weather_prefetch.asyncio, "sleep", sleep)
+    monkeypatch.setattr(weather_prefetch, "_stats", dict(weather_prefetch._stats, runs=0, refreshed=0, skipped=0, failed=0))
+    return state
+
+
+def _locations(monkeypatch, locations):
+    async def get_active_user_locations(days, limit):
+        return locations[:limit]
+
+    monkeypatch.setattr(weather_prefetch, "get_active_user_locations", get_active_user_locations)
+
+
+def test_requests_are_paced_to_rate(clock, monkeypatch):
+    _locations(monkeypatch, ["a", "b", "fresh", "c"])
+    outcomes = {"a": True, "b": False, "fresh": None, "c": True}
+
+    async def refresh(location):
+        # 每次上游请求耗时 0.05 秒
+        clock["now"] += 0.05
+        return outcomes[location]
+
+    monkeypatch.setattr(weather_prefetch, "refresh_qweather_now", refresh)
+    monkeypatch.setattr(weather_prefetch, "WEATHER_PREFETCH_RATE", 5.0)
+    result = asyncio.run(weather_prefetch.prefetch_weather())
+
+    assert result == {"refreshed": 2, "skipped": 1, "failed": 1}
+    # 间隔 0.2 秒减去请求本身的耗时；跳过的位置不等待
+    assert clock["sleeps"] == [0.15, 0.15, 0.15]
+    assert weather_prefetch._stats["last_run_locations"] == 4
+    assert weather_prefetch._stats["runs"] == 1
+
+
+def test_slow_requests_and_zero_rate_do_not_wait(clock, monkeypatch):
+    _locations(monkeypatch, ["a", "b"])
+
+    async def refresh(location):
+        clock["now"] += 1.0
+        return True
+
+    monkeypatch.setattr(weather_prefetch, "refresh_qweather_now", refresh)
+    monkeypatch.setattr(weather_prefetch, "WEATHER_PREFETCH_RATE", 5.0)
+    asyncio.run(weather_prefetch.prefetch_weather())
+    monkeypatch.setattr(weather_prefetch, "WEATHER_PREFETCH_RATE", 0.0)
+    asyncio.run(weather_prefetch.prefetch_weather())
+    assert clock["sleeps"] == [0.0] * 4
+
+
+def test_max_locations_limits_the_run(clock, monkeypatch):
+    _locations(monkeypatch, [str(i) for i in range(10)])
+    requested = []
+
+    async def refresh(location):
+        requested.append(location)
+        return True
+
+    monkeypatch.setattr(weather_prefetch, "refresh_qweather_now", refresh)
+    monkeypatch.setattr(weather_prefetch, "WEATHER_PREFETCH_MAX_LOCATIONS", 3)
+    asyncio.run(weather_prefetch.prefetch_weather())
+    assert requested == ["0", "1", "2"]
+
+
+def test_fresh_and_backoff_locations_skip_the_upstream(clock, monkeypatch):
+    """通过真实的 refresh_qweather_now：缓存有效的位置跳过，失败冷却中的位置不请求上游"""
+    _locations(monkeypatch, ["fresh", "cooling", "new"])
+    now = 2_000_000_000.0
+    fetched = []
+
+    async def fetch(location):
+        fetched.append(location)
+        return types.SimpleNamespace(now=types.SimpleNamespace(obsTime=""), updateTime="")
+
+    monkeypatch.setattr(weather, "_fetch_qweather_now", fetch)
+    monkeypatch.setattr(weather, "time", types.SimpleNamespace(time=lambda: now))
+    monkeypatch.setattr(weather, "_weather_cache", OrderedDict(fresh=(now + 300, now + 3900, object())))
+    monkeypatch.setattr(weather, "_weather_failures", {"cooling": now + 10})
+    monkeypatch.setattr(weather, "_weather_inflight", {})
+    monkeypatch.setattr(weather, "_weather_stats", dict.fromkeys(weather._weather_stats, 0))
+
+    result = asyncio.run(weather_prefetch.prefetch_weather())
+    assert result == {"refreshed": 1, "skipped": 1, "failed": 1}
+    assert fetched == ["new"]
+
+
+def test_loop_sleeps_until_next_run_then_prefetches(clock, monkeypatch):
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2026, 10, 18, 6, 30)
+
+    runs = []
+
+    async def prefetch():
+        runs.append(1)
+        if len(runs) == 2:
+            raise asyncio.CancelledError
+        raise RuntimeError("数据库不可用")
+
+    monkeypatch.setattr(weather_prefetch, "datetime", FixedDatetime)
+    monkeypatch.setattr(weather_prefetch, "prefetch_weather", prefetch)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(weather_prefetch._prefetch_loop(TIMES))
+
+    # 06:30 到 06:45 共 900 秒；预取失败后继续等待下一次
+    assert clock["sleeps"] == [900.0, 900.0]
+    assert len(runs) == 2
+    assert weather_prefetch._stats["next_run_at"] == "2026-10-18T06:45:00"